@@ -2,83 +2,780 @@
 OpenRouter AI Integration Module
 Supports free tier models via OpenRouter
 """
+import asyncio
+import hashlib
+import json
 import os
-from openai import OpenAI
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+import httpx
+from openai import (AsyncOpenAI, DefaultAsyncHttpxClient, RateLimitError,
+                    APIConnectionError, InternalServerError)
 from dotenv import load_dotenv
+from ai_router import ModelRouter, ModelsUnavailable
+from ai_scheduler import AIScheduler, QueueTimeout
+from eventlog import log_error, log_event
+from metrics import (AI_FIRST_TOKEN_SECONDS, AI_QUEUE_SECONDS, AI_REQUEST_SECONDS, AI_REQUESTS, AI_RETRIES,
+                     AI_TOKENS, REGISTRY, error as count_error)
 
 load_dotenv()
 
+SYSTEM_PROMPT = """You are a helpful AI assistant running on a retro 90s BBS (Bulletin Board System). 
+Keep your responses conversational and friendly. You can use some retro internet slang and emoticons if appropriate. 
+Keep responses concise but informative - remember, this is a text-based terminal interface!
+You support multiple languages including English, Russian (Cyrillic), and others. 
+Respond in the same language the user writes to you."""
+
+SUMMARY_PROMPT = """Summarize the conversation below for your own memory in at most five sentences.
+Keep names, facts, the user's preferences and open questions. Write it in the language the user writes in."""
+
+BUSY_MESSAGE = "The AI is busy with other callers right now - please try again in a moment."
+
+UNAVAILABLE_MESSAGE = "The AI is down right now - please try again in a minute."
+
+# Provider errors worth retrying (and failing over to another model for)
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+# Tokens reserved for the reply (max_tokens of every chat request)
+MAX_REPLY_TOKENS = 500
+
+# Context windows of the free models we suggest; others get the default
+MODEL_CONTEXT_TOKENS = {
+    'google/gemma-2-9b-it:free': 8192,
+    'meta-llama/llama-3.2-3b-instruct:free': 131072,
+    'microsoft/phi-3-mini-128k-instruct:free': 128000,
+}
+DEFAULT_CONTEXT_TOKENS = 8192
+
+# History is capped well below long context windows to keep per-turn cost flat
+HISTORY_TOKENS = int(os.getenv('AI_HISTORY_TOKENS', 3000))
+
+
+def estimate_tokens(text):
+    """Rough token count without a tokenizer
+
+    About four ASCII characters per token for English; Cyrillic and other
+    non-ASCII text splits into far more tokens per character.
+    """
+    ascii_chars = sum(1 for ch in text if ch < '\x80')
+    other_chars = len(text) - ascii_chars
+    return (ascii_chars + 3) // 4 + (other_chars * 2 + 2) // 3
+
+
+def message_tokens(message):
+    """Estimated tokens for one chat message, including role framing"""
+    return estimate_tokens(message["content"]) + 4
+
+
+def history_budget(model, system_prompt=SYSTEM_PROMPT):
+    """Tokens of conversation history a request to ``model`` may carry"""
+    context = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+    available = context - MAX_REPLY_TOKENS - estimate_tokens(system_prompt) - 64
+    return max(256, min(HISTORY_TOKENS, available))
+
+
+class ConversationContext:
+    """Token-budgeted conversation history with a rolling summary
+
+    The most recent turns are kept verbatim as long as they fit the budget
+    together with the summary; older turns move to ``pending`` until the
+    session folds them into the summary in the background. At least
+    ``keep_messages`` recent messages are always kept.
+    """
+
+    def __init__(self, budget, keep_messages=2):
+        self.budget = budget
+        self.keep_messages = keep_messages
+        self.turns = []
+        self.summary = ""
+        self.pending = []
+        self.generation = 0  # bumped on clear so stale summaries are discarded
+        self._turn_tokens = 0
+
+    def append(self, message):
+        """Add a message and evict the oldest turns that no longer fit"""
+        self.turns.append(message)
+        self._turn_tokens += message_tokens(message)
+        summary_tokens = estimate_tokens(self.summary)
+        while len(self.turns) > self.keep_messages and self._turn_tokens + summary_tokens > self.budget:
+            old = self.turns.pop(0)
+            self._turn_tokens -= message_tokens(old)
+            self.pending.append(old)
+
+    def messages(self, system_prompt):
+        """Messages for the next request: system prompt, summary, recent turns"""
+        messages = [{"role": "system", "content": system_prompt}]
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+        return messages + self.turns
+
+    def take_pending(self):
+        """Hand over the evicted turns for summarization"""
+        pending, self.pending = self.pending, []
+        return pending
+
+    def clear(self):
+        self.turns = []
+        self.summary = ""
+        self.pending = []
+        self._turn_tokens = 0
+        self.generation += 1
+
+
+def fallback_summary(summary, turns, budget):
+    """Extractive summary used when the model could not summarize"""
+    lines = [summary] if summary else []
+    for message in turns:
+        lines.append(f"{message['role']}: {message['content'][:120]}")
+    text = "\n".join(lines)
+    while estimate_tokens(text) > budget and "\n" in text:
+        text = text.split("\n", 1)[1]
+    return text
+
+
+def normalize_content(text):
+    """Canonical form of a user message for cache keys
+
+    Case, surrounding whitespace, repeated spaces and trailing punctuation do
+    not change what "Hi!" and "hi" are asking.
+    """
+    return " ".join(text.split()).casefold().rstrip(".!?…")
+
+
+class ResponseCache:
+    """LRU + TTL cache of AI completions with an optional SQLite tier on disk
+
+    Entries remember how long the original request took, so a hit can report
+    the latency it saved. The disk tier (a file under data/) survives
+    restarts; it is read on a memory miss and filled on every store.
+    """
+
+    def __init__(self, max_entries, ttl, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires, response, latency)
+        self.db = None
+        self._db_lock = threading.Lock()
+        self._puts = 0
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS responses ("
+                            "key TEXT PRIMARY KEY, response TEXT, latency REAL, expires REAL)")
+            self.db.commit()
+
+        # Counters
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.latency_saved = 0.0
+
+    @classmethod
+    def from_env(cls):
+        size = int(os.getenv('AI_CACHE_SIZE', 1000))
+        if size <= 0:
+            return None
+        return cls(size, float(os.getenv('AI_CACHE_TTL', 3600)), os.getenv('AI_CACHE_PATH') or None)
+
+    async def get(self, key):
+        """Cached response for a key, or None"""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.latency_saved += entry[2]
+                return entry[1]
+            del self._entries[key]
+        if self.db is not None:
+            row = await asyncio.to_thread(self._disk_get, key, now)
+            if row is not None:
+                self._remember(key, row)
+                self.hits += 1
+                self.disk_hits += 1
+                self.latency_saved += row[2]
+                return row[1]
+        self.misses += 1
+        return None
+
+    async def put(self, key, response, latency):
+        """Store a response and the time it took to produce"""
+        entry = (time.time() + self.ttl, response, latency)
+        self._remember(key, entry)
+        if self.db is not None:
+            await asyncio.to_thread(self._disk_put, key, entry)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'bypassed': self.bypassed,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'latency_saved': self.latency_saved,
+        }
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_get(self, key, now):
+        with self._db_lock:
+            row = self.db.execute("SELECT expires, response, latency FROM responses WHERE key = ?",
+                                  (key,)).fetchone()
+        if row is None or row[0] <= now:
+            return None
+        return row
+
+    def _disk_put(self, key, entry):
+        expires, response, latency = entry
+        with self._db_lock:
+            self.db.execute("INSERT OR REPLACE INTO responses (key, response, latency, expires) "
+                            "VALUES (?, ?, ?, ?)", (key, response, latency, expires))
+            self._puts += 1
+            if self._puts % 100 == 0:
+                # Drop expired rows and keep the file at ten times the memory tier
+                self.db.execute("DELETE FROM responses WHERE expires <= ?", (time.time(),))
+                self.db.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                                "ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self.max_entries * 10,))
+            self.db.commit()
+
 
 class AIClient:
+    """Process-wide OpenRouter client shared by every session
+
+    Holds the one ``AsyncOpenAI`` instance and its keep-alive HTTP connection
+    pool, so callers reuse warm TCP+TLS connections instead of each paying a
+    fresh handshake. Conversation state lives in ``ChatSession``.
+    """
+
     def __init__(self):
         api_key = os.getenv('OPENROUTER_API_KEY')
         if not api_key:
             raise ValueError("OPENROUTER_API_KEY not found in environment variables")
-        
-        # OpenRouter uses OpenAI-compatible API
-        self.client = OpenAI(
+
+        self.max_connections = int(os.getenv('AI_MAX_CONNECTIONS', 20))
+        self.http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+                keepalive_expiry=float(os.getenv('AI_KEEPALIVE_SECONDS', 60)),
+            )
+        )
+
+        # OpenRouter uses OpenAI-compatible API (AI_BASE_URL points elsewhere,
+        # e.g. at mock_openrouter.py for load tests)
+        # Retries are done in create() so they back off under the scheduler
+        self.base_url = os.getenv('AI_BASE_URL', "https://openrouter.ai/api/v1")
+        self.client = AsyncOpenAI(
             api_key=api_key,
-            base_url="https://openrouter.ai/api/v1"
+            base_url=self.base_url,
+            http_client=self.http_client,
+            max_retries=0
         )
-        self.conversation_history = []
-        
+        self.max_retries = int(os.getenv('AI_MAX_RETRIES', 3))
+        self.retry_base = float(os.getenv('AI_RETRY_BASE', 1.0))
+
+        # Every request takes a slot from here
+        self.scheduler = AIScheduler()
+        REGISTRY.collector(self.scheduler.metrics)
+
         # Use a free model from OpenRouter
         # Options: google/gemma-2-9b-it:free, meta-llama/llama-3.2-3b-instruct:free, etc.
         self.model = os.getenv('AI_MODEL', 'google/gemma-2-9b-it:free')
-        
-        self.system_prompt = """You are a helpful AI assistant running on a retro 90s BBS (Bulletin Board System). 
-Keep your responses conversational and friendly. You can use some retro internet slang and emoticons if appropriate. 
-Keep responses concise but informative - remember, this is a text-based terminal interface!
-You support multiple languages including English, Russian (Cyrillic), and others. 
-Respond in the same language the user writes to you."""
-    
-    def chat(self, user_message):
+        # AI_MODELS lists candidates to route between (AI_MODEL alone if unset); the first keys the cache
+        self.models = [m.strip() for m in os.getenv('AI_MODELS', '').split(',') if m.strip()] or [self.model]
+        self.model = self.models[0]
+        self.router = ModelRouter(self.models, RETRYABLE_ERRORS)
+        REGISTRY.collector(self.router.metrics)
+        # History must fit the smallest context window among them
+        self.context_model = min(self.models, key=lambda m: MODEL_CONTEXT_TOKENS.get(m, DEFAULT_CONTEXT_TOKENS))
+        self.temperature = float(os.getenv('AI_TEMPERATURE', 0.7))
+
+        # Shared reply cache (None when AI_CACHE_SIZE=0)
+        self.cache = ResponseCache.from_env()
+        self.cache_max_prompt_chars = int(os.getenv('AI_CACHE_MAX_PROMPT_CHARS', 200))
+
+    async def warm_up(self, connections=None):
+        """Open pooled connections ahead of the first caller
+
+        Each probe is a HEAD request against the API base URL: the response
+        does not matter, only the TCP+TLS connection it leaves in the pool.
+        """
+        if connections is None:
+            connections = int(os.getenv('AI_PREWARM_CONNECTIONS', 2))
+        connections = min(connections, self.max_connections)
+        if connections <= 0:
+            return 0
+        results = await asyncio.gather(
+            *[self.http_client.head(self.base_url) for _ in range(connections)],
+            return_exceptions=True)
+        return sum(1 for r in results if not isinstance(r, Exception))
+
+    def new_session(self, handle="Guest"):
+        """Create conversation state for one caller"""
+        return ChatSession(self, handle)
+
+    async def resume_session(self, handle):
+        """A session that carries on the saved conversation of ``handle``
+
+        Callers who kept the default Guest handle start fresh every time.
+        """
+        from conversations import get_conversations
+        log = get_conversations()
+        if log is None or handle == "Guest":
+            return self.new_session(handle)
+        budget = history_budget(self.context_model, SYSTEM_PROMPT)
+        return ChatSession(self, handle, await log.load(handle, budget), log)
+
+    async def create(self, messages, stream=False, hedge=False, **overrides):
+        """Send a completion request to the best model; returns (model, response, hedged)
+
+        With ``hedge`` a slow first token brings in a second model (see
+        ai_router.py). A stream is returned once its first token arrived,
+        as a StreamReply. Failed requests fail over to the other models,
+        then back off and start over.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.router.race(
+                    lambda model: self._request(model, messages, stream, overrides),
+                    hedge=hedge, discard=self._discard if stream else None, first_token=stream)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                AI_RETRIES.inc()
+                await asyncio.sleep(self._retry_delay(e, attempt))
+
+    async def _request(self, model, messages, stream, overrides):
+        """One request to one model; a stream is read up to its first token"""
+        params = dict(
+            model=model,
+            messages=messages,
+            temperature=self.temperature,
+            max_tokens=MAX_REPLY_TOKENS,
+            stream=stream,
+            # OpenRouter-specific headers
+            extra_headers={
+                "HTTP-Referer": "https://github.com/yourusername/aibbs",
+                "X-Title": "AI BBS"
+            }
+        )
+        if stream:
+            # Final chunk carries the token usage
+            params["stream_options"] = {"include_usage": True}
+        params.update(overrides)
+        response = await self.client.chat.completions.create(**params)
+        if not stream:
+            return response
+        chunks = []
+        try:
+            while True:
+                try:
+                    chunk = await response.__anext__()
+                except StopAsyncIteration:
+                    break
+                chunks.append(chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    break
+        except BaseException:
+            await response.close()  # cancelled by a faster model, or failed
+            raise
+        return StreamReply(response, chunks, lambda: self.router.failed(model))
+
+    @staticmethod
+    async def _discard(reply):
+        await reply.close()
+
+    def _retry_delay(self, error, attempt):
+        """Backoff before retrying: the server's Retry-After, else jittered exponential"""
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                return min(30.0, float(response.headers.get("retry-after")))
+            except (TypeError, ValueError):
+                pass
+        return min(30.0, self.retry_base * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    def cache_key(self, messages):
+        """Cache key for a chat request, or None when it must bypass the cache
+
+        At temperature 0 any request is cacheable. Sampled replies are only
+        reused for openers: the system prompt plus a single short user turn,
+        where a canned answer is as good as a fresh one.
+        """
+        if self.cache is None:
+            return None
+        if self.temperature > 0:
+            if len(messages) != 2 or messages[0]["role"] != "system":
+                return None
+            if len(messages[1]["content"]) > self.cache_max_prompt_chars:
+                return None
+        normalized = [
+            (m["role"], normalize_content(m["content"]) if m["role"] == "user" else m["content"])
+            for m in messages
+        ]
+        raw = json.dumps([self.model, self.temperature, MAX_REPLY_TOKENS, normalized], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def summarize(self, summary, turns):
+        """Fold conversation turns into a running summary"""
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in turns)
+        if summary:
+            transcript = f"Summary so far: {summary}\n\n{transcript}"
+        _, response, _ = await self.create(
+            [{"role": "system", "content": SUMMARY_PROMPT},
+             {"role": "user", "content": transcript}],
+            temperature=0.3, max_tokens=200)
+        return (response.choices[0].message.content or "").strip()
+
+    def get_model_name(self):
+        """The model the next request would go to"""
+        return self.router.best()
+
+    async def close(self):
+        """Close the pooled connections"""
+        await self.client.close()
+
+
+_shared_client = None
+
+
+def get_client():
+    """Return the process-wide AIClient, creating it on first use"""
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = AIClient()
+    return _shared_client
+
+
+class StreamReply:
+    """A streamed reply whose first chunks were read while models raced
+
+    Iterating yields those chunks, then the rest of the stream. An error
+    mid-stream counts against the model that was answering.
+    """
+
+    def __init__(self, stream, chunks, on_error):
+        self.stream = stream
+        self.chunks = chunks
+        self.on_error = on_error
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+        try:
+            async for chunk in self.stream:
+                yield chunk
+        except RETRYABLE_ERRORS:
+            self.on_error()
+            raise
+
+    async def close(self):
+        await self.stream.close()
+
+
+class ChatSession:
+    """Per-caller conversation state on top of the shared AIClient"""
+
+    def __init__(self, client, handle="Guest", context=None, log=None):
+        self.client = client
+        self.handle = handle
+        self.ticket = None
+        self.system_prompt = SYSTEM_PROMPT
+        self.context = context or ConversationContext(history_budget(client.context_model, self.system_prompt))
+        self.log = log  # ConversationLog the turns are saved to, if any
+        self.trace = None  # SessionTrace of the caller's session while the sysop traces it
+        self.session = None  # id of the caller's session, for the event log
+        self.model = None  # model that answered the last request
+        self.hedged = False  # whether that request was raced against a second model
+        self._summary_task = None
+
+        # Prompt size per request: local estimate, and what the API reported
+        self.prompt_tokens = deque(maxlen=100)
+        self.last_usage = None
+
+    @property
+    def conversation_history(self):
+        """Turns currently kept verbatim"""
+        return self.context.turns
+
+    def _record(self, op, **fields):
+        if self.log is not None:
+            self.log.record(self.handle, op, **fields)
+
+    def _messages(self, user_message):
+        """Add the user turn to history and return the messages to send"""
+        # Add user message to history
+        self.context.append({
+            "role": "user",
+            "content": user_message
+        })
+        self._record('turn', role="user", content=user_message)
+
+        # Prepare messages with system prompt and summary
+        messages = self.context.messages(self.system_prompt)
+        self.prompt_tokens.append(sum(message_tokens(m) for m in messages))
+        return messages
+
+    @asynccontextmanager
+    async def _slot(self, background=False):
+        """Wait in the scheduler queue, then hold a request slot"""
+        scheduler = self.client.scheduler
+        trace = None if background else self.trace
+        span = trace.begin('ai.queue') if trace else None
+        queued = time.monotonic()
+        ticket = scheduler.enqueue(self.caller(), background)
+        if not background:
+            self.ticket = ticket
+        try:
+            await scheduler.wait(ticket)
+        finally:
+            if not background:
+                self.ticket = None  # A summary must not hide the caller's own place in line
+            if span is not None:
+                trace.end(span)
+        AI_QUEUE_SECONDS.labels('summary' if background else 'chat').observe(time.monotonic() - queued)
+        try:
+            yield
+        finally:
+            scheduler.release()
+
+    def caller(self):
+        """Who this session queues as: its handle, or just itself while it is an anonymous Guest"""
+        if self.handle == "Guest":
+            return ("Guest", self.session if self.session is not None else id(self))
+        return self.handle
+
+    def queue_position(self):
+        """Place in the AI queue while this session's request waits, else None"""
+        if self.ticket is None:
+            return None
+        return self.client.scheduler.position(self.ticket)
+
+    def _count_tokens(self, reply):
+        """Token metrics for a finished reply: the API's usage figures, else estimates"""
+        usage = self.last_usage
+        prompt = getattr(usage, 'prompt_tokens', None)
+        completion = getattr(usage, 'completion_tokens', None)
+        AI_TOKENS.labels('prompt').inc(prompt if prompt is not None else self.prompt_tokens[-1])
+        AI_TOKENS.labels('completion').inc(completion if completion is not None else estimate_tokens(reply or ""))
+
+    def _add_reply(self, assistant_message):
+        """Add the assistant response to history and summarize what fell out"""
+        self.context.append({
+            "role": "assistant",
+            "content": assistant_message
+        })
+        self._record('turn', role="assistant", content=assistant_message)
+        if self.context.pending and self._summary_task is None:
+            self._summary_task = asyncio.get_running_loop().create_task(self._summarize())
+
+    async def _summarize(self):
+        """Background task: fold evicted turns into the rolling summary"""
+        try:
+            while self.context.pending:
+                generation = self.context.generation
+                previous = self.context.summary
+                turns = self.context.take_pending()
+                try:
+                    async with self._slot(background=True):
+                        started = time.monotonic()
+                        summary = await self.client.summarize(previous, turns)
+                        AI_REQUEST_SECONDS.labels('summary').observe(time.monotonic() - started)
+                except Exception as e:
+                    count_error('ai_summary', e)
+                    log_error('ai_summary', e, self.session)
+                    summary = ""
+                if not summary:
+                    summary = fallback_summary(previous, turns, self.context.budget // 4)
+                if generation == self.context.generation:
+                    self.context.summary = summary
+                    self._record('summary', summary=summary, folded=len(turns))
+        finally:
+            self._summary_task = None
+
+    async def _cached(self, messages):
+        """Cache lookup for a request: returns (key, cached response or None)"""
+        key = self.client.cache_key(messages)
+        if key is None:
+            if self.client.cache is not None:
+                self.client.cache.bypassed += 1
+            return None, None
+        return key, await self.client.cache.get(key)
+
+    def _audit(self, user_message, reply, outcome, started):
+        """One ai.turn record in the event log"""
+        answered = outcome == 'ok'
+        log_event('ai.turn', self.session, handle=self.handle, outcome=outcome,
+                  model=self.model if answered else None, hedged=self.hedged and answered,
+                  prompt_chars=len(user_message), reply_chars=len(reply or ""),
+                  prompt_tokens=self.prompt_tokens[-1] if self.prompt_tokens else None,
+                  reply_tokens=getattr(self.last_usage, 'completion_tokens', None) if answered else None,
+                  ms=round((time.monotonic() - started) * 1000, 1))
+
+    async def chat(self, user_message):
         """Send a message to AI and get a response"""
+        submitted = time.monotonic()
+        trace = self.trace
+        span = trace.begin('ai.chat', chars=len(user_message)) if trace else None
         try:
-            # Add user message to history
-            self.conversation_history.append({
-                "role": "user",
-                "content": user_message
-            })
-            
-            # Prepare messages with system prompt
-            messages = [{"role": "system", "content": self.system_prompt}] + self.conversation_history
-            
-            # Get response from OpenRouter
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=500,
-                # OpenRouter-specific headers
-                extra_headers={
-                    "HTTP-Referer": "https://github.com/yourusername/aibbs",
-                    "X-Title": "AI BBS"
-                }
-            )
-            
-            assistant_message = response.choices[0].message.content
-            
+            messages = self._messages(user_message)
+            key, assistant_message = await self._cached(messages)
+            cached = assistant_message is not None
+            if not cached:
+                # Get response from OpenRouter
+                async with self._slot():
+                    started = time.monotonic()
+                    self.model, response, self.hedged = await self.client.create(messages, hedge=True)
+                    latency = time.monotonic() - started
+                self.last_usage = response.usage
+                AI_FIRST_TOKEN_SECONDS.observe(latency)
+                AI_REQUEST_SECONDS.labels('chat').observe(latency)
+
+                assistant_message = response.choices[0].message.content
+                self._count_tokens(assistant_message)
+                AI_REQUESTS.labels('ok').inc()
+                if key is not None and assistant_message:
+                    await self.client.cache.put(key, assistant_message, latency)
+            else:
+                AI_REQUESTS.labels('cached').inc()
+
             # Add assistant response to history
-            self.conversation_history.append({
-                "role": "assistant",
-                "content": assistant_message
-            })
-            
+            self._add_reply(assistant_message)
+
+            if span is not None:
+                trace.end(span, reply_chars=len(assistant_message or ""), cached=cached, model=self.model,
+                          hedged=self.hedged)
+            self._audit(user_message, assistant_message, 'cached' if cached else 'ok', submitted)
             return assistant_message
-            
+
+        except QueueTimeout:
+            AI_REQUESTS.labels('busy').inc()
+            if span is not None:
+                trace.end(span, outcome='busy')
+            self._audit(user_message, None, 'busy', submitted)
+            return BUSY_MESSAGE
+        except ModelsUnavailable:
+            AI_REQUESTS.labels('unavailable').inc()
+            if span is not None:
+                trace.end(span, outcome='unavailable')
+            self._audit(user_message, None, 'unavailable', submitted)
+            return UNAVAILABLE_MESSAGE
         except Exception as e:
+            AI_REQUESTS.labels('error').inc()
+            count_error('ai', e)
+            log_error('ai', e, self.session)
+            if span is not None:
+                trace.end(span, outcome='error', error=str(e))
+            self._audit(user_message, None, 'error', submitted)
             return f"Error communicating with AI: {str(e)}"
-    
+
+    async def stream_chat(self, user_message):
+        """Send a message to AI and yield the response text as it arrives
+
+        The full reply is added to the conversation history once the stream
+        ends (a reply cut short by an error, or by the caller hanging up and
+        closing the stream, keeps the part that arrived).
+        """
+        parts = []
+        submitted = time.monotonic()
+        trace = self.trace
+        span = trace.begin('ai.stream', chars=len(user_message)) if trace else None
+        outcome = 'disconnected'  # Until the stream runs to its end
+        try:
+            messages = self._messages(user_message)
+            key, cached = await self._cached(messages)
+            if cached is not None:
+                AI_REQUESTS.labels('cached').inc()
+                parts.append(cached)
+                yield cached
+                outcome = 'cached'
+            else:
+                async with self._slot():
+                    started = time.monotonic()
+                    self.last_usage = None
+                    self.model, stream, self.hedged = await self.client.create(messages, stream=True, hedge=True)
+                    try:
+                        async for chunk in stream:
+                            if getattr(chunk, "usage", None):
+                                self.last_usage = chunk.usage
+                            if not chunk.choices:
+                                continue
+                            delta = chunk.choices[0].delta.content
+                            if delta:
+                                if not parts:
+                                    first_token = time.monotonic() - started
+                                    AI_FIRST_TOKEN_SECONDS.observe(first_token)
+                                    if span is not None:
+                                        span['first_token_ms'] = round(first_token * 1000, 1)
+                                parts.append(delta)
+                                yield delta
+                    finally:
+                        await stream.close()
+                    latency = time.monotonic() - started
+                AI_REQUEST_SECONDS.labels('stream').observe(latency)
+                self._count_tokens("".join(parts))
+                AI_REQUESTS.labels('ok').inc()
+                if key is not None and parts:
+                    await self.client.cache.put(key, "".join(parts), latency)
+                outcome = 'ok'
+        except QueueTimeout:
+            outcome = 'busy'
+            AI_REQUESTS.labels('busy').inc()
+            yield BUSY_MESSAGE
+        except ModelsUnavailable:
+            outcome = 'unavailable'
+            AI_REQUESTS.labels('unavailable').inc()
+            yield UNAVAILABLE_MESSAGE
+        except Exception as e:
+            outcome = 'error'
+            AI_REQUESTS.labels('error').inc()
+            count_error('ai', e)
+            log_error('ai', e, self.session)
+            prefix = "\n" if parts else ""
+            yield f"{prefix}Error communicating with AI: {str(e)}"
+        finally:
+            if outcome == 'disconnected':
+                AI_REQUESTS.labels('disconnected').inc()
+            if parts:
+                # Add assistant response to history
+                self._add_reply("".join(parts))
+            if span is not None:
+                answered = outcome == 'ok'
+                trace.end(span, outcome=outcome, reply_chars=sum(map(len, parts)),
+                          model=self.model if answered else None, hedged=self.hedged and answered)
+            self._audit(user_message, "".join(parts), outcome, submitted)
+
     def reset_conversation(self):
         """Clear conversation history"""
-        self.conversation_history = []
-    
+        self.context.clear()
+        self._record('reset')
+
     def get_conversation_length(self):
         """Get number of messages in conversation"""
-        return len(self.conversation_history)
-    
+        return len(self.context.turns)
+
     def get_model_name(self):
-        """Get the current model name"""
-        return self.model
+        """The model that answered last, else the one the next request would go to"""
+        return self.model or self.client.get_model_name()
 
+    def get_prompt_stats(self):
+        """Prompt size figures for the last request"""
+        return {
+            'estimated_prompt_tokens': self.prompt_tokens[-1] if self.prompt_tokens else 0,
+            'reported_prompt_tokens': getattr(self.last_usage, 'prompt_tokens', None),
+            'budget': self.context.budget,
+            'verbatim_messages': len(self.context.turns),
+            'summarized': bool(self.context.summary),
+        }
@@ -0,0 +1,283 @@
+"""
+Latency-aware routing of AI requests across several models
+
+Every candidate model has a moving profile: an average time to first token
+and error rate, recent first-token times, and a circuit breaker. A request
+goes to the model expected to answer soonest. If that model has not
+produced a token by its hedge delay (its recent 90th percentile, clamped),
+a duplicate goes to the runner-up; whichever produces a token first
+answers and the other request is cancelled. Hedges are capped at a
+fraction of recent requests so an outage cannot double the load.
+Requests that return a whole completion (not a stream) are routed and
+counted for the breaker but neither hedged nor timed: their latency is
+not a time to first token.
+
+A model that fails AI_BREAKER_FAILURES times in a row is skipped for
+AI_BREAKER_SECONDS (doubling while it keeps failing); then one request
+probes it and a success puts it back in rotation.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+
+from metrics import AI_HEDGES, AI_MODEL_REQUESTS
+
+
+class ModelsUnavailable(Exception):
+    """Raised when the circuit breaker of every model is open"""
+
+
+class ModelProfile:
+    """Moving latency/error figures and circuit breaker state of one model"""
+
+    def __init__(self, model, samples=50, alpha=0.2):
+        self.model = model
+        self.alpha = alpha
+        self.first_token = deque(maxlen=samples)  # recent seconds to first token
+        self.latency = None  # moving average of the same
+        self.error_rate = 0.0
+        self.failures = 0    # in a row
+        self.open_until = 0.0
+        self.trips = 0
+        self.probing = False
+        self.in_flight = 0
+        self.requests = 0    # the rest are counted in bbs_ai_model_requests_total
+
+    @property
+    def state(self):
+        if self.open_until == 0.0:
+            return 'closed'
+        return 'open' if time.monotonic() < self.open_until or self.probing else 'half-open'
+
+    def available(self):
+        """Closed, or open with the cooldown over and no probe running"""
+        return self.state != 'open'
+
+    def score(self):
+        """Expected seconds until a token, counting retries after errors; unknown models go first"""
+        if self.latency is None:
+            return 0.0
+        return self.latency / (1.0 - min(self.error_rate, 0.95))
+
+    def observe(self, seconds):
+        self.first_token.append(seconds)
+        self.latency = seconds if self.latency is None else self.latency + self.alpha * (seconds - self.latency)
+
+    def success(self, seconds=None):
+        if seconds is not None:
+            self.observe(seconds)
+        self.error_rate -= self.alpha * self.error_rate
+        self.failures = 0
+        self.open_until = 0.0
+        self.trips = 0
+        self.probing = False
+
+    def failure(self, threshold, cooldown, max_cooldown):
+        self.error_rate += self.alpha * (1.0 - self.error_rate)
+        self.failures += 1
+        if self.probing or self.failures >= threshold:
+            self.trips += 1
+            self.open_until = time.monotonic() + min(max_cooldown, cooldown * 2 ** (self.trips - 1))
+        self.probing = False
+
+    def percentile(self, q):
+        if not self.first_token:
+            return None
+        ordered = sorted(self.first_token)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def stats(self):
+        p50, p90 = self.percentile(0.5), self.percentile(0.9)
+        return {
+            'state': self.state,
+            'latency': self.latency,
+            'p50': p50,
+            'p90': p90,
+            'error_rate': self.error_rate,
+            'requests': self.requests,
+        }
+
+
+class ModelRouter:
+    """Picks models for requests and races hedged duplicates
+
+    ``retryable`` are the exceptions that count against a model's health;
+    others (a bad request, say) are passed on without blame.
+    """
+
+    def __init__(self, models, retryable=(Exception,), hedge=None, hedge_min=None, hedge_max=None,
+                 hedge_ratio=None, breaker_failures=None, breaker_seconds=None):
+        if hedge is None:
+            hedge = os.getenv('AI_HEDGE', '1') != '0'
+        if hedge_min is None:
+            hedge_min = float(os.getenv('AI_HEDGE_MIN_MS', 300)) / 1000
+        if hedge_max is None:
+            hedge_max = float(os.getenv('AI_HEDGE_MAX_MS', 4000)) / 1000
+        if hedge_ratio is None:
+            hedge_ratio = float(os.getenv('AI_HEDGE_RATIO', 0.2))
+        if breaker_failures is None:
+            breaker_failures = int(os.getenv('AI_BREAKER_FAILURES', 3))
+        if breaker_seconds is None:
+            breaker_seconds = float(os.getenv('AI_BREAKER_SECONDS', 30))
+        self.models = list(dict.fromkeys(models))
+        self.profiles = {model: ModelProfile(model) for model in self.models}
+        self.retryable = retryable
+        self.hedge = hedge and len(self.models) > 1
+        self.hedge_min = hedge_min
+        self.hedge_max = hedge_max
+        self.hedge_ratio = hedge_ratio
+        self.breaker_failures = max(1, breaker_failures)
+        self.breaker_seconds = breaker_seconds
+        self.max_cooldown = breaker_seconds * 8
+
+        # Requests and hedges, decayed so the hedge cap follows recent traffic
+        self._recent_requests = 0.0
+        self._recent_hedges = 0.0
+
+        # Counters
+        self.requests = 0
+        self.hedges = 0
+        self.hedges_won = 0
+
+    def ranked(self, exclude=()):
+        """Available models, the one expected to answer soonest first"""
+        return sorted((m for m in self.models if m not in exclude and self.profiles[m].available()),
+                      key=lambda m: self.profiles[m].score())
+
+    def best(self):
+        """The model the next request would go to"""
+        ranked = self.ranked()
+        return ranked[0] if ranked else self.models[0]
+
+    def hedge_delay(self, model):
+        """Seconds to wait for a first token from ``model`` before hedging"""
+        profile = self.profiles[model]
+        if len(profile.first_token) < 10:
+            return self.hedge_max
+        return min(self.hedge_max, max(self.hedge_min, profile.percentile(0.9)))
+
+    def failed(self, model):
+        """Count a failure of ``model``, also one after its first token"""
+        self.profiles[model].failure(self.breaker_failures, self.breaker_seconds, self.max_cooldown)
+
+    def _may_hedge(self):
+        return self._recent_hedges < self.hedge_ratio * self._recent_requests
+
+    async def _attempt(self, request, model, started, timed):
+        profile = self.profiles[model]
+        profile.requests += 1
+        profile.in_flight += 1
+        try:
+            result = await request(model)
+        except asyncio.CancelledError:
+            AI_MODEL_REQUESTS.labels(model, 'cancelled').inc()
+            profile.probing = False
+            # A loser took at least this long; only that lower bound is known
+            elapsed = time.monotonic() - started
+            if timed and profile.latency is not None and elapsed > profile.latency:
+                profile.observe(elapsed)
+            raise
+        except self.retryable:
+            AI_MODEL_REQUESTS.labels(model, 'error').inc()
+            self.failed(model)
+            raise
+        finally:
+            profile.in_flight -= 1
+        AI_MODEL_REQUESTS.labels(model, 'ok').inc()
+        profile.success(time.monotonic() - started if timed else None)
+        return result
+
+    async def race(self, request, exclude=(), hedge=True, discard=None, first_token=True):
+        """Run ``await request(model)`` on the best model, hedged onto the runner-up
+
+        ``request`` should return once the model produced its first token;
+        with ``first_token`` off it returns the whole completion, which is
+        then not hedged and not timed. Returns (model, result, hedged).
+        Losing requests are cancelled and awaited before this returns;
+        ``discard(result)`` is called for one that finished anyway. Raises
+        the last error if every attempt failed, or ModelsUnavailable if no
+        model may be tried.
+        """
+        candidates = self.ranked(exclude)
+        if not candidates:
+            soonest = min(self.profiles[m].open_until for m in self.models)
+            raise ModelsUnavailable(f"every AI model is failing, retrying in "
+                                    f"{max(1, soonest - time.monotonic()):.0f}s")
+        self.requests += 1
+        self._recent_requests = self._recent_requests * 0.99 + 1
+        self._recent_hedges *= 0.99
+        hedge = hedge and self.hedge and first_token
+        tasks = {}
+        primary = candidates[0]
+        hedge_at = time.monotonic() + self.hedge_delay(primary)
+        hedged = False
+
+        def launch(model):
+            profile = self.profiles[model]
+            if profile.state == 'half-open':
+                profile.probing = True  # the one request that may try it
+            tasks[asyncio.ensure_future(self._attempt(request, model, time.monotonic(), first_token))] = model
+
+        launch(candidates.pop(0))
+        error = None
+        try:
+            while tasks:
+                timeout = None
+                if hedge and not hedged and candidates and self._may_hedge():
+                    timeout = max(0.0, hedge_at - time.monotonic())
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    self.hedges += 1
+                    self._recent_hedges += 1
+                    launch(candidates.pop(0))
+                    continue
+                winner = None
+                for task in done:
+                    model = tasks.pop(task)
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif winner is None:
+                        winner = model, task.result()
+                    elif discard is not None:
+                        await discard(task.result())
+                if winner is not None:
+                    model, result = winner
+                    if hedged:
+                        AI_HEDGES.labels('primary' if model == primary else 'hedge').inc()
+                    if hedged and model != primary:
+                        self.hedges_won += 1
+                    return model, result, hedged
+                if not tasks and candidates and isinstance(error, self.retryable):
+                    launch(candidates.pop(0))  # fail over at once
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                # Let the losers close their requests now, and collect what they raised
+                for result in await asyncio.gather(*tasks, return_exceptions=True):
+                    if discard is not None and not isinstance(result, BaseException):
+                        await discard(result)
+
+    def metrics(self):
+        """Scrape-time gauges of every model's profile (a metrics collector)"""
+        states = ('closed', 'half-open', 'open')
+        profiles = self.profiles.values()
+        return [
+            ('bbs_ai_model_breaker_state', 'gauge', "Circuit breaker of each model: 0 closed, 1 half-open, 2 open",
+             [({'model': p.model}, states.index(p.state)) for p in profiles]),
+            ('bbs_ai_model_first_token_seconds', 'gauge', "Moving average time to first token of each model",
+             [({'model': p.model}, p.latency) for p in profiles if p.latency is not None]),
+            ('bbs_ai_model_error_rate', 'gauge', "Moving error rate of each model",
+             [({'model': p.model}, p.error_rate) for p in profiles]),
+        ]
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'hedges': self.hedges,
+            'hedges_won': self.hedges_won,
+            'models': {model: profile.stats() for model, profile in self.profiles.items()},
+        }
@@ -0,0 +1,171 @@
+"""
+Fair scheduler for AI requests
+
+Every request to the provider takes a slot from one process-wide scheduler.
+At most ``concurrency`` requests are in flight; the rest wait in per-caller
+queues served round-robin, so one busy caller cannot starve the others. A
+caller is a handle, except that every anonymous Guest session is its own
+caller (see ChatSession.caller).
+"""
+import asyncio
+import os
+import time
+from collections import deque
+
+
+class QueueTimeout(Exception):
+    """Raised when a request waited in the queue past its deadline"""
+
+
+class Ticket:
+    """One queued request"""
+    __slots__ = ('caller', 'future', 'enqueued', 'background')
+
+    def __init__(self, caller, future, background):
+        self.caller = caller
+        self.future = future
+        self.enqueued = time.monotonic()
+        self.background = background
+
+
+class AIScheduler:
+    """Concurrency-capped, round-robin fair queue for AI calls
+
+    Foreground tickets are grouped by caller; each dispatch takes the oldest
+    ticket of the caller at the front of the rotation and moves that caller
+    to the back. Background work (history summaries) only runs when no
+    foreground ticket is waiting.
+    """
+
+    def __init__(self, concurrency=None, deadline=None):
+        if concurrency is None:
+            concurrency = int(os.getenv('AI_CONCURRENCY', 8))
+        if deadline is None:
+            deadline = float(os.getenv('AI_QUEUE_DEADLINE', 60))
+        self.concurrency = max(1, concurrency)
+        self.deadline = deadline
+        self.active = 0
+        self._queues = {}  # caller -> deque of tickets, dict order is the rotation
+        self._background = deque()
+
+        # Counters
+        self.dispatched = 0
+        self.timed_out = 0
+        self.peak_waiting = 0
+        self.total_wait = 0.0
+
+    def waiting(self):
+        """Number of foreground tickets waiting for a slot"""
+        return sum(len(q) for q in self._queues.values())
+
+    def enqueue(self, caller, background=False):
+        """Queue a request and return its ticket"""
+        ticket = Ticket(caller, asyncio.get_running_loop().create_future(), background)
+        if background:
+            self._background.append(ticket)
+        else:
+            self._queues.setdefault(caller, deque()).append(ticket)
+            self.peak_waiting = max(self.peak_waiting, self.waiting())
+        self._dispatch()
+        return ticket
+
+    async def wait(self, ticket):
+        """Wait until the ticket holds a slot; release() must follow"""
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), self.deadline)
+        except asyncio.TimeoutError:
+            if not self._cancel(ticket):
+                return
+            self.timed_out += 1
+            raise QueueTimeout("the AI queue is full right now")
+        except asyncio.CancelledError:
+            if not self._cancel(ticket):
+                self.release()  # the slot was granted as we were cancelled
+            raise
+
+    def release(self):
+        """Give a slot back and start the next waiting request"""
+        self.active -= 1
+        self._dispatch()
+
+    def position(self, ticket):
+        """1-based place in line of a waiting foreground ticket, None once it runs"""
+        if ticket.future.done():
+            return None
+        queue = self._queues.get(ticket.caller)
+        if queue is None:
+            return None
+        try:
+            index = queue.index(ticket)
+        except ValueError:
+            return None
+        # Round-robin dispatch serves one ticket per caller per round
+        ahead = 0
+        before = True
+        for caller, q in self._queues.items():
+            if caller == ticket.caller:
+                before = False
+                ahead += index
+                continue
+            ahead += min(len(q), index + 1 if before else index)
+        return ahead + 1
+
+    def stats(self):
+        return {
+            'concurrency': self.concurrency,
+            'active': self.active,
+            'waiting': self.waiting(),
+            'background_waiting': len(self._background),
+            'dispatched': self.dispatched,
+            'timed_out': self.timed_out,
+            'peak_waiting': self.peak_waiting,
+            'mean_wait': self.total_wait / self.dispatched if self.dispatched else 0.0,
+        }
+
+    def metrics(self):
+        """Scrape-time queue figures (a metrics collector)"""
+        stats = self.stats()
+        return [
+            ('bbs_ai_requests_active', 'gauge', "AI requests holding a slot", [({}, stats['active'])]),
+            ('bbs_ai_queue_length', 'gauge', "AI requests waiting for a slot",
+             [({'kind': 'chat'}, stats['waiting']), ({'kind': 'summary'}, stats['background_waiting'])]),
+            ('bbs_ai_queue_peak', 'gauge', "Most chat requests waiting at once", [({}, stats['peak_waiting'])]),
+            ('bbs_ai_queue_timeouts_total', 'counter', "Requests that gave up waiting for a slot",
+             [({}, stats['timed_out'])]),
+        ]
+
+    def _cancel(self, ticket):
+        """Drop a ticket that has not been dispatched; False if it already has"""
+        if ticket.future.done():
+            return False
+        ticket.future.cancel()
+        if ticket.background:
+            self._background.remove(ticket)
+        else:
+            queue = self._queues[ticket.caller]
+            queue.remove(ticket)
+            if not queue:
+                del self._queues[ticket.caller]
+        return True
+
+    def _next(self):
+        if self._queues:
+            caller = next(iter(self._queues))
+            queue = self._queues.pop(caller)
+            ticket = queue.popleft()
+            if queue:
+                self._queues[caller] = queue  # back of the rotation
+            return ticket
+        if self._background:
+            return self._background.popleft()
+        return None
+
+    def _dispatch(self):
+        while self.active < self.concurrency:
+            ticket = self._next()
+            if ticket is None:
+                return
+            self.active += 1
+            self.dispatched += 1
+            self.total_wait += time.monotonic() - ticket.enqueued
+            ticket.future.set_result(True)
@@ -0,0 +1,111 @@
+"""
+Frame scheduling for session animations
+"""
+import asyncio
+import math
+
+# Resolution of animation timing (seconds)
+FRAME_TICK = 0.01
+
+
+class TimerWheel:
+    """Hashed timing wheel shared by every session's animations
+
+    Instead of one loop timer per frame per session, a single ticker task
+    wakes every ``tick`` seconds while frames are pending and resolves all
+    futures whose deadline has passed. When the loop is busy and a tick
+    comes late, everything that fell due meanwhile fires at once.
+    """
+
+    def __init__(self, tick=FRAME_TICK, size=256):
+        self.tick = tick
+        self.size = size
+        self._loop = None
+        self._task = None
+        self._slots = [[] for _ in range(size)]
+        self._pending = 0
+        self._origin = 0.0
+        self._fired_tick = 0
+
+        # Exported by metrics(): ticks run, waits resolved, ticks the busy loop woke late
+        self.ticks = 0
+        self.fired = 0
+        self.late_ticks = 0
+
+    def schedule(self, deadline, future, value='tick'):
+        """Resolve ``future`` with ``value`` once loop time reaches ``deadline``"""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._reset(loop)
+        if self._task is None:
+            # Idle until now: nothing is due between the last tick and this one
+            self._fired_tick = max(self._fired_tick, int((loop.time() - self._origin) / self.tick))
+        tick = max(self._fired_tick + 1, math.ceil((deadline - self._origin) / self.tick))
+        self._slots[tick % self.size].append((tick, future, value))
+        self._pending += 1
+        if self._task is None:
+            self._task = loop.create_task(self._run())
+
+    def stats(self):
+        return {'pending': self._pending, 'ticks': self.ticks, 'fired': self.fired, 'late_ticks': self.late_ticks}
+
+    def metrics(self):
+        """Scrape-time figures of the wheel (a metrics collector)"""
+        return [
+            ('bbs_frame_wheel_ticks_total', 'counter', "Frame wheel ticks, by whether the loop woke it on time",
+             [({'when': 'on_time'}, self.ticks - self.late_ticks), ({'when': 'late'}, self.late_ticks)]),
+            ('bbs_frame_wheel_waits_total', 'counter', "Animation frame waits resolved by the wheel",
+             [({}, self.fired)]),
+            ('bbs_frame_wheel_pending', 'gauge', "Animation frame waits scheduled on the wheel",
+             [({}, self._pending)]),
+        ]
+
+    def _reset(self, loop):
+        self._loop = loop
+        self._task = None
+        self._slots = [[] for _ in range(self.size)]
+        self._pending = 0
+        self._origin = loop.time()
+        self._fired_tick = 0
+
+    async def _run(self):
+        loop = self._loop
+        try:
+            while self._pending:
+                delay = self._origin + (self._fired_tick + 1) * self.tick - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self.ticks += 1
+                now_tick = int((loop.time() - self._origin) / self.tick)
+                if now_tick > self._fired_tick + 1:
+                    self.late_ticks += 1
+                if now_tick > self._fired_tick:
+                    self._advance(now_tick)
+        finally:
+            self._task = None
+
+    def _advance(self, now_tick):
+        first = self._fired_tick + 1
+        # More than a full turn behind: one pass over every slot covers it
+        last = min(now_tick, first + self.size - 1)
+        for tick in range(first, last + 1):
+            index = tick % self.size
+            slot = self._slots[index]
+            if not slot:
+                continue
+            keep = []
+            for entry in slot:
+                if entry[0] <= now_tick:
+                    self._pending -= 1
+                    self.fired += 1
+                    future = entry[1]
+                    if not future.done():
+                        future.set_result(entry[2])
+                else:
+                    keep.append(entry)
+            self._slots[index] = keep
+        self._fired_tick = now_tick
+
+
+# Process-wide wheel used by all sessions
+FRAME_WHEEL = TimerWheel()
@@ -77,6 +77,8 @@ MAIN_MENU = f"""{Colors.BRIGHT_CYAN}
 ║   {Colors.BRIGHT_GREEN}[3]{Colors.WHITE} ASCII Art Gallery            {Colors.BRIGHT_BLACK}// Retro masterpieces{Colors.BRIGHT_CYAN}                  ║
 ║   {Colors.BRIGHT_GREEN}[4]{Colors.WHITE} System Information           {Colors.BRIGHT_BLACK}// Stats & info{Colors.BRIGHT_CYAN}                        ║
 ║   {Colors.BRIGHT_GREEN}[5]{Colors.WHITE} Easter Eggs                  {Colors.BRIGHT_BLACK}// Find the secrets!{Colors.BRIGHT_CYAN}                   ║
+║   {Colors.BRIGHT_GREEN}[6]{Colors.WHITE} Search                       {Colors.BRIGHT_BLACK}// Boards & your AI chats{Colors.BRIGHT_CYAN}              ║
+║   {Colors.BRIGHT_GREEN}[7]{Colors.WHITE} Teleconference               {Colors.BRIGHT_BLACK}// Talk to other callers{Colors.BRIGHT_CYAN}               ║
 ║   {Colors.BRIGHT_RED}[Q]{Colors.WHITE} Quit / Logoff                {Colors.BRIGHT_BLACK}// See you later!{Colors.BRIGHT_CYAN}                      ║
 ║                                                                           ║
 ╚═══════════════════════════════════════════════════════════════════════════╝
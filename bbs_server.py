@@ -1,41 +1,317 @@
 """
 Main BBS Server - Telnet-based Bulletin Board System
 """
+import asyncio
+import importlib
+import itertools
+import resource
+import signal
 import socket
-import socketserver
-import paramiko
-import threading
-import time
 import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from dotenv import load_dotenv
+
+# Before the modules below read their settings
+load_dotenv()
+
 from ascii_art import *
-from ai_client import AIClient
+from cluster import (SUPERVISED, WORKER_ID, WORKERS, Supervisor, get_addresses, get_link, get_presence,
+                     inherited_listeners)
+from conversations import SAVE_CHATS, get_conversations
+from eventlog import get_event_log, log_error, log_event
+from metrics import (ACCEPTS, ANIMATION_FRAMES, METRICS_PORT, REGISTRY, SESSIONS, SSH_HANDSHAKE_SECONDS,
+                     RenderTimer, error as count_error, serve_metrics)
+from rooms import ROOM_AI, get_rooms
+from search import get_search
+from storage import get_store
+from animation import FRAME_WHEEL
+from screen import MAIN_MENU_SCREEN, WELCOME_SCREEN, VirtualScreen
+from sysop import ADMIN_SOCKET, AdminServer, admin_socket_path
+from session_io import (COMPRESS2, DO, DONT, IAC, READ_CHUNK, TELNET_COMPRESS, TYPEAHEAD_LIMIT, WONT,
+                        InputDecoder, OutputBuffer, StreamCompressor, edit_line)
+
+
+# Stream AI replies token by token (0 waits for the full reply and types it out)
+AI_STREAM = os.getenv('AI_STREAM', '1') != '0'
+
+# Streamed tokens are pushed to the caller at most this often
+AI_STREAM_RENDER_INTERVAL = int(os.getenv('AI_STREAM_RENDER_MS', 50)) / 1000
+
+
+# Longest message a caller can compose on the boards
+MAX_MESSAGE_LINES = 20
+
+# Seconds a caller may sit at a prompt without typing: before and after entering a handle
+LOGIN_TIMEOUT = float(os.getenv('BBS_LOGIN_TIMEOUT', 120))
+IDLE_TIMEOUT = float(os.getenv('BBS_IDLE_TIMEOUT', 900))
+
+# Longest input line; characters typed past it are dropped
+MAX_LINE_LENGTH = int(os.getenv('BBS_MAX_LINE', 2000))
+
+# Output handed to the transport but not yet taken by the caller before we hang up,
+# and seconds a flush may wait for the caller to read
+OUTPUT_LIMIT = int(os.getenv('BBS_OUTPUT_LIMIT', 1024 * 1024))
+WRITE_TIMEOUT = float(os.getenv('BBS_WRITE_TIMEOUT', 60))
+
+# Concurrent connections (telnet and SSH together) from one address, 0 for no limit
+MAX_PER_IP = int(os.getenv('BBS_MAX_PER_IP', 20))
+
+# Seconds a worker replaced by a reload lets its callers finish before hanging up
+DRAIN_SECONDS = float(os.getenv('BBS_DRAIN_SECONDS', 300))
+
+# Callers of a draining worker are reminded this many seconds before the deadline
+DRAIN_REMINDERS = (120, 60, 30, 10)
 
+# Animation frames by how they went out (children looked up once, frames are frequent)
+FRAMES_ON_TIME = ANIMATION_FRAMES.labels('on_time')
+FRAMES_LATE = ANIMATION_FRAMES.labels('late')
+FRAMES_SKIPPED = ANIMATION_FRAMES.labels('skipped')
+REGISTRY.collector(FRAME_WHEEL.metrics)
 
-class BBSHandler(socketserver.BaseRequestHandler):
-    """Handler for individual BBS connections"""
+# How often each session limit fired in this process
+limit_stats = {'login_timeouts': 0, 'idle_timeouts': 0, 'long_lines': 0,
+               'write_timeouts': 0, 'output_overflows': 0, 'per_ip_rejected': 0}
+
+ROOM_HELP = "Commands: /who, /me <action>, " + ("/ai <question>, " if ROOM_AI else "") + "/quit"
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M')
+
+
+class ClientDisconnected(Exception):
+    """Raised inside a session once the caller has gone away"""
+
+
+class BBSHandler:
+    """Handler for individual BBS connections
+
+    Every session is a coroutine on the server's event loop. ``reader`` is an
+    ``asyncio.StreamReader`` and ``writer`` anything with the StreamWriter
+    ``write``/``drain``/``close`` surface (a real StreamWriter for telnet, a
+    ``ParamikoChannelAdapter`` for SSH).
+    """
     
-    def __init__(self, *args, **kwargs):
+    def __init__(self, reader, writer, client_address, is_ssh=False):
+        self.reader = reader
+        self.writer = writer
+        self.client_address = client_address
+        self.is_ssh = is_ssh
+        self.input = InputDecoder(telnet=not is_ssh, on_command=self.telnet_command)
+        self.output = OutputBuffer()
+        self.screen = VirtualScreen()
+        self._flush_timer = None
+        self._input_task = None
+        self._input_ready = asyncio.Event()
+        self._input_wanted = asyncio.Event()
+        self._input_closed = False
+        self._waiter = None
+        self.idle_since = 0.0
+        self.idle_timeout = LOGIN_TIMEOUT
+        self.logged_in = False
+        self.aborted = False
+        self.compress_offered = False
+        self.protocol = 'ssh' if is_ssh else 'telnet'
+        self._render = None
+        self.session_id = next(_session_ids)
+        self.task = None
+        self.connected = time.monotonic()
+        self.screen_name = 'login'
+        self.trace = None  # SessionTrace while the sysop traces this session
         self.username = "Guest"
-        self.ai_client = None
-        super().__init__(*args, **kwargs)
+        self.ai_session = None
+        self.ai_first_char_times = deque(maxlen=100)
     
-    def send(self, message):
-        """Send message to client with UTF-8 encoding"""
+    async def send(self, message):
+        """Queue a message for the client; it goes out at the next flush point"""
+        trace = self.trace and self.live_trace()
+        span = trace.begin('send', text=trace.text(message)) if trace else None
+        self.screen.track(message)
+        if self.output.write(message):
+            await self.flush()
+        if span is not None:
+            trace.end(span, chars=len(message))
+
+    async def draw(self, static, dynamic=""):
+        """Show a static screen plus dynamic lines, redrawing only what changed"""
+        if self.output.write(self.screen.draw(static, dynamic)):
+            await self.flush()
+
+    async def flush(self, frame=False):
+        """Write all queued output to the client in one go
+
+        With ``frame`` set this is an animation frame: if the previous write
+        was less than the batch window ago, the output is held back and goes
+        out when the window expires, together with any frames drawn meanwhile.
+        """
+        if not self.output.pending():
+            return
+        if frame:
+            delay = self.output.frame_delay()
+            if delay > 0:
+                self.flush_later(delay)
+                return
         try:
-            # Ensure proper line endings (CRLF) for both Telnet and SSH/PTY
-            # This fixes the "staircase effect" where ASCII art falls apart
-            if isinstance(message, str):
-                message = message.replace('\r\n', '\n').replace('\n', '\r\n')
-            
-            # Ensure proper UTF-8 encoding for Cyrillic and other Unicode characters
-            self.request.sendall(message.encode('utf-8', errors='replace'))
+            self.write_pending()
+            if self.aborted:
+                raise ClientDisconnected()
+            await asyncio.wait_for(self.writer.drain(), WRITE_TIMEOUT)
+        except asyncio.TimeoutError as e:
+            # The caller stopped reading
+            limit_stats['write_timeouts'] += 1
+            self.abort()
+            raise ClientDisconnected() from e
+        except ConnectionError as e:
+            raise ClientDisconnected() from e
+        except ClientDisconnected:
+            raise
         except Exception as e:
-            print(f"Error sending message: {e}")
+            count_error('send', e)
+            log_error('send', e, self.session_id)
+
+    def flush_later(self, delay):
+        """Write queued output ``delay`` seconds from now, unless a flush comes first"""
+        if self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(delay, self.write_pending)
+
+    def write_pending(self):
+        """Hand queued output to the transport without waiting for it to drain"""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if self.output.pending() and not self.aborted:
+            self.writer.write(self.output.take())
+            if self.write_buffer_size() > OUTPUT_LIMIT:
+                limit_stats['output_overflows'] += 1
+                self.abort()
+
+    def write_buffer_size(self):
+        """Bytes written to the transport that the caller has not taken yet"""
+        transport = getattr(self.writer, 'transport', None) or self.writer
+        get_size = getattr(transport, 'get_write_buffer_size', None)
+        return get_size() if get_size is not None else 0
+
+    def notice(self, text):
+        """Show a system notice at once, on top of whatever screen the caller is on"""
+        message = f"\n{Colors.BRIGHT_YELLOW}*** {text} ***{Colors.RESET}\n"
+        self.screen.track(message)
+        self.output.write(message)
+        self.write_pending()
+
+    def hang_up(self):
+        """End the session from outside; output already queued still goes out
+
+        The session unwinds through ClientDisconnected at its next read or
+        write, running its usual cleanup.
+        """
+        self.write_pending()
+        self.aborted = True
+        self.writer.close()
+        self._input_closed = True
+        self._input_arrived()
+
+    def abort(self):
+        """Drop the connection at once, discarding unsent output"""
+        self.aborted = True
+        transport = getattr(self.writer, 'transport', None)
+        if transport is not None:
+            transport.abort()
+        else:
+            self.writer.close()
+        self._input_closed = True
+        self._input_arrived()
+
+    async def pause(self, seconds):
+        """Flush, then wait (a key press ends the wait early)"""
+        await self.animate([("", seconds)])
+
+    async def animate(self, frames):
+        """Play ``(text, delay)`` frames: draw the text, then wait the delay
+
+        Waits run on the shared frame wheel. A key press skips the rest of
+        the animation and is swallowed; type-ahead that was already buffered
+        skips it too but is kept for the next prompt. Frames that fall
+        behind schedule (busy loop) are not drawn on their own: their text
+        goes out with the next frame that is on time. Either way the caller
+        receives exactly the same bytes, only sooner.
+        """
+        loop = asyncio.get_running_loop()
+        skip = self.input.has_input()
+        deadline = loop.time()
+        for text, delay in frames:
+            if text:
+                await self.send(text)
+            if skip:
+                FRAMES_SKIPPED.inc()
+                continue
+            deadline += delay
+            if loop.time() >= deadline:
+                FRAMES_LATE.inc()
+                continue
+            await self.flush(frame=True)
+            FRAMES_ON_TIME.inc()
+            if await self.wait_frame(deadline) == 'key':
+                skip = True
+                self.input.unread(self.input.read()[1:])
+        await self.flush()
+
+    async def wait_frame(self, deadline):
+        """Wait for loop time ``deadline``; returns 'key' if input arrived first
+
+        A caller who has hung up counts as a key press, so nothing is
+        animated for nobody.
+        """
+        if self.input.has_input() or (self._input_task is not None and self._input_closed):
+            return 'key'
+        waiter = asyncio.get_running_loop().create_future()
+        FRAME_WHEEL.schedule(deadline, waiter)
+        if self._input_task is not None and not self._input_closed:
+            self._waiter = waiter
+        try:
+            return await waiter
+        finally:
+            self._waiter = None
+
+    def start_input(self):
+        """Start reading from the caller in the background
+
+        Chunks are decoded as they arrive, so a key pressed during an
+        animation can end it. Reading pauses while TYPEAHEAD_LIMIT characters
+        are waiting, leaving the rest to transport flow control.
+        """
+        self._input_task = asyncio.get_running_loop().create_task(self._read_input())
+
+    async def _read_input(self):
+        try:
+            while True:
+                while self.input.buffered() >= TYPEAHEAD_LIMIT:
+                    self._input_wanted.clear()
+                    await self._input_wanted.wait()
+                chunk = await self.reader.read(READ_CHUNK)
+                if not chunk:
+                    break
+                self.idle_since = asyncio.get_running_loop().time()
+                self.input.feed(chunk)
+                if self.input.has_input():
+                    self._input_arrived()
+        except ConnectionError:
+            pass
+        finally:
+            self._input_closed = True
+            self._input_arrived()
+
+    def _input_arrived(self):
+        self._input_ready.set()
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result('key')
     
-    def negotiate_telnet(self):
+    async def negotiate_telnet(self):
         """Send Telnet negotiation codes to force character mode"""
-        if getattr(self.request, 'is_ssh', False):
+        if self.is_ssh:
             return
             
         # IAC WILL ECHO (255 251 1)
@@ -43,153 +319,196 @@ class BBSHandler(socketserver.BaseRequestHandler):
         # IAC WONT LINEMODE (255 252 34)
         # IAC DO BINARY (255 253 0) - Please send 8-bit data
         # IAC WILL BINARY (255 251 0) - I will send 8-bit data
-        msg = b'\xff\xfb\x01\xff\xfb\x03\xff\xfc\x22\xff\xfd\x00\xff\xfb\x00'
+        await self.send(b'\xff\xfb\x01\xff\xfb\x03\xff\xfc\x22\xff\xfd\x00\xff\xfb\x00')
+
+        # IAC WILL COMPRESS2 (255 251 86) - Offer MCCP2; clients that don't know it refuse or ignore it
+        if TELNET_COMPRESS:
+            self.compress_offered = True
+            await self.send(b'\xff\xfb\x56')
+
+    def telnet_command(self, command, option):
+        """Telnet commands from the caller (called by the input decoder)"""
+        if option != COMPRESS2:
+            return
+        if command == DO:
+            if not self.compress_offered:
+                self.output.write(bytes([IAC, WONT, COMPRESS2]))
+            elif self.output.compressor is None:
+                # Compression starts right after the start sequence in the output stream
+                self.output.start_compression(StreamCompressor())
+        elif command == DONT:
+            # Refused, or the client wants plain output again
+            self.compress_offered = False
+            if self.output.compressor is not None:
+                self.write_pending()
+                self.writer.write(self.output.end_compression())
+
+    def begin_render(self, screen):
+        """Time a screen (for the metrics) until the session next waits for the caller"""
+        self._render = RenderTimer(screen, self.output.bytes_out)
+        self.screen_name = screen
+        trace = self.trace and self.live_trace()
+        if trace:
+            trace.event('screen', screen=screen)
+
+    def set_trace(self, trace):
+        """Start (or with None, stop) tracing this session"""
+        if self.trace is not None:
+            self.trace.close()
+        self.trace = trace
+        if self.ai_session is not None:
+            self.ai_session.trace = trace
+
+    def live_trace(self):
+        """The session's trace, or None once it has run out"""
+        if self.trace.expired():
+            self.set_trace(None)
+        return self.trace
+
+    async def fill_input(self):
+        """Wait until the input decoder has decoded text buffered"""
+        if not self.input.has_input():
+            await self.flush()  # Everything on screen before blocking on the caller
+            if self._render is not None:
+                self._render.end(self.output.bytes_out)
+                self._render = None
+        self.idle_since = asyncio.get_running_loop().time()
+        if self._input_task is not None:
+            self._input_wanted.set()
+            while not self.input.has_input():
+                if self._input_closed:
+                    raise ClientDisconnected()
+                self._input_ready.clear()
+                await self.wait_idle(self._input_ready.wait())
+            return
+        while not self.input.has_input():
+            try:
+                chunk = await self.wait_idle(self.reader.read(READ_CHUNK))
+            except ConnectionError as e:
+                raise ClientDisconnected() from e
+            if not chunk:
+                raise ClientDisconnected()
+            self.input.feed(chunk)
+
+    async def wait_idle(self, awaitable):
+        """Await input; hang up if the caller stays idle past the session's timeout"""
+        remaining = self.idle_since + self.idle_timeout - asyncio.get_running_loop().time()
         try:
-            self.request.sendall(msg)
-        except Exception as e:
-            print(f"Telnet negotiation error: {e}")
+            return await asyncio.wait_for(awaitable, max(0.0, remaining))
+        except asyncio.TimeoutError:
+            limit_stats['idle_timeouts' if self.logged_in else 'login_timeouts'] += 1
+            idle = (f"{self.idle_timeout / 60:.0f} minutes" if self.idle_timeout >= 120
+                    else f"{self.idle_timeout:.0f} seconds")
+            await self.send(f"\n\n{Colors.BRIGHT_RED}No input for {idle}, disconnecting. "
+                            f"Call again soon!{Colors.RESET}\n")
+            await self.flush()
+            raise ClientDisconnected()
+
+    def edit_line(self, line):
+        """edit_line with the session's line length limit (counted once per line)"""
+        full = len(line) >= MAX_LINE_LENGTH
+        finished, echo = edit_line(self.input, line, MAX_LINE_LENGTH)
+        if not full and len(line) >= MAX_LINE_LENGTH:
+            limit_stats['long_lines'] += 1
+        return finished, echo
 
-    def receive(self, prompt=""):
+    async def receive(self, prompt=""):
         """Receive input from client with UTF-8 decoding and line editing"""
+        trace = self.trace and self.live_trace()
+        span = trace.begin('receive', prompt=trace.text(prompt)) if trace else None
         try:
             if prompt:
-                self.send(prompt)
+                await self.send(prompt)
 
-            is_ssh = getattr(self.request, 'is_ssh', False)
             buffer = []
-            byte_buffer = b""  # Buffer for incomplete UTF-8 sequences
-            
             while True:
-                # Read one byte at a time
-                try:
-                    chunk = self.request.recv(1)
-                    if not chunk:
-                        break
-                    
-                    # Handle Telnet Commands (IAC)
-                    if not is_ssh and chunk == b'\xff':
-                        # Read command
-                        cmd = self.request.recv(1)
-                        if not cmd: break
-                        
-                        # Handle option negotiation (3-byte commands)
-                        # WILL, WONT, DO, DONT
-                        if cmd in [b'\xfb', b'\xfc', b'\xfd', b'\xfe']:
-                            opt = self.request.recv(1)
-                            continue # Ignore negotiation
-                        
-                        # Handle escaped 255 (double IAC)
-                        if cmd == b'\xff':
-                            pass # allow generic processing as 0xFF
-                        else:
-                            continue # Ignore other commands
-                
-                    if not is_ssh and chunk == b'\xff' and cmd == b'\xff':
-                        # Valid 0xFF data case
-                        byte_buffer += b'\xff'
-                    elif not is_ssh and chunk == b'\xff':
-                        continue # Should have been handled above, but safety
-                    else:
-                        # Normal data
-                        byte_buffer += chunk
-                    
-                    # Try to decode the accumulated bytes
-                    try:
-                        char = byte_buffer.decode('utf-8')
-                        # If successful, clear the byte buffer
-                        byte_buffer = b""
-                    except UnicodeDecodeError:
-                        # Incomplete multibyte sequence, wait for more bytes
-                        if len(byte_buffer) > 4: # Safety valve for garbage
-                            byte_buffer = b""
-                        continue
-                        
-                except Exception:
-                    break
-
-                # Handle Enter (CR or LF)
-                if char == '\r' or char == '\n':
-                    self.send('\r\n')  # Echo newline to user
-                    break
-                
-                # Handle Backspace (ASCII 127 or 8)
-                if char == '\x7f' or char == '\x08':
-                    if buffer:
-                        buffer.pop()
-                        self.send('\x08 \x08')  # Erase character on screen
-                    continue
-                
-                # Handle regular characters
-                if char.isprintable():
-                    buffer.append(char)
-                    self.send(char)  # Echo character back to user
-            
-            return "".join(buffer)
+                await self.fill_input()
+                finished, echo = self.edit_line(buffer)
+                if echo:
+                    await self.send(echo)  # Echo everything consumed in one write
+                if finished:
+                    return "".join(buffer)
 
+        except ClientDisconnected:
+            raise
         except Exception as e:
-            print(f"Error receiving data: {e}")
+            count_error('receive', e)
+            log_error('receive', e, self.session_id)
             return ""
+        finally:
+            if span is not None:
+                trace.end(span)
     
-    def show_loading(self, message="Loading"):
+    async def show_loading(self, message="Loading"):
         """Show animated loading bar"""
-        self.send(f"\n{Colors.BRIGHT_CYAN}{message}... {Colors.RESET}")
-        for frame in LOADING_FRAMES:
-            self.send(f"\r{message}... {frame}")
-            time.sleep(0.1)
-        self.send("\n")
+        await self.send(f"\n{Colors.BRIGHT_CYAN}{message}... {Colors.RESET}")
+        await self.animate([(f"\r{message}... {frame}", 0.1) for frame in LOADING_FRAMES])
+        await self.send("\n")
     
-    def typing_effect(self, text, delay=0.03):
+    async def typing_effect(self, text, delay=0.03):
         """Display text with typing effect"""
-        for char in text:
-            self.send(char)
-            time.sleep(delay)
+        await self.animate([(char, delay) for char in text])
     
-    def show_welcome(self):
+    async def show_welcome(self):
         """Display welcome screen"""
-        self.send(clear_screen())
-        self.send(LOGO)
-        self.send(f"\n{Colors.BRIGHT_CYAN}╔═══════════════════════════════════════════════════════════════════════════╗{Colors.RESET}\n")
-        self.send(f"{Colors.BRIGHT_CYAN}║{Colors.RESET}  {Colors.BRIGHT_WHITE}Welcome to AI BBS!{Colors.RESET}                                                       {Colors.BRIGHT_CYAN}║{Colors.RESET}\n")
-        self.send(f"{Colors.BRIGHT_CYAN}╚═══════════════════════════════════════════════════════════════════════════╝{Colors.RESET}\n\n")
+        self.begin_render('welcome')
+        await self.draw(WELCOME_SCREEN)
+        await self.send(f"\n{Colors.BRIGHT_CYAN}╔═══════════════════════════════════════════════════════════════════════════╗{Colors.RESET}\n")
+        await self.send(f"{Colors.BRIGHT_CYAN}║{Colors.RESET}  {Colors.BRIGHT_WHITE}Welcome to AI BBS!{Colors.RESET}                                                       {Colors.BRIGHT_CYAN}║{Colors.RESET}\n")
+        await self.send(f"{Colors.BRIGHT_CYAN}╚═══════════════════════════════════════════════════════════════════════════╝{Colors.RESET}\n\n")
         
-        username = self.receive(f"{Colors.BRIGHT_YELLOW}Enter your handle: {Colors.RESET}")
+        username = await self.receive(f"{Colors.BRIGHT_YELLOW}Enter your handle: {Colors.RESET}")
         if username:
             self.username = username[:20]  # Limit username length
+        self.logged_in = True
+        get_presence().login(self.username)
+        log_event('login', self.session_id, handle=self.username)
+        self.idle_timeout = IDLE_TIMEOUT
         
-        self.send(f"\n{Colors.BRIGHT_GREEN}Welcome aboard, {self.username}!{Colors.RESET}\n")
-        time.sleep(1)
+        await self.send(f"\n{Colors.BRIGHT_GREEN}Welcome aboard, {self.username}!{Colors.RESET}\n")
+        await self.pause(1)
     
-    def show_main_menu(self):
+    async def show_main_menu(self):
         """Display main menu"""
-        self.send(clear_screen())
-        self.send(LOGO)
-        self.send(MAIN_MENU)
-        self.send(f"\n{Colors.BRIGHT_YELLOW}Logged in as: {Colors.BRIGHT_WHITE}{self.username}{Colors.RESET}\n")
-        self.send(f"{Colors.BRIGHT_BLACK}Current time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}{Colors.RESET}\n\n")
+        self.begin_render('main_menu')
+        await self.draw(MAIN_MENU_SCREEN,
+                        f"\n{Colors.BRIGHT_YELLOW}Logged in as: {Colors.BRIGHT_WHITE}{self.username}{Colors.RESET}\n"
+                        f"{Colors.BRIGHT_BLACK}Current time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}{Colors.RESET}\n\n")
     
-    def chat_with_ai(self):
+    async def chat_with_ai(self):
         """AI Chat interface"""
-        self.send(clear_screen())
-        self.send(CHAT_HEADER)
-        self.send(ROBOT_ART)
-        self.send("\n")
+        self.begin_render('ai_chat')
+        await self.send(clear_screen())
+        await self.send(CHAT_HEADER)
+        await self.send(ROBOT_ART)
+        await self.send("\n")
         
         # Initialize AI client if not already done
-        if not self.ai_client:
+        if not self.ai_session:
             try:
-                self.show_loading("Connecting to AI")
-                self.ai_client = AIClient()
-                model_name = self.ai_client.get_model_name()
-                self.send(f"{Colors.BRIGHT_GREEN}✓ Connected successfully!{Colors.RESET}\n")
-                self.send(f"{Colors.BRIGHT_BLACK}Using model: {model_name}{Colors.RESET}\n\n")
+                await self.show_loading("Connecting to AI")
+                get_client = await load_ai()
+                self.ai_session = await get_client().resume_session(self.username)
+                self.ai_session.trace = self.trace
+                self.ai_session.session = self.session_id
+                model_name = self.ai_session.get_model_name()
+                await self.send(f"{Colors.BRIGHT_GREEN}✓ Connected successfully!{Colors.RESET}\n")
+                models = len(self.ai_session.client.models)
+                routed = f" (fastest of {models} models right now)" if models > 1 else ""
+                await self.send(f"{Colors.BRIGHT_BLACK}Using model: {model_name}{routed}{Colors.RESET}\n")
+                resumed = self.ai_session.get_conversation_length()
+                if resumed:
+                    await self.send(f"{Colors.BRIGHT_BLACK}Picking up where you left off ({resumed} messages) - "
+                                    f"/reset to start over{Colors.RESET}\n")
+                await self.send("\n")
             except Exception as e:
-                self.send(f"{Colors.BRIGHT_RED}✗ Error: {str(e)}{Colors.RESET}\n")
-                self.send(f"{Colors.BRIGHT_YELLOW}Make sure OPENROUTER_API_KEY is set in .env file{Colors.RESET}\n\n")
-                self.receive("Press ENTER to continue...")
+                await self.send(f"{Colors.BRIGHT_RED}✗ Error: {str(e)}{Colors.RESET}\n")
+                await self.send(f"{Colors.BRIGHT_YELLOW}Make sure OPENROUTER_API_KEY is set in .env file{Colors.RESET}\n\n")
+                await self.receive("Press ENTER to continue...")
                 return
         
         while True:
-            user_input = self.receive(f"{Colors.BRIGHT_CYAN}{self.username}>{Colors.RESET} ")
+            user_input = await self.receive(f"{Colors.BRIGHT_CYAN}{self.username}>{Colors.RESET} ")
             
             if not user_input:
                 continue
@@ -198,81 +517,458 @@ class BBSHandler(socketserver.BaseRequestHandler):
                 break
             
             if user_input.lower() == '/reset':
-                self.ai_client.reset_conversation()
-                self.send(f"{Colors.BRIGHT_YELLOW}Conversation reset!{Colors.RESET}\n\n")
+                self.ai_session.reset_conversation()
+                await self.send(f"{Colors.BRIGHT_YELLOW}Conversation reset!{Colors.RESET}\n\n")
                 continue
             
             if user_input.lower() == '/help':
-                self.send(f"\n{Colors.BRIGHT_YELLOW}Commands:{Colors.RESET}\n")
-                self.send(f"  {Colors.BRIGHT_GREEN}/exit{Colors.RESET}  - Return to main menu\n")
-                self.send(f"  {Colors.BRIGHT_GREEN}/reset{Colors.RESET} - Clear conversation history\n")
-                self.send(f"  {Colors.BRIGHT_GREEN}/help{Colors.RESET}  - Show this help\n\n")
+                await self.send(f"\n{Colors.BRIGHT_YELLOW}Commands:{Colors.RESET}\n")
+                await self.send(f"  {Colors.BRIGHT_GREEN}/exit{Colors.RESET}  - Return to main menu\n")
+                await self.send(f"  {Colors.BRIGHT_GREEN}/reset{Colors.RESET} - Clear conversation history\n")
+                await self.send(f"  {Colors.BRIGHT_GREEN}/stats{Colors.RESET} - Show AI reply latency, prompt size and which model answered\n")
+                await self.send(f"  {Colors.BRIGHT_GREEN}/help{Colors.RESET}  - Show this help\n\n")
+                continue
+            
+            if user_input.lower() == '/stats':
+                await self.show_ai_stats()
                 continue
             
-            # Show thinking animation
-            self.send(f"{Colors.BRIGHT_MAGENTA}AI is thinking{Colors.RESET}")
-            for _ in range(3):
-                self.send(".")
-                time.sleep(0.3)
-            self.send("\n\n")
+            if AI_STREAM:
+                await self.stream_ai_reply(user_input)
+                continue
             
-            # Get AI response
-            response = self.ai_client.chat(user_input)
+            # Get AI response, showing the queue position while we wait
+            submitted = time.monotonic()
+            pending = asyncio.ensure_future(self.ai_session.chat(user_input))
+            try:
+                await self.wait_for_ai(pending)
+            finally:
+                if not pending.done():
+                    pending.cancel()
+            response = pending.result()
             
             # Display response with typing effect
-            self.send(f"{Colors.BRIGHT_MAGENTA}AI>{Colors.RESET} ")
-            self.typing_effect(response, delay=0.01)
-            self.send("\n\n")
-    
-    def show_message_boards(self):
-        """Display message boards (placeholder)"""
-        self.send(clear_screen())
-        self.send(f"{Colors.BRIGHT_CYAN}╔═══════════════════════════════════════════════════════════════════════════╗{Colors.RESET}\n")
-        self.send(f"{Colors.BRIGHT_CYAN}║{Colors.RESET}                        {Colors.BRIGHT_YELLOW}« MESSAGE BOARDS »{Colors.RESET}                                 {Colors.BRIGHT_CYAN}║{Colors.RESET}\n")
-        self.send(f"{Colors.BRIGHT_CYAN}╚═══════════════════════════════════════════════════════════════════════════╝{Colors.RESET}\n\n")
-        
-        boards = [
-            ("General Discussion", "42", "Talk about anything!"),
-            ("Tech Talk", "128", "Computers, coding, and more"),
-            ("AI & Future", "89", "Discuss AI and the future"),
-            ("Retro Computing", "156", "Old school tech nostalgia"),
-            ("Off Topic", "73", "Random stuff goes here"),
-        ]
+            await self.send(f"{Colors.BRIGHT_MAGENTA}AI>{Colors.RESET} ")
+            await self.flush()
+            self.ai_first_char_times.append(time.monotonic() - submitted)
+            await self.typing_effect(response, delay=0.01)
+            await self.send("\n\n")
+            await self.log_chat(user_input, response)
+    
+    async def wait_for_ai(self, pending):
+        """Animate the wait for an AI request until ``pending`` completes
         
-        for i, (name, posts, desc) in enumerate(boards, 1):
-            self.send(f"{Colors.BRIGHT_GREEN}[{i}]{Colors.RESET} {Colors.BRIGHT_WHITE}{name:<25}{Colors.RESET} ")
-            self.send(f"{Colors.BRIGHT_YELLOW}({posts} posts){Colors.RESET} - {Colors.BRIGHT_BLACK}{desc}{Colors.RESET}\n")
+        While the request is queued the caller sees a live place in line;
+        once it is running, thinking dots.
+        """
+        await asyncio.sleep(0)  # Let the request reach the scheduler queue
+        shown = None
+        dots = 0
+        while True:
+            position = self.ai_session.queue_position()
+            if position is not None:
+                if position != shown:
+                    await self.send(f"\r{Colors.BRIGHT_MAGENTA}Waiting for the AI: you are #{position} in line{Colors.RESET}\033[K")
+                    shown = position
+            elif shown != 'thinking':
+                prefix = "\r" if shown is not None else ""
+                await self.send(f"{prefix}{Colors.BRIGHT_MAGENTA}AI is thinking{Colors.RESET}")
+                if shown is not None:
+                    await self.send("\033[K")
+                shown = 'thinking'
+            elif dots < 40:
+                await self.send(".")
+                dots += 1
+            await self.flush()
+            done, _ = await asyncio.wait({pending}, timeout=0.3)
+            if done:
+                break
+        await self.send("\n\n")
+    
+    async def stream_ai_reply(self, user_input):
+        """Show the AI reply as it streams in
         
-        self.send(f"\n{Colors.BRIGHT_BLACK}[This is a demo - message boards coming soon!]{Colors.RESET}\n\n")
-        self.receive("Press ENTER to continue...")
+        The request goes out immediately; the queue position or thinking
+        dots play only until the first token arrives. Tokens are flushed at
+        most every AI_STREAM_RENDER_INTERVAL, except the first, which goes out
+        at once; a token inside the window goes out when the window ends, even
+        if the model stalls before the next one.
+        """
+        submitted = time.monotonic()
+        stream = self.ai_session.stream_chat(user_input)
+        pending = asyncio.ensure_future(anext(stream, None))
+        try:
+            await self.wait_for_ai(pending)
+            await self.send(f"{Colors.BRIGHT_MAGENTA}AI>{Colors.RESET} ")
+            
+            delta = pending.result()
+            reply = []
+            if delta is not None:
+                reply.append(delta)
+                await self.send(delta)
+                await self.flush()
+                self.ai_first_char_times.append(time.monotonic() - submitted)
+            while delta is not None:
+                delta = await anext(stream, None)
+                if delta is None:
+                    break
+                reply.append(delta)
+                await self.send(delta)
+                since_render = time.monotonic() - self.output.last_flush
+                if since_render >= AI_STREAM_RENDER_INTERVAL:
+                    await self.flush()
+                else:
+                    self.flush_later(AI_STREAM_RENDER_INTERVAL - since_render)
+            await self.send("\n\n")
+            await self.log_chat(user_input, "".join(reply))
+        finally:
+            if not pending.done():
+                pending.cancel()
+                try:
+                    await pending
+                except BaseException:
+                    pass
+            await stream.aclose()
+    
+    async def log_chat(self, question, answer):
+        """Keep a finished AI exchange so the caller can search it later
+
+        Only with BBS_SAVE_CHATS on, and not for Guest: that handle is
+        shared by every anonymous caller.
+        """
+        if not SAVE_CHATS or not answer or self.username == "Guest":
+            return
+        try:
+            await get_store().log_chat(self.username, question, answer)
+            get_search().notify()
+        except Exception as e:
+            count_error('chat_log', e)
+            log_error('chat_log', e, self.session_id)
+    
+    async def show_ai_stats(self):
+        """Show reply latency and prompt size for this session"""
+        times = self.ai_first_char_times
+        await self.send(f"\n{Colors.BRIGHT_YELLOW}AI latency (this session):{Colors.RESET}\n")
+        if not times:
+            await self.send(f"  {Colors.BRIGHT_BLACK}No replies yet{Colors.RESET}\n\n")
+            return
+        ordered = sorted(times)
+        await self.send(f"  Time to first character: last {times[-1]:.2f}s, "
+                        f"median {ordered[len(ordered) // 2]:.2f}s, worst {ordered[-1]:.2f}s "
+                        f"over {len(times)} replies\n")
+        prompt = self.ai_session.get_prompt_stats()
+        reported = prompt['reported_prompt_tokens']
+        reported = f", {reported} reported" if reported is not None else ""
+        summary = "with summary of earlier turns" if prompt['summarized'] else "no summary yet"
+        await self.send(f"  Last prompt: ~{prompt['estimated_prompt_tokens']} tokens{reported} "
+                        f"(history budget {prompt['budget']}, {prompt['verbatim_messages']} messages verbatim, "
+                        f"{summary})\n")
+        cache = self.ai_session.client.cache
+        if cache is not None:
+            stats = cache.stats()
+            await self.send(f"  Reply cache (all callers): {stats['hit_ratio']:.0%} hits "
+                            f"({stats['hits']} of {stats['hits'] + stats['misses']}, {stats['bypassed']} bypassed), "
+                            f"{stats['latency_saved']:.1f}s saved\n")
+        stats = self.ai_session.client.scheduler.stats()
+        await self.send(f"  AI queue (all callers): {stats['active']} of {stats['concurrency']} slots busy, "
+                        f"{stats['waiting']} waiting (peak {stats['peak_waiting']}), "
+                        f"mean wait {stats['mean_wait']:.2f}s, {stats['timed_out']} timed out\n")
+        log = self.ai_session.log
+        if log is not None:
+            stats = log.stats()
+            await self.send(f"  Saved conversations: {stats['handles']} callers, {stats['in_memory']} in memory, "
+                            f"{stats['records']} records in {stats['batches']} fsync'd batches\n")
+        if self.ai_session.model:
+            hedged = " after a hedge" if self.ai_session.hedged else ""
+            await self.send(f"  Last reply from: {self.ai_session.model}{hedged}\n")
+        router = self.ai_session.client.router
+        if len(router.models) > 1:
+            await self.send(f"  Models (all callers), time to first token:\n")
+            for model, stats in router.stats()['models'].items():
+                p50 = f"{stats['p50']:.2f}s" if stats['p50'] is not None else "-"
+                p90 = f"{stats['p90']:.2f}s" if stats['p90'] is not None else "-"
+                await self.send(f"    {model:<40} {stats['state']:<9} p50 {p50:>6} p90 {p90:>6} "
+                                f"errors {stats['error_rate']:4.0%} requests {stats['requests']}\n")
+        await self.send("\n")
+    
+    async def show_message_boards(self):
+        """Message boards: pick a board, browse its threads, read and post"""
+        self.begin_render('boards')
+        store = get_store()
+        while True:
+            boards = await store.boards()
+            await self.send(clear_screen())
+            await self.send(f"{Colors.BRIGHT_CYAN}╔═══════════════════════════════════════════════════════════════════════════╗{Colors.RESET}\n")
+            await self.send(f"{Colors.BRIGHT_CYAN}║{Colors.RESET}                        {Colors.BRIGHT_YELLOW}« MESSAGE BOARDS »{Colors.RESET}                                 {Colors.BRIGHT_CYAN}║{Colors.RESET}\n")
+            await self.send(f"{Colors.BRIGHT_CYAN}╚═══════════════════════════════════════════════════════════════════════════╝{Colors.RESET}\n\n")
+            
+            for i, board in enumerate(boards, 1):
+                await self.send(f"{Colors.BRIGHT_GREEN}[{i}]{Colors.RESET} {Colors.BRIGHT_WHITE}{board['name']:<25}{Colors.RESET} ")
+                await self.send(f"{Colors.BRIGHT_YELLOW}({board['post_count']} posts){Colors.RESET} - {Colors.BRIGHT_BLACK}{board['description']}{Colors.RESET}\n")
+            
+            choice = await self.receive(f"\n{Colors.BRIGHT_YELLOW}Board number, or ENTER to go back: {Colors.RESET}")
+            if not choice:
+                return
+            if choice.isdigit() and 1 <= int(choice) <= len(boards):
+                await self.show_board(boards[int(choice) - 1]['id'])
+    
+    async def show_board(self, board_id):
+        """Thread list of one board, newest activity first, a page at a time"""
+        store = get_store()
+        pages = [None]  # Cursor of every page seen so far, for going back
+        while True:
+            board = await store.board(board_id)
+            threads, next_page = await store.threads(board_id, before=pages[-1])
+            await self.send(clear_screen())
+            await self.send(f"{Colors.BRIGHT_CYAN}═══ {Colors.BRIGHT_YELLOW}{board['name']}{Colors.BRIGHT_CYAN} ═══{Colors.RESET} "
+                            f"{Colors.BRIGHT_BLACK}{board['thread_count']} threads, {board['post_count']} posts, "
+                            f"page {len(pages)}{Colors.RESET}\n\n")
+            if not threads:
+                await self.send(f"{Colors.BRIGHT_BLACK}No threads yet - be the first to post!{Colors.RESET}\n")
+            for i, thread in enumerate(threads, 1):
+                await self.send(f"{Colors.BRIGHT_GREEN}[{i:>2}]{Colors.RESET} {Colors.BRIGHT_WHITE}{thread['subject'][:40]:<40}{Colors.RESET} "
+                                f"{Colors.BRIGHT_CYAN}{thread['author'][:12]:<12}{Colors.RESET} "
+                                f"{Colors.BRIGHT_YELLOW}{thread['post_count']:>5}{Colors.RESET} "
+                                f"{Colors.BRIGHT_BLACK}{format_time(thread['last_post'])}{Colors.RESET}\n")
+            
+            commands = "[#] Read  [N] New thread"
+            if next_page is not None:
+                commands += "  [>] Next page"
+            if len(pages) > 1:
+                commands += "  [<] Previous page"
+            await self.send(f"\n{Colors.BRIGHT_BLACK}{commands}  [ENTER] Back{Colors.RESET}\n")
+            choice = (await self.receive(f"{Colors.BRIGHT_YELLOW}Command, or ENTER to go back: {Colors.RESET}")).lower()
+            
+            if not choice:
+                return
+            if choice == '>' and next_page is not None:
+                pages.append(next_page)
+            elif choice == '<' and len(pages) > 1:
+                pages.pop()
+            elif choice == 'n':
+                await self.post_thread(board_id)
+                pages = [None]
+            elif choice.isdigit() and 1 <= int(choice) <= len(threads):
+                await self.show_thread(threads[int(choice) - 1]['id'])
+    
+    async def show_thread(self, thread_id):
+        """Posts of one thread, oldest first, a page at a time"""
+        store = get_store()
+        pages = [None]
+        while True:
+            thread = await store.thread(thread_id)
+            posts, next_page = await store.posts(thread_id, after=pages[-1])
+            await self.send(clear_screen())
+            await self.send(f"{Colors.BRIGHT_CYAN}═══ {Colors.BRIGHT_WHITE}{thread['subject']}{Colors.BRIGHT_CYAN} ═══{Colors.RESET} "
+                            f"{Colors.BRIGHT_BLACK}{thread['post_count']} posts, page {len(pages)}{Colors.RESET}\n\n")
+            for post in posts:
+                await self.send(f"{Colors.BRIGHT_CYAN}── {post['author']}{Colors.RESET} "
+                                f"{Colors.BRIGHT_BLACK}{format_time(post['created'])}{Colors.RESET}\n")
+                await self.send(f"{post['body']}\n\n")
+            
+            commands = "[R] Reply"
+            if next_page is not None:
+                commands += "  [>] Next page"
+            if len(pages) > 1:
+                commands += "  [<] Previous page"
+            await self.send(f"{Colors.BRIGHT_BLACK}{commands}  [ENTER] Back{Colors.RESET}\n")
+            choice = (await self.receive(f"{Colors.BRIGHT_YELLOW}Command, or ENTER to go back: {Colors.RESET}")).lower()
+            
+            if not choice:
+                return
+            if choice == '>' and next_page is not None:
+                pages.append(next_page)
+            elif choice == '<' and len(pages) > 1:
+                pages.pop()
+            elif choice == 'r':
+                body = await self.compose()
+                if body:
+                    await store.reply(thread_id, self.username, body)
+                    get_search().notify()
+    
+    async def post_thread(self, board_id):
+        """Ask for a subject and a message and start a new thread"""
+        subject = await self.receive(f"\n{Colors.BRIGHT_YELLOW}Subject: {Colors.RESET}")
+        if not subject.strip():
+            return
+        body = await self.compose()
+        if body:
+            await get_store().new_thread(board_id, self.username, subject.strip(), body)
+            get_search().notify()
+    
+    async def compose(self):
+        """Read a message, one line at a time, until a line with a single '.'"""
+        await self.send(f"{Colors.BRIGHT_BLACK}Type your message. End with a line containing only '.' "
+                        f"({MAX_MESSAGE_LINES} lines max){Colors.RESET}\n")
+        lines = []
+        while len(lines) < MAX_MESSAGE_LINES:
+            line = await self.receive(f"{Colors.BRIGHT_BLACK}{len(lines) + 1:>2}:{Colors.RESET} ")
+            if line.strip() == '.':
+                break
+            lines.append(line)
+        return "\n".join(lines).strip()
     
-    def show_ascii_gallery(self):
+    async def show_search(self):
+        """Search board posts and this caller's own AI chats, best matches first"""
+        self.begin_render('search')
+        query = (await self.receive(f"\n{Colors.BRIGHT_YELLOW}Search for: {Colors.RESET}")).strip()
+        if not query:
+            return
+        search = get_search()
+        pages = [None]
+        while True:
+            results, next_page = await search.search(query, self.username, after=pages[-1],
+                                                     highlight=(Colors.BRIGHT_YELLOW, Colors.RESET))
+            await self.send(clear_screen())
+            await self.send(f"{Colors.BRIGHT_CYAN}═══ {Colors.BRIGHT_YELLOW}Search: {query}{Colors.BRIGHT_CYAN} ═══{Colors.RESET} "
+                            f"{Colors.BRIGHT_BLACK}page {len(pages)}{Colors.RESET}\n\n")
+            if not results:
+                await self.send(f"{Colors.BRIGHT_BLACK}No matches.{Colors.RESET}\n")
+            for i, row in enumerate(results, 1):
+                where = f"{row['board']} › {row['subject']}" if row['kind'] == 'post' else f"AI chat › {row['subject']}"
+                await self.send(f"{Colors.BRIGHT_GREEN}[{i:>2}]{Colors.RESET} {Colors.BRIGHT_WHITE}{where[:50]}{Colors.RESET} "
+                                f"{Colors.BRIGHT_BLACK}{row['author']} {format_time(row['created'])}{Colors.RESET}\n")
+                snippet = " ".join(row['snippet'].split())
+                await self.send(f"     {snippet}\n")
+            
+            commands = "[#] Open thread"
+            if next_page is not None:
+                commands += "  [>] Next page"
+            if len(pages) > 1:
+                commands += "  [<] Previous page"
+            await self.send(f"\n{Colors.BRIGHT_BLACK}{commands}  [ENTER] Back{Colors.RESET}\n")
+            choice = await self.receive(f"{Colors.BRIGHT_YELLOW}Command, or ENTER to go back: {Colors.RESET}")
+            
+            if not choice:
+                return
+            if choice == '>' and next_page is not None:
+                pages.append(next_page)
+            elif choice == '<' and len(pages) > 1:
+                pages.pop()
+            elif choice.isdigit() and 1 <= int(choice) <= len(results):
+                row = results[int(choice) - 1]
+                if row['kind'] == 'post':
+                    await self.show_thread(row['ref'])
+    
+    async def show_rooms(self):
+        """Teleconference: list the rooms and join one"""
+        self.begin_render('rooms')
+        rooms = get_rooms()
+        await self.send(clear_screen())
+        await self.send(f"{Colors.BRIGHT_CYAN}╔═══════════════════════════════════════════════════════════════════════════╗{Colors.RESET}\n")
+        await self.send(f"{Colors.BRIGHT_CYAN}║{Colors.RESET}                        {Colors.BRIGHT_YELLOW}« TELECONFERENCE »{Colors.RESET}                                 {Colors.BRIGHT_CYAN}║{Colors.RESET}\n")
+        await self.send(f"{Colors.BRIGHT_CYAN}╚═══════════════════════════════════════════════════════════════════════════╝{Colors.RESET}\n\n")
+        for name, members in rooms.listing():
+            await self.send(f"  {Colors.BRIGHT_WHITE}{name:<20}{Colors.RESET} {Colors.BRIGHT_YELLOW}{members} online{Colors.RESET}\n")
+        name = await self.receive(f"\n{Colors.BRIGHT_YELLOW}Room to join or create (ENTER for lobby, '.' to go back): {Colors.RESET}")
+        if name.strip() == '.':
+            return
+        await self.chat_room(rooms.room(name))
+    
+    async def chat_room(self, room):
+        """Live chat: lines from the room appear above the caller's prompt as they arrive"""
+        member = room.join(self.username)
+        self.idle_since = asyncio.get_running_loop().time()
+        prompt = f"{Colors.BRIGHT_CYAN}{room.name}>{Colors.RESET} "
+        await self.send(clear_screen())
+        await self.send(f"{Colors.BRIGHT_YELLOW}You are in {room.name} with {room.count() - 1} other caller(s).{Colors.RESET}\n")
+        await self.send(f"{Colors.BRIGHT_BLACK}{ROOM_HELP}{Colors.RESET}\n\n")
+        await self.send(prompt)
+        line = []
+        try:
+            while True:
+                if member.pending():
+                    # Erase the prompt, print what arrived, then put the prompt and typing back
+                    await self.send("\r\033[K")
+                    for payload in member.take():
+                        await self.send(payload)
+                    if member.kicked:
+                        await self.send(f"{Colors.BRIGHT_RED}You were removed from {room.name}.{Colors.RESET}\n")
+                        await self.pause(2)
+                        return
+                    await self.send(prompt + "".join(line))
+                if self.input.has_input():
+                    finished, echo = self.edit_line(line)
+                    if echo:
+                        await self.send(echo)
+                    if finished:
+                        text = "".join(line).strip()
+                        line = []
+                        if text.lower() in ('/quit', '/exit'):
+                            return
+                        await self.room_command(room, member, text)
+                        await self.send(prompt)
+                    continue
+                await self.wait_for_activity(member)
+        finally:
+            get_rooms().leave(room, member)
+    
+    async def room_command(self, room, member, text):
+        """Handle one line typed in a room"""
+        if not text:
+            return
+        command, _, rest = text.partition(' ')
+        command = command.lower()
+        if command == '/who':
+            names = ", ".join(room.handles())
+            await self.send(f"{Colors.BRIGHT_BLACK}In {room.name}: {names}{Colors.RESET}\n")
+        elif command == '/me' and rest:
+            room.emote(member, rest)
+        elif command == '/ai' and ROOM_AI and rest:
+            room.say(member, text)
+            if not room.ask_ai(member.handle, rest):
+                await self.send(f"{Colors.BRIGHT_BLACK}The AI is still answering the last question.{Colors.RESET}\n")
+        elif command.startswith('/'):
+            await self.send(f"{Colors.BRIGHT_BLACK}{ROOM_HELP}{Colors.RESET}\n")
+        else:
+            room.say(member, text)
+    
+    async def wait_for_activity(self, member):
+        """Sleep until the caller types something or the room has lines for us"""
+        await self.flush()
+        if member.pending() or self.input.has_input():
+            return
+        if self._input_closed:
+            raise ClientDisconnected()
+        self._input_wanted.set()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiter = waiter
+        member.waiter = waiter
+        try:
+            # Lines from the room do not count as activity, only typing does
+            await self.wait_idle(waiter)
+        finally:
+            self._waiter = None
+            member.waiter = None
+    
+    async def show_ascii_gallery(self):
         """Display ASCII art gallery"""
-        self.send(clear_screen())
-        self.send(f"{Colors.BRIGHT_CYAN}╔═══════════════════════════════════════════════════════════════════════════╗{Colors.RESET}\n")
-        self.send(f"{Colors.BRIGHT_CYAN}║{Colors.RESET}                      {Colors.BRIGHT_YELLOW}« ASCII ART GALLERY »{Colors.RESET}                                {Colors.BRIGHT_CYAN}║{Colors.RESET}\n")
-        self.send(f"{Colors.BRIGHT_CYAN}╚═══════════════════════════════════════════════════════════════════════════╝{Colors.RESET}\n\n")
+        self.begin_render('gallery')
+        await self.send(clear_screen())
+        await self.send(f"{Colors.BRIGHT_CYAN}╔═══════════════════════════════════════════════════════════════════════════╗{Colors.RESET}\n")
+        await self.send(f"{Colors.BRIGHT_CYAN}║{Colors.RESET}                      {Colors.BRIGHT_YELLOW}« ASCII ART GALLERY »{Colors.RESET}                                {Colors.BRIGHT_CYAN}║{Colors.RESET}\n")
+        await self.send(f"{Colors.BRIGHT_CYAN}╚═══════════════════════════════════════════════════════════════════════════╝{Colors.RESET}\n\n")
         
         arts = [COMPUTER_ART, ROBOT_ART]
         
-        for art in arts:
-            self.send(art)
-            self.send("\n")
-            time.sleep(1)
+        await self.animate([(art + "\n", 1) for art in arts])
         
-        self.receive("\nPress ENTER to continue...")
+        await self.receive("\nPress ENTER to continue...")
     
-    def show_system_info(self):
+    async def show_system_info(self):
         """Display system information"""
-        self.send(clear_screen())
-        self.send(f"{Colors.BRIGHT_CYAN}╔═══════════════════════════════════════════════════════════════════════════╗{Colors.RESET}\n")
-        self.send(f"{Colors.BRIGHT_CYAN}║{Colors.RESET}                     {Colors.BRIGHT_YELLOW}« SYSTEM INFORMATION »{Colors.RESET}                                {Colors.BRIGHT_CYAN}║{Colors.RESET}\n")
-        self.send(f"{Colors.BRIGHT_CYAN}╚═══════════════════════════════════════════════════════════════════════════╝{Colors.RESET}\n\n")
+        self.begin_render('system_info')
+        await self.send(clear_screen())
+        await self.send(f"{Colors.BRIGHT_CYAN}╔═══════════════════════════════════════════════════════════════════════════╗{Colors.RESET}\n")
+        await self.send(f"{Colors.BRIGHT_CYAN}║{Colors.RESET}                     {Colors.BRIGHT_YELLOW}« SYSTEM INFORMATION »{Colors.RESET}                                {Colors.BRIGHT_CYAN}║{Colors.RESET}\n")
+        await self.send(f"{Colors.BRIGHT_CYAN}╚═══════════════════════════════════════════════════════════════════════════╝{Colors.RESET}\n\n")
         
         # Get AI model info if available
         ai_model = "Not connected"
-        if self.ai_client:
-            ai_model = self.ai_client.get_model_name()
+        if self.ai_session:
+            ai_model = self.ai_session.get_model_name()
+            if self.ai_session.model:
+                ai_model += " (answered your last message" + (", hedged)" if self.ai_session.hedged else ")")
         
         info = [
             ("BBS Name", "AI BBS (Retro Edition)"),
@@ -280,27 +976,59 @@ class BBSHandler(socketserver.BaseRequestHandler):
             ("Established", "2026"),
             ("AI Provider", "OpenRouter (Free Tier)"),
             ("AI Model", ai_model),
+            ("AI Routing", self.routing_info()),
             ("Your Handle", self.username),
             ("Connection", f"{self.client_address[0]}:{self.client_address[1]}"),
+            ("Callers Online", str(get_presence().count())),
+            ("Output", self.output_info()),
+            ("Compression", self.compression_info()),
             ("Server Time", datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
             ("Uptime", "Running in Docker"),
         ]
         
         for key, value in info:
-            self.send(f"{Colors.BRIGHT_GREEN}{key:.<30}{Colors.RESET} {Colors.BRIGHT_WHITE}{value}{Colors.RESET}\n")
+            await self.send(f"{Colors.BRIGHT_GREEN}{key:.<30}{Colors.RESET} {Colors.BRIGHT_WHITE}{value}{Colors.RESET}\n")
         
-        self.send(f"\n{Colors.BRIGHT_YELLOW}« Powered by Python & OpenRouter AI »{Colors.RESET}\n\n")
-        self.receive("Press ENTER to continue...")
+        await self.send(f"\n{Colors.BRIGHT_YELLOW}« Powered by Python & OpenRouter AI »{Colors.RESET}\n\n")
+        await self.receive("Press ENTER to continue...")
     
-    def show_easter_eggs(self):
+    def routing_info(self):
+        """How many models the AI client routes between, and how often it hedged"""
+        if not self.ai_session:
+            return "Not connected"
+        router = self.ai_session.client.router
+        if len(router.models) == 1:
+            return "Single model"
+        up = sum(1 for m in router.models if router.profiles[m].available())
+        return (f"{up} of {len(router.models)} models up, {router.hedges} of {router.requests} "
+                f"requests hedged ({router.hedges_won} won by the hedge)")
+
+    def output_info(self):
+        """How well this session's output was batched into writes"""
+        stats = self.output.stats()
+        return (f"{stats['messages']} messages in {stats['writes']} writes, "
+                f"{stats['bytes_per_write']:.0f} bytes per write")
+
+    def compression_info(self):
+        """MCCP2 ratio and CPU cost so far for this session"""
+        compression = self.output.compression
+        if compression is None:
+            return "Off"
+        stats = compression.stats()
+        state = "MCCP2" if self.output.compressor is not None else "MCCP2 (ended)"
+        return (f"{state} {stats['ratio']:.1f}:1, {stats['bytes_in'] // 1024} KB sent as "
+                f"{stats['bytes_out'] // 1024} KB, {stats['cpu'] * 1000:.1f} ms CPU")
+
+    async def show_easter_eggs(self):
         """Display easter eggs menu"""
-        self.send(clear_screen())
-        self.send(f"{Colors.BRIGHT_CYAN}╔═══════════════════════════════════════════════════════════════════════════╗{Colors.RESET}\n")
-        self.send(f"{Colors.BRIGHT_CYAN}║{Colors.RESET}                        {Colors.BRIGHT_YELLOW}« EASTER EGGS »{Colors.RESET}                                    {Colors.BRIGHT_CYAN}║{Colors.RESET}\n")
-        self.send(f"{Colors.BRIGHT_CYAN}╚═══════════════════════════════════════════════════════════════════════════╝{Colors.RESET}\n\n")
+        self.begin_render('easter_eggs')
+        await self.send(clear_screen())
+        await self.send(f"{Colors.BRIGHT_CYAN}╔═══════════════════════════════════════════════════════════════════════════╗{Colors.RESET}\n")
+        await self.send(f"{Colors.BRIGHT_CYAN}║{Colors.RESET}                        {Colors.BRIGHT_YELLOW}« EASTER EGGS »{Colors.RESET}                                    {Colors.BRIGHT_CYAN}║{Colors.RESET}\n")
+        await self.send(f"{Colors.BRIGHT_CYAN}╚═══════════════════════════════════════════════════════════════════════════╝{Colors.RESET}\n\n")
         
-        self.send(EASTER_EGG_MATRIX)
-        self.send("\n")
+        await self.send(EASTER_EGG_MATRIX)
+        await self.send("\n")
         
         # Fun retro messages
         messages = [
@@ -311,176 +1039,582 @@ class BBSHandler(socketserver.BaseRequestHandler):
             "⌨️  Press F to pay respects",
         ]
         
-        for msg in messages:
-            self.send(f"{Colors.BRIGHT_YELLOW}★{Colors.RESET} {msg}\n")
-            time.sleep(0.5)
+        await self.animate([(f"{Colors.BRIGHT_YELLOW}★{Colors.RESET} {msg}\n", 0.5) for msg in messages])
         
-        self.send(f"\n{Colors.BRIGHT_BLACK}[More secrets hidden throughout the BBS...]{Colors.RESET}\n\n")
-        self.receive("Press ENTER to continue...")
+        await self.send(f"\n{Colors.BRIGHT_BLACK}[More secrets hidden throughout the BBS...]{Colors.RESET}\n\n")
+        await self.receive("Press ENTER to continue...")
     
-    def handle(self):
+    async def handle(self):
         """Main handler for BBS connection"""
+        SESSIONS.labels(self.protocol).inc()
+        self.task = asyncio.current_task()
+        _sessions[self.session_id] = self
+        log_event('connect', self.session_id, protocol=self.protocol,
+                  address=self.client_address[0] if self.client_address else None)
         try:
+            self.start_input()
+            
             # Negotiate Telnet options (force character mode)
-            self.negotiate_telnet()
+            await self.negotiate_telnet()
             
             # Show welcome screen
-            self.show_welcome()
+            await self.show_welcome()
             
             # Main menu loop
             while True:
-                self.show_main_menu()
-                choice = self.receive(f"{Colors.BRIGHT_YELLOW}Enter your choice: {Colors.RESET}")
+                await self.show_main_menu()
+                choice = await self.receive(f"{Colors.BRIGHT_YELLOW}Enter your choice: {Colors.RESET}")
+                log_event('menu', self.session_id, choice=choice[:20])
                 
                 if choice == '1':
-                    self.chat_with_ai()
+                    await self.chat_with_ai()
                 elif choice == '2':
-                    self.show_message_boards()
+                    await self.show_message_boards()
                 elif choice == '3':
-                    self.show_ascii_gallery()
+                    await self.show_ascii_gallery()
                 elif choice == '4':
-                    self.show_system_info()
+                    await self.show_system_info()
                 elif choice == '5':
-                    self.show_easter_eggs()
+                    await self.show_easter_eggs()
+                elif choice == '6':
+                    await self.show_search()
+                elif choice == '7':
+                    await self.show_rooms()
                 elif choice.lower() in ['q', 'quit', 'exit']:
                     break
                 else:
-                    self.send(f"\n{Colors.BRIGHT_RED}Invalid choice! Please try again.{Colors.RESET}\n")
-                    time.sleep(1)
+                    await self.send(f"\n{Colors.BRIGHT_RED}Invalid choice! Please try again.{Colors.RESET}\n")
+                    await self.pause(1)
             
             # Show goodbye screen
-            self.send(clear_screen())
-            self.send(GOODBYE)
-            time.sleep(3)
+            await self.send(clear_screen())
+            await self.send(GOODBYE)
+            await self.pause(3)
             
+        except ClientDisconnected:
+            pass
         except Exception as e:
-            print(f"Error in handler: {e}")
+            count_error('handler', e)
+            log_error('handler', e, self.session_id)
         finally:
-            self.request.close()
+            SESSIONS.labels(self.protocol).dec()
+            del _sessions[self.session_id]
+            log_event('disconnect', self.session_id, handle=self.username,
+                      seconds=round(time.monotonic() - self.connected, 1), bytes_out=self.output.bytes_out)
+            if self.trace is not None:
+                self.set_trace(None)
+            if self.logged_in:
+                get_presence().logout(self.username)
+            if self._input_task is not None:
+                self._input_task.cancel()
+            try:
+                self.write_pending()
+                if self.output.compressor is not None:
+                    self.writer.write(self.output.end_compression())
+            except Exception:
+                pass
+            self.writer.close()
 
 
-class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    """Threaded TCP server for handling multiple connections"""
-    allow_reuse_address = True
+# Paramiko handshakes block, so they run on a small dedicated pool instead of
+# the loop's default executor (which the AI calls use)
+SSH_HANDSHAKE_WORKERS = int(os.getenv('SSH_HANDSHAKE_WORKERS', 32))
+SSH_HANDSHAKE_EXECUTOR = ThreadPoolExecutor(max_workers=SSH_HANDSHAKE_WORKERS, thread_name_prefix='ssh-handshake')
 
+# Connections allowed to wait for a handshake worker; past that they are closed at once
+SSH_HANDSHAKE_BACKLOG = int(os.getenv('SSH_HANDSHAKE_BACKLOG', 128))
 
-class ParamikoSocketAdapter:
-    """Adapts a Paramiko channel to look like a socket for BBSHandler"""
-    def __init__(self, channel):
-        self.channel = channel
-        self.is_ssh = True
+# Seconds from accept until the caller must have a shell channel open (queueing included)
+SSH_HANDSHAKE_TIMEOUT = float(os.getenv('SSH_HANDSHAKE_TIMEOUT', 10))
 
-    def sendall(self, data):
-        sent = 0
-        while sent < len(data):
-            n = self.channel.send(data[sent:])
-            if n == 0:
-                raise RuntimeError("Channel closed")
-            sent += n
+# SSH handshake counters for this process
+ssh_stats = {'pending': 0, 'completed': 0, 'failed': 0, 'timed_out': 0, 'rejected': 0}
 
-    def recv(self, n):
-        return self.channel.recv(n)
+# Strong references to running session tasks (the loop only keeps weak ones)
+_session_tasks = set()
 
-    def close(self):
-        self.channel.close()
+# Sessions by id, for the sysop's admin socket
+_sessions = {}
+_session_ids = itertools.count(1)
 
 
-class BBS_SSHInterface(paramiko.ServerInterface):
-    """Handle SSH authentication and channel requests"""
-    def check_channel_request(self, kind, chanid):
-        if kind == 'session':
-            return paramiko.OPEN_SUCCEEDED
-        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+def spawn_session(coro):
+    """Schedule a session coroutine and keep it alive until it finishes"""
+    task = asyncio.get_running_loop().create_task(coro)
+    _session_tasks.add(task)
+    task.add_done_callback(_session_tasks.discard)
+    return task
 
-    def check_auth_password(self, username, password):
-        return paramiko.AUTH_SUCCESSFUL
 
-    def check_auth_none(self, username):
-        return paramiko.AUTH_SUCCESSFUL
-    
-    def get_allowed_auths(self, username):
-        return 'none,password'
-    
-    def check_channel_shell_request(self, channel):
-        return True
+def admit_connection(ip):
+    """Count a new connection from ``ip``; False if that address is at MAX_PER_IP on all workers"""
+    addresses = get_addresses()
+    if MAX_PER_IP and addresses.count(ip) >= MAX_PER_IP:
+        limit_stats['per_ip_rejected'] += 1
+        return False
+    addresses.add(ip)
+    return True
 
-    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
-        return True
 
+def release_connection(ip):
+    get_addresses().remove(ip)
 
-def handle_ssh_connection(client_sock, host_key):
-    """Handle a single SSH connection"""
-    transport = paramiko.Transport(client_sock)
+
+async def handle_telnet_connection(reader, writer):
+    """asyncio.start_server callback: one coroutine per telnet caller"""
+    client_addr = writer.get_extra_info('peername')
+    ip = client_addr[0] if client_addr else None
+    ACCEPTS.labels('telnet').inc()
+    if not admit_connection(ip):
+        writer.write(b"Too many connections from your address, try again later.\r\n")
+        writer.close()
+        return
     try:
-        transport.add_server_key(host_key)
-        server = BBS_SSHInterface()
+        await BBSHandler(reader, writer, client_addr).handle()
+    except asyncio.CancelledError:
+        pass  # Hung up at shutdown; asyncio would report it as an error of this callback
+    finally:
+        release_connection(ip)
+
+
+class ParamikoChannelAdapter:
+    """Bridges a Paramiko channel onto the event loop for BBSHandler
+
+    Incoming data is pushed into an ``asyncio.StreamReader`` from a loop reader
+    callback on the channel's poll pipe, and the object itself implements the
+    StreamWriter subset the handler uses, so no thread sits blocked in
+    ``recv`` per SSH caller.
+    """
+    def __init__(self, channel, peername, loop):
+        self.channel = channel
+        self.peername = peername
+        self.loop = loop
+        self.reader = asyncio.StreamReader()
+        self._pending = bytearray()
+        self._fileno = channel.fileno()
+        channel.setblocking(0)
+        loop.add_reader(self._fileno, self._on_readable)
+
+    def _on_readable(self):
         try:
-            transport.start_server(server=server)
-        except paramiko.SSHException:
+            data = self.channel.recv(65536)
+        except socket.timeout:
             return
+        if data:
+            self.reader.feed_data(data)
+        else:
+            self.loop.remove_reader(self._fileno)
+            self.reader.feed_eof()
+
+    def write(self, data):
+        self._pending += data
+        self._send_ready_data()
+
+    def _send_ready_data(self):
+        """Push as much pending data as the channel window takes right now"""
+        try:
+            while self._pending and not self.channel.closed and self.channel.send_ready():
+                n = self.channel.send(bytes(self._pending))
+                if n <= 0:
+                    break
+                del self._pending[:n]
+        except (socket.timeout, OSError):
+            pass
+
+    async def drain(self):
+        while self._pending:
+            if self.channel.closed:
+                raise ConnectionResetError("Channel closed")
+            if not self.channel.send_ready():
+                await asyncio.sleep(0.01)
+                continue
+            try:
+                n = self.channel.send(bytes(self._pending))
+            except socket.timeout:
+                await asyncio.sleep(0.01)
+                continue
+            del self._pending[:n]
 
-        # Wait for a channel
-        channel = transport.accept(20)
+    def get_extra_info(self, name, default=None):
+        if name == 'peername':
+            return self.peername
+        return default
+
+    def get_write_buffer_size(self):
+        return len(self._pending)
+
+    def close(self):
+        self.loop.remove_reader(self._fileno)
+        self.channel.close()
+
+
+def handshake_finished(future):
+    """An SSH handshake thread is done, whether or not its connection still waits for it"""
+    ssh_stats['pending'] -= 1
+    if not future.cancelled():
+        future.exception()  # Retrieved, so an abandoned failure is not reported as lost
+
+
+async def handle_ssh_connection(client_sock, host_keys, ip=None):
+    """Handle a single SSH connection (``ip`` is released from the per-IP count at the end)"""
+    loop = asyncio.get_running_loop()
+    accepted = time.perf_counter()
+    if ssh_stats['pending'] >= SSH_HANDSHAKE_WORKERS + SSH_HANDSHAKE_BACKLOG:
+        ssh_stats['rejected'] += 1
+        client_sock.close()
+        release_connection(ip)
+        return
+    # Already imported off the loop by run_ssh_server
+    import paramiko
+    from ssh_transport import ssh_handshake
+
+    client_sock.setblocking(True)
+    transport = paramiko.Transport(client_sock)
+    try:
+        deadline = time.monotonic() + SSH_HANDSHAKE_TIMEOUT
+        handshake = loop.run_in_executor(SSH_HANDSHAKE_EXECUTOR, ssh_handshake, transport, host_keys, deadline)
+        # Counted until its thread is done, which can be after we stop waiting for it
+        ssh_stats['pending'] += 1
+        handshake.add_done_callback(handshake_finished)
+        try:
+            channel = await asyncio.wait_for(asyncio.shield(handshake), SSH_HANDSHAKE_TIMEOUT + 1)
+        except asyncio.TimeoutError:
+            channel = None
+        result = 'completed' if channel is not None else 'timed_out' if time.monotonic() >= deadline else 'failed'
+        ssh_stats[result] += 1
+        SSH_HANDSHAKE_SECONDS.labels(result).observe(time.perf_counter() - accepted)
         if channel is None:
             return
         
-        # Simple wait for the client to be ready (shell/pty negotiation handled by callbacks)
-        # BBSHandler expects a synchronous socket-like object
-        adapter = ParamikoSocketAdapter(channel)
+        # Shell/pty negotiation is handled by the interface callbacks; from here
+        # on the session runs on the event loop like a telnet caller
         client_addr = client_sock.getpeername()
+        adapter = ParamikoChannelAdapter(channel, client_addr, loop)
         
         try:
             # BBSHandler handles the entire session
-            BBSHandler(adapter, client_addr, None)
+            await BBSHandler(adapter.reader, adapter, client_addr, is_ssh=True).handle()
         except Exception as e:
-            print(f"SSH Handler Error: {e}")
+            count_error('ssh_session', e)
+            log_error('ssh_session', e)
         finally:
             adapter.close()
             
     except Exception as e:
-        print(f"SSH Transport Error: {e}")
+        count_error('ssh_transport', e)
+        log_error('ssh_transport', e, address=ip)
     finally:
         transport.close()
         client_sock.close()
+        release_connection(ip)
 
 
-def run_ssh_server(port, host_key_path='data/ssh_host_key'):
-    """Main loop for SSH server"""
-    # Load or generate host key
-    # Ensure data directory exists
-    os.makedirs(os.path.dirname(host_key_path), exist_ok=True)
-    
-    if not os.path.exists(host_key_path):
-        print(f"Generating SSH host key at {host_key_path}...")
-        key = paramiko.RSAKey.generate(2048)
-        key.write_private_key_file(host_key_path)
-    
-    host_key = paramiko.RSAKey(filename=host_key_path)
+def load_ssh_host_keys(key_dir):
+    """Import paramiko and load (on first start, generate) the host keys; runs on a worker thread"""
+    from ssh_transport import load_host_keys
+    return load_host_keys(key_dir)
+
+
+async def run_ssh_server(port, key_dir='data', listening=None, sock=None):
+    """Accept loop for the SSH server; sets the ``listening`` event once it accepts
+
+    ``sock`` is a listening socket to accept on instead of binding ``port``
+    (one inherited from the supervisor). Cancelling the task stops
+    accepting; sessions already running carry on.
+    """
+    loop = asyncio.get_running_loop()
+    host_keys = await loop.run_in_executor(None, load_ssh_host_keys, key_dir)
     
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    sock.bind(('0.0.0.0', port))
-    sock.listen(100)
+    if sock is None:
+        sock = bind_listener('0.0.0.0', port)
+    sock.setblocking(False)
     
-    print(f"SSH Server listening on 0.0.0.0:{port}")
+    if WORKER_ID == 0:
+        print(f"SSH Server listening on 0.0.0.0:{port}")
+    if listening is not None:
+        listening.set()
     
-    while True:
+    try:
+        while True:
+            try:
+                client, addr = await loop.sock_accept(sock)
+                ACCEPTS.labels('ssh').inc()
+                if not admit_connection(addr[0]):
+                    client.close()
+                    continue
+                spawn_session(handle_ssh_connection(client, host_keys, addr[0]))
+            except Exception as e:
+                count_error('ssh_accept', e)
+                log_error('ssh_accept', e)
+    finally:
+        sock.close()
+
+
+def bind_listener(host, port):
+    """A listening TCP socket with the full accept backlog"""
+    return socket.create_server((host, port), backlog=socket.SOMAXCONN)
+
+
+async def hang_up_sessions(notice, timeout=5):
+    """Show every caller ``notice`` and end their sessions; returns how many there were
+
+    Sessions unwind through their own cleanup (so their turns are saved and
+    their disconnects logged); any still running after ``timeout`` seconds
+    are cancelled, as are SSH handshakes that have not become sessions.
+    """
+    handlers = list(_sessions.values())
+    tasks = {handler.task for handler in handlers if handler.task is not None}
+    for task in _session_tasks - tasks:
+        task.cancel()
+    for handler in handlers:
+        handler.notice(notice)
+        handler.hang_up()
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending, timeout=1)
+    return len(handlers)
+
+
+def countdown(seconds):
+    seconds = max(0, round(seconds))
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def restart_notice(seconds, stopping=False):
+    if stopping:
+        return (f"The BBS is shutting down. This line closes in {countdown(seconds)} - "
+                f"please finish up; your chats and posts are kept.")
+    return (f"The BBS is being updated. This line closes in {countdown(seconds)} - "
+            f"call back any time to reach the new version; your chats and posts are kept.")
+
+
+async def drain_sessions(seconds=DRAIN_SECONDS, stopping=False):
+    """Let this process's callers finish, counting down to them, then hang up on the rest
+
+    Returns once no session (or SSH handshake) is left, with how many were hung up on.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + seconds
+    reminders = [r for r in DRAIN_REMINDERS if r < seconds]
+    await asyncio.sleep(0.1)  # Connections accepted just before the listener closed start their sessions
+    for handler in list(_sessions.values()):
+        handler.notice(restart_notice(seconds, stopping))
+    while _sessions or _session_tasks:
+        left = deadline - loop.time()
+        if left <= 0:
+            break
+        if reminders and left <= reminders[0] + 0.5:
+            reminders.pop(0)
+            for handler in list(_sessions.values()):
+                handler.notice(restart_notice(left, stopping))
+        await asyncio.sleep(min(1.0, left))
+    return await hang_up_sessions("The BBS is shutting down now. Please call back later!" if stopping else
+                                  "The BBS is restarting now. Please call back - see you in a moment!")
+
+
+@REGISTRY.collector
+def server_metrics():
+    """Counters the server already keeps, read at scrape time"""
+    return [
+        ('bbs_ssh_handshakes_pending', 'gauge', "SSH handshakes running or waiting for a worker",
+         [({}, ssh_stats['pending'])]),
+        ('bbs_ssh_handshakes_total', 'counter', "SSH handshakes by result (rejected: backlog full)",
+         [({'result': k}, v) for k, v in ssh_stats.items() if k != 'pending']),
+        ('bbs_session_limits_total', 'counter', "Sessions cut off or input trimmed by a limit",
+         [({'limit': k}, v) for k, v in limit_stats.items()]),
+        ('bbs_callers_online', 'gauge', "Logged-in callers on all workers", [({}, get_presence().count())]),
+    ] + event_log_metrics()
+
+
+def event_log_metrics():
+    event_log = get_event_log()
+    if event_log is None:
+        return []
+    stats = event_log.stats()
+    return [
+        ('bbs_log_records_total', 'counter', "Event log records queued", [({}, stats['records'])]),
+        ('bbs_log_records_dropped_total', 'counter', "Event log records dropped on a full queue",
+         [({}, stats['dropped'])]),
+        ('bbs_log_queue_length', 'gauge', "Event log records waiting for the writer", [({}, stats['queued'])]),
+        ('bbs_log_batches_total', 'counter', "Event log batches written", [({}, stats['batches'])]),
+        ('bbs_log_bytes_total', 'counter', "Event log bytes written", [({}, stats['bytes_written'])]),
+        ('bbs_log_rotations_total', 'counter', "Event log files rotated", [({}, stats['rotations'])]),
+        ('bbs_log_write_errors_total', 'counter', "Event log batches lost to a failed write",
+         [({}, stats['write_errors'])]),
+    ]
+
+
+def raise_fd_limit():
+    """Lift the soft open-file limit to the hard limit (one fd per caller, two more per SSH channel)"""
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or hard > soft:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError) as e:
+        print(f"Could not raise open file limit: {e}")
+
+
+async def load_ai():
+    """ai_client's get_client; the first call imports it (and openai) on a worker thread"""
+    module = sys.modules.get('ai_client')
+    if module is None:
+        module = await asyncio.get_running_loop().run_in_executor(None, importlib.import_module, 'ai_client')
+    return module.get_client
+
+
+async def prewarm_ai(after=None):
+    """Create the shared AI client and open its first pooled connections
+
+    Waits for the ``after`` event first (for a few seconds at most), so that
+    importing openai does not hold up the SSH listener.
+    """
+    if after is not None:
         try:
-            client, addr = sock.accept()
-            t = threading.Thread(target=handle_ssh_connection, args=(client, host_key))
-            t.daemon = True
-            t.start()
-        except Exception as e:
-            print(f"Error accepting SSH connection: {e}")
+            await asyncio.wait_for(after.wait(), 5)
+        except asyncio.TimeoutError:
+            pass
+    try:
+        client = (await load_ai())()
+    except ValueError as e:
+        print(f"AI not available: {e}")
+        return
+    warmed = await client.warm_up()
+    print(f"AI connection pool ready ({warmed} warm of max {client.max_connections})")
+
+
+async def serve(host, port, ssh_port):
+    """Run the telnet and SSH servers on one event loop
+
+    Telnet listens first; paramiko, the SSH host keys, the AI client and
+    the conversation log are loaded after it, mostly on worker threads.
+    Under the supervisor the listening sockets are inherited; once both
+    accept, the worker tells the supervisor it is ready, and a 'drain' from
+    the supervisor (a reload replaced it, or the supervisor is stopping)
+    makes it stop accepting, let its callers finish and return. SIGTERM
+    and SIGINT hang up on the callers and return; either way the
+    conversation and event logs are written out.
+    """
+    get_store()  # Open (and on first start create) the board database
+    event_log = get_event_log()
+    link = get_link()
+    if link is not None:
+        await link.start()
+        get_rooms().attach(link)
+        get_presence().attach(link)
+        get_addresses().attach(link)
+    telnet_sock, ssh_sock = inherited_listeners() or (None, None)
+    if telnet_sock is not None:
+        server = await asyncio.start_server(handle_telnet_connection, sock=telnet_sock, backlog=socket.SOMAXCONN)
+    else:
+        server = await asyncio.start_server(handle_telnet_connection, host, port, backlog=socket.SOMAXCONN)
+    metrics_task = None
+    if METRICS_PORT:
+        metrics_task = asyncio.create_task(serve_metrics(METRICS_PORT + WORKER_ID, wait=10 if link else 0))
+    admin_server = None
+    if ADMIN_SOCKET:
+        try:
+            admin_server = await AdminServer(lambda: _sessions).start(admin_socket_path())
+        except OSError as e:
+            print(f"Admin socket not started: {e}")
+    ssh_listening = asyncio.Event()
+    ssh_task = asyncio.create_task(run_ssh_server(ssh_port, listening=ssh_listening, sock=ssh_sock))
+    warm_task = asyncio.create_task(prewarm_ai(after=ssh_listening))
+    if WORKER_ID == 0:
+        # One indexer per search database; other workers' posts are picked up on its next pass
+        get_search().start()
+    conversations = get_conversations()  # Indexes the log in the background
+    if conversations is not None:
+        REGISTRY.collector(conversations.metrics)
+        if link is None:
+            conversations.compact()  # Queued behind the index scan, ahead of any load
+
+    def stop_accepting():
+        server.close()
+        ssh_task.cancel()
+        if metrics_task is not None:
+            metrics_task.cancel()
+            if metrics_task.done() and not metrics_task.cancelled() and metrics_task.result() is not None:
+                metrics_task.result().close()
+        if admin_server is not None:
+            admin_server.close()
+        if WORKER_ID == 0:
+            get_search().stop()
+
+    async def drain(seconds, stopping):
+        print(f"Worker {WORKER_ID}: {'stopping' if stopping else 'replaced by a reload'}, "
+              f"draining {len(_sessions)} sessions")
+        log_event('drain', sessions=len(_sessions), seconds=seconds, reason='stop' if stopping else 'reload')
+        stop_accepting()
+        hung_up = await drain_sessions(seconds, stopping)
+        log_event('drained', hung_up=hung_up)
+        finished.set()
+
+    def on_drain(message):
+        nonlocal drain_task
+        if drain_task is None and not finished.is_set():
+            drain_task = asyncio.create_task(drain(message.get('seconds', DRAIN_SECONDS),
+                                                   message.get('reason') == 'stop'))
+
+    def on_signal(sig):
+        if finished.is_set():
+            return  # Already shutting down
+        log_event('shutdown', signal=sig.name, sessions=len(_sessions))
+        finished.set()
+
+    finished = asyncio.Event()
+    drain_task = None
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, on_signal, sig)
+    try:
+        if link is not None:
+            link.on('drain', on_drain)
+            await ssh_listening.wait()
+            link.publish('ready')
+        await finished.wait()
+    finally:
+        stop_accepting()
+        warm_task.cancel()
+        await hang_up_sessions("The BBS is shutting down. Please call back later!")
+        if conversations is not None:
+            conversations.close()  # Save the last batch of turns
+        if event_log is not None:
+            event_log.close()
+
+
+def prepare_shared_files():
+    """Create the databases once, before workers race to do it
+
+    Host keys are left to the workers, which write them race-free.
+    """
+    get_store().close()
+    get_search().close()
+    conversations = get_conversations()
+    if conversations is not None:
+        conversations.compact().result()
+        conversations.close()
 
 
 def main():
     """Main server function"""
     HOST = '0.0.0.0'
-    HOST = '0.0.0.0'
     PORT = int(os.getenv('BBS_PORT', 2323))
     SSH_PORT = int(os.getenv('SSH_PORT', 2222))
     
+    raise_fd_limit()
+
+    if get_link() is not None:
+        # A worker under the supervisor
+        print(f"Worker {WORKER_ID} started (pid {os.getpid()})")
+        try:
+            asyncio.run(serve(HOST, PORT, SSH_PORT))
+        except KeyboardInterrupt:
+            pass
+        return
+
     print(f"""
 ╔═══════════════════════════════════════════════════════════════════════════╗
 ║                     AI BBS Server Starting...                             ║
@@ -493,20 +1627,16 @@ def main():
     print(f"Connect via ssh:    ssh -p {SSH_PORT} guest@localhost")
     print(f"\nPress Ctrl+C to stop the server\n")
     
-    # Start SSH Server in background thread
-    ssh_thread = threading.Thread(target=run_ssh_server, args=(SSH_PORT,))
-    ssh_thread.daemon = True
-    ssh_thread.start()
-    
-    server = ThreadedTCPServer((HOST, PORT), BBSHandler)
-    
-    try:
-        server.serve_forever()
-    except KeyboardInterrupt:
-        print("\n\nShutting down server...")
-        server.shutdown()
-        server.server_close()
+    if SUPERVISED:
+        print(f"Running {WORKERS} worker process{'es' if WORKERS > 1 else ''} (kill -HUP {os.getpid()} to reload)")
+        prepare_shared_files()
+        listeners = [bind_listener(HOST, PORT), bind_listener(HOST, SSH_PORT)]
+        asyncio.run(Supervisor(WORKERS, [os.path.abspath(__file__)], listeners).run())
         print("Server stopped.")
+        return
+
+    asyncio.run(serve(HOST, PORT, SSH_PORT))
+    print("\n\nServer stopped.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,1335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks for the BBS hot paths
+
+Usage:
+    python benchmark.py input      # chunked input decoder vs the old recv(1) loop
+    python benchmark.py output     # buffered output vs one sendall per send()
+    python benchmark.py animation  # frame wheel vs one sleep per frame, under load
+    python benchmark.py screen     # main menu redraw bytes: full resend vs diff
+    python benchmark.py boards     # message board list/read latency on 1M posts
+    python benchmark.py search     # FTS5 search vs a LIKE scan
+    python benchmark.py rooms      # chat room fan-out to 1,000 members
+    python benchmark.py mccp       # MCCP2 compression ratio and CPU per write
+    python benchmark.py ssh        # SSH handshakes: RSA + paramiko defaults vs Ed25519 + tuned algorithms
+    python benchmark.py conversations  # saved AI conversations: turn latency, batching, resume time
+    python benchmark.py startup    # import times, time until telnet and SSH answer, RSS
+    python benchmark.py metrics    # cost of recording a metric, sharded vs locked, and of a scrape
+    python benchmark.py logging    # error storm: print() to a slow stdout pipe vs the event log queue
+    python benchmark.py router     # time to first token: one model vs routing across several, hedged
+    python benchmark.py reload     # callers connecting during a deploy: restart vs SIGHUP reload
+"""
+import argparse
+import asyncio
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+
+from session_io import READ_CHUNK, InputDecoder, OutputBuffer, edit_line, encode_text
+
+
+class FakeSocket:
+    """In-memory socket that counts recv() calls"""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.recv_calls = 0
+
+    def recv(self, n):
+        self.recv_calls += 1
+        chunk = self.data[self.pos:self.pos + n]
+        self.pos += len(chunk)
+        return chunk
+
+
+def legacy_receive(sock):
+    """The pre-chunking BBSHandler.receive loop (echo left out)"""
+    buffer = []
+    byte_buffer = b""
+    while True:
+        chunk = sock.recv(1)
+        if not chunk:
+            return None
+        if chunk == b'\xff':
+            cmd = sock.recv(1)
+            if cmd in [b'\xfb', b'\xfc', b'\xfd', b'\xfe']:
+                sock.recv(1)
+                continue
+            if cmd != b'\xff':
+                continue
+            byte_buffer += b'\xff'
+        else:
+            byte_buffer += chunk
+        try:
+            char = byte_buffer.decode('utf-8')
+            byte_buffer = b""
+        except UnicodeDecodeError:
+            if len(byte_buffer) > 4:
+                byte_buffer = b""
+            continue
+        if char == '\r' or char == '\n':
+            return "".join(buffer)
+        if char == '\x7f' or char == '\x08':
+            if buffer:
+                buffer.pop()
+            continue
+        if char.isprintable():
+            buffer.append(char)
+
+
+def chunked_receive(sock, decoder):
+    """BBSHandler.receive on top of InputDecoder (echo left out)"""
+    buffer = []
+    while True:
+        while not decoder.has_input():
+            chunk = sock.recv(READ_CHUNK)
+            if not chunk:
+                return None
+            decoder.feed(chunk)
+        finished, _ = edit_line(decoder, buffer)
+        if finished:
+            return "".join(buffer)
+
+
+def input_payload(lines=2000):
+    """Pasted text: ASCII and Cyrillic lines with some telnet negotiation mixed in"""
+    parts = []
+    for i in range(lines):
+        if i % 2:
+            parts.append(f"line {i}: the quick brown fox jumps over the lazy dog\r\n".encode())
+        else:
+            parts.append(f"строка {i}: съешь же ещё этих мягких французских булок\r\n".encode())
+        if i % 50 == 0:
+            parts.append(b'\xff\xfd\x01\xff\xfb\x03')
+    return b"".join(parts)
+
+
+def bench_input(args):
+    payload = input_payload(args.lines)
+    print(f"Payload: {len(payload)} bytes, {args.lines} lines\n")
+
+    results = {}
+    for name in ('legacy', 'chunked'):
+        best = None
+        for _ in range(args.repeat):
+            sock = FakeSocket(payload)
+            decoder = InputDecoder()
+            lines = []
+            start = time.perf_counter()
+            while True:
+                if name == 'legacy':
+                    line = legacy_receive(sock)
+                else:
+                    line = chunked_receive(sock, decoder)
+                if line is None:
+                    break
+                lines.append(line)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best[0]:
+                best = (elapsed, sock.recv_calls, lines)
+        results[name] = best
+        elapsed, calls, lines = best
+        print(f"{name:<8} {len(payload) / elapsed / 1e6:8.2f} MB/s  "
+              f"{calls:>8} recv calls  {len(lines)} lines")
+
+    # The old loop treats the LF of every CR LF as a second, empty line
+    legacy_lines = [line for line in results['legacy'][2] if line]
+    if legacy_lines != results['chunked'][2]:
+        print("\nWARNING: decoded lines differ between implementations")
+    speedup = results['legacy'][0] / results['chunked'][0]
+    print(f"\nSpeedup: {speedup:.1f}x")
+
+
+class CountingWriter:
+    """StreamWriter stand-in that counts transport writes"""
+
+    def __init__(self):
+        self.writes = 0
+        self.bytes = 0
+
+    def write(self, data):
+        self.writes += 1
+        self.bytes += len(data)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+    def get_extra_info(self, name, default=None):
+        return ('127.0.0.1', 0) if name == 'peername' else default
+
+
+class RecordingBuffer(OutputBuffer):
+    """OutputBuffer that keeps every message for the encode comparison"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.log = []
+
+    def write(self, message):
+        self.log.append(message)
+        return super().write(message)
+
+
+async def scripted_session(batch_delay, reply):
+    """Drive a real BBSHandler through several screens and an AI reply"""
+    from bbs_server import BBSHandler, ClientDisconnected
+
+    reader = asyncio.StreamReader()
+    # Whole session typed ahead: handle, boards, system info, easter eggs, quit
+    reader.feed_data(b"bench\r2\r\r4\r\r5\r\rq\r")
+    reader.feed_eof()
+    writer = CountingWriter()
+    handler = BBSHandler(reader, writer, writer.get_extra_info('peername'))
+    handler.output = RecordingBuffer(batch_delay=batch_delay)
+
+    await handler.typing_effect(reply, delay=0.01)
+    try:
+        await handler.handle()
+    except ClientDisconnected:
+        pass
+    return handler.output, writer
+
+
+def bench_output(args):
+    reply = ("Greetings from the other side of the modem! " * 10)[:args.reply_chars]
+    print(f"Scripted session: 4 screens, goodbye, and a {len(reply)}-char typed AI reply")
+    print("(runs in real time because of the animations)\n")
+
+    for batch_ms in args.batch_ms:
+        output, writer = asyncio.run(scripted_session(batch_ms / 1000, reply))
+        messages = output.log
+
+        # Legacy: translate, encode and sendall every message on its own
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for message in messages:
+                encode_text(message) if isinstance(message, str) else message
+        legacy_cpu = (time.perf_counter() - start) / args.repeat
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            buffer = OutputBuffer(batch_delay=0)
+            for message in messages:
+                buffer.write(message)
+            buffer.take()
+        batched_cpu = (time.perf_counter() - start) / args.repeat
+
+        print(f"batch window {batch_ms} ms")
+        print(f"  legacy   {len(messages):>6} writes  {writer.bytes / len(messages):8.1f} bytes/write")
+        print(f"  buffered {writer.writes:>6} writes  {writer.bytes / writer.writes:8.1f} bytes/write  "
+              f"({len(messages) / writer.writes:.1f}x fewer syscalls)")
+        print(f"  encode CPU per session: {legacy_cpu * 1e3:.3f} ms legacy, "
+              f"{batched_cpu * 1e3:.3f} ms as one flush\n")
+
+
+async def sleep_animation(handler, text, delay):
+    """The old animation loop: one flush and one loop timer per frame"""
+    for char in text:
+        await handler.send(char)
+        await handler.flush(frame=True)
+        await asyncio.sleep(delay)
+    await handler.flush()
+
+
+async def animation_run(sessions, text, delay, stall, use_wheel):
+    """Many sessions typing at once while the loop is stalled every 100 ms"""
+    from bbs_server import BBSHandler
+
+    handlers = []
+    for _ in range(sessions):
+        writer = CountingWriter()
+        handlers.append((BBSHandler(asyncio.StreamReader(), writer, ('127.0.0.1', 0)), writer))
+
+    async def staller():
+        while True:
+            await asyncio.sleep(0.1)
+            time.sleep(stall)  # Stand-in for a slow callback hogging the loop
+
+    stall_task = asyncio.ensure_future(staller()) if stall else None
+    start = time.perf_counter()
+    if use_wheel:
+        await asyncio.gather(*[h.typing_effect(text, delay) for h, _ in handlers])
+    else:
+        await asyncio.gather(*[sleep_animation(h, text, delay) for h, _ in handlers])
+    elapsed = time.perf_counter() - start
+    if stall_task is not None:
+        stall_task.cancel()
+    writes = sum(w.writes for _, w in handlers)
+    return elapsed, writes
+
+
+def bench_animation(args):
+    from animation import FRAME_WHEEL
+    from bbs_server import FRAMES_LATE
+
+    text = ("The modem sings at night. " * 20)[:args.chars]
+    ideal = len(text) * args.delay
+    print(f"{args.sessions} sessions typing {len(text)} chars at {args.delay * 1e3:.0f} ms/char "
+          f"(ideal {ideal:.2f}s), loop stalled {args.stall_ms} ms every 100 ms\n")
+    for name, use_wheel in (("sleep per frame", False), ("frame wheel", True)):
+        ticks, late = FRAME_WHEEL.ticks, FRAMES_LATE.value()
+        elapsed, writes = asyncio.run(
+            animation_run(args.sessions, text, args.delay, args.stall_ms / 1000, use_wheel))
+        timers = FRAME_WHEEL.ticks - ticks if use_wheel else args.sessions * len(text)
+        dropped = FRAMES_LATE.value() - late
+        print(f"{name}")
+        print(f"  took {elapsed:6.2f}s ({elapsed / ideal:.2f}x ideal), {writes} writes, "
+              f"{timers} loop timers, {dropped} frames drawn late and coalesced\n")
+
+
+def bench_screen(args):
+    from datetime import datetime, timedelta
+    from ascii_art import LOGO, MAIN_MENU, Colors, clear_screen
+    from screen import MAIN_MENU_SCREEN, VirtualScreen
+
+    def dynamic(now):
+        return (f"\n{Colors.BRIGHT_YELLOW}Logged in as: {Colors.BRIGHT_WHITE}bench{Colors.RESET}\n"
+                f"{Colors.BRIGHT_BLACK}Current time: {now.strftime('%Y-%m-%d %H:%M:%S')}{Colors.RESET}\n\n")
+
+    # Between redraws: prompt, a mistyped choice and the error line
+    between = (f"{Colors.BRIGHT_YELLOW}Enter your choice: {Colors.RESET}" "9\r\n"
+               f"\n{Colors.BRIGHT_RED}Invalid choice! Please try again.{Colors.RESET}\n")
+    start_time = datetime(2026, 1, 1)
+
+    start = time.perf_counter()
+    legacy_bytes = 0
+    for i in range(args.redraws):
+        now = start_time + timedelta(seconds=i)
+        legacy_bytes += len(encode_text(clear_screen() + LOGO + MAIN_MENU + dynamic(now)))
+        legacy_bytes += len(encode_text(between))
+    legacy_cpu = time.perf_counter() - start
+
+    start = time.perf_counter()
+    screen = VirtualScreen()
+    diff_bytes = 0
+    for i in range(args.redraws):
+        now = start_time + timedelta(seconds=i)
+        out = screen.draw(MAIN_MENU_SCREEN, dynamic(now))
+        diff_bytes += len(out if isinstance(out, bytes) else encode_text(out))
+        screen.track(between)
+        diff_bytes += len(encode_text(between))
+    diff_cpu = time.perf_counter() - start
+
+    print(f"{args.redraws} main menu redraws, clock ticking, an invalid choice between each")
+    print(f"  full resend  {legacy_bytes:>9} bytes  {legacy_bytes / args.redraws:8.1f} per redraw  "
+          f"{legacy_cpu / args.redraws * 1e6:7.1f} us CPU")
+    print(f"  diff redraw  {diff_bytes:>9} bytes  {diff_bytes / args.redraws:8.1f} per redraw  "
+          f"{diff_cpu / args.redraws * 1e6:7.1f} us CPU  ({legacy_bytes / diff_bytes:.1f}x fewer bytes, "
+          f"{screen.full_draws} full, {screen.diff_draws} diff)")
+    for baud in (2400, 9600, 33600):
+        print(f"  at {baud:>5} baud: {legacy_bytes / args.redraws * 10 / baud:6.2f}s vs "
+              f"{diff_bytes / args.redraws * 10 / baud:6.2f}s per redraw")
+
+
+def seed_boards(path, posts, posts_per_thread, body=None):
+    """Bulk-load a board database, keeping the counters the way posting does"""
+    import random
+    from storage import DEFAULT_BOARDS, SCHEMA, connect
+
+    db = connect(path)
+    db.executescript(SCHEMA)
+    db.executemany("INSERT INTO boards (name, description) VALUES (?, ?)", DEFAULT_BOARDS)
+    boards = len(DEFAULT_BOARDS)
+    threads = max(1, posts // posts_per_thread)
+    now = time.time() - posts
+    thread_rows = []
+    for thread_id in range(1, threads + 1):
+        board_id = random.randint(1, boards)
+        thread_rows.append([thread_id, board_id, f"Thread {thread_id}", f"user{thread_id % 997}", now, now, 0])
+    board_stats = {b: [0, 0, None] for b in range(1, boards + 1)}
+    for row in thread_rows:
+        board_stats[row[1]][0] += 1
+
+    batch = []
+    for post_id in range(1, posts + 1):
+        thread = thread_rows[random.randrange(threads)]
+        created = now + post_id
+        batch.append((post_id, thread[1], thread[0], f"user{post_id % 997}",
+                      body() if body else f"Post {post_id}: the modem sings at night", created))
+        thread[5] = created
+        thread[6] += 1
+        stats = board_stats[thread[1]]
+        stats[1] += 1
+        stats[2] = created
+        if len(batch) == 50000:
+            db.executemany("INSERT INTO posts VALUES (?, ?, ?, ?, ?, ?)", batch)
+            batch = []
+    if batch:
+        db.executemany("INSERT INTO posts VALUES (?, ?, ?, ?, ?, ?)", batch)
+    db.executemany("INSERT INTO threads VALUES (?, ?, ?, ?, ?, ?, ?)", thread_rows)
+    db.executemany("UPDATE boards SET thread_count = ?, post_count = ?, last_post = ? WHERE id = ?",
+                   [(t, p, last, b) for b, (t, p, last) in board_stats.items()])
+    db.commit()
+    db.close()
+
+
+async def board_reads(store, board_id, thread_id, sessions, rounds):
+    """Concurrent sessions each listing threads, paging, and reading a thread"""
+    timings = {'boards': [], 'threads p1': [], 'threads p50': [], 'posts p1': [], 'reply': []}
+
+    async def timed(name, coro):
+        start = time.perf_counter()
+        result = await coro
+        timings[name].append(time.perf_counter() - start)
+        return result
+
+    async def session(n):
+        for _ in range(rounds):
+            await timed('boards', store.boards())
+            rows, cursor = await timed('threads p1', store.threads(board_id))
+            for _ in range(48):
+                rows, cursor = await store.threads(board_id, before=cursor)
+            await timed('threads p50', store.threads(board_id, before=cursor))
+            await timed('posts p1', store.posts(thread_id))
+            if n % 10 == 0:
+                await timed('reply', store.reply(thread_id, f"bench{n}", "Benchmark reply"))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[session(n) for n in range(sessions)])
+    return timings, time.perf_counter() - start
+
+
+def bench_boards(args):
+    import os
+    import tempfile
+    from storage import BoardStore, connect
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bbs.db')
+        start = time.perf_counter()
+        seed_boards(path, args.posts, args.posts_per_thread)
+        print(f"Seeded {args.posts} posts in {time.perf_counter() - start:.1f}s "
+              f"({os.path.getsize(path) / 2 ** 20:.0f} MiB)")
+
+        db = connect(path)
+        board_id, thread_id = db.execute("SELECT board_id, id FROM threads ORDER BY post_count DESC LIMIT 1").fetchone()
+        # What the keyset walk replaces: OFFSET rescans every earlier row
+        last_page = db.execute("SELECT thread_count FROM boards WHERE id = ?", (board_id,)).fetchone()[0] - 10
+        start = time.perf_counter()
+        db.execute("SELECT * FROM threads WHERE board_id = ? ORDER BY last_post DESC, id DESC "
+                   "LIMIT 10 OFFSET ?", (board_id, last_page)).fetchall()
+        offset_time = time.perf_counter() - start
+        start = time.perf_counter()
+        db.execute("SELECT COUNT(*) FROM posts WHERE board_id = ?", (board_id,)).fetchone()
+        count_time = time.perf_counter() - start
+        db.close()
+
+        for readers in args.readers:
+            store = BoardStore(path, readers=readers)
+            timings, elapsed = asyncio.run(board_reads(store, board_id, thread_id, args.sessions, args.rounds))
+            store.close()
+            print(f"\n{args.sessions} sessions, {readers} reader connection(s): {elapsed:.2f}s, "
+                  f"{store.reads / elapsed:.0f} reads/s")
+            for name, values in timings.items():
+                values.sort()
+                if values:
+                    print(f"  {name:<12} p50 {values[len(values) // 2] * 1e3:7.2f} ms   "
+                          f"p99 {values[int(len(values) * 0.99)] * 1e3:7.2f} ms")
+        print(f"\nFor comparison: last page via OFFSET {offset_time * 1e3:.2f} ms, "
+              f"COUNT(*) of one board {count_time * 1e3:.1f} ms")
+
+
+def bench_search(args):
+    import os
+    import random
+    import tempfile
+    from search import SearchIndex
+    from storage import BoardStore, connect
+
+    vocabulary = ("modem baud sysop door game ansi art fidonet echomail zmodem upload download "
+                  "модем сисоп звонок файл сообщение эхо конференция ночью скорость").split()
+    vocabulary += [f"word{i}" for i in range(5000)]
+
+    def body():
+        return " ".join(random.choice(vocabulary) for _ in range(30))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bbs.db')
+        seed_boards(path, args.posts, 50, body)
+        store = BoardStore(path)
+        index = SearchIndex(os.path.join(tmp, 'search.db'), store=store)
+
+        async def build():
+            start = time.perf_counter()
+            while await index.catch_up():
+                pass
+            return time.perf_counter() - start
+        build_time = asyncio.run(build())
+        print(f"Indexed {index.indexed} posts in {build_time:.1f}s ({index.indexed / build_time:.0f} posts/s)\n")
+
+        db = connect(path)
+        queries = ["модем", "zmodem upload", "word4217", "сисоп ночью", "fido"]
+        for query in queries:
+            async def run():
+                start = time.perf_counter()
+                for _ in range(args.repeat):
+                    rows, cursor = await index.search(query, 'bench')
+                return (time.perf_counter() - start) / args.repeat, rows
+            fts_time, rows = asyncio.run(run())
+            start = time.perf_counter()
+            like = " AND ".join("body LIKE ?" for _ in query.split())
+            # Newest first is the best order a LIKE search can offer, and it reads every row
+            db.execute(f"SELECT id FROM posts WHERE {like} ORDER BY created DESC LIMIT 10",
+                       [f"%{word}%" for word in query.split()]).fetchall()
+            like_time = time.perf_counter() - start
+            print(f"  {query!r:<16} FTS5 first page {fts_time * 1e3:7.2f} ms   "
+                  f"LIKE scan {like_time * 1e3:8.2f} ms")
+        db.close()
+        index.close()
+        store.close()
+
+
+class RoomWriter(CountingWriter):
+    """Session writer that timestamps room lines on arrival, optionally on a slow link"""
+
+    def __init__(self, sent, latencies, stall=0.0):
+        super().__init__()
+        self.sent = sent
+        self.latencies = latencies
+        self.stall = stall
+
+    def write(self, data):
+        super().write(data)
+        now = time.perf_counter()
+        for match in re.finditer(rb'#(\d+)#', data):
+            self.latencies.append(now - self.sent[int(match.group(1))])
+
+    async def drain(self):
+        if self.stall:
+            await asyncio.sleep(self.stall)
+
+
+async def room_run(args):
+    import rooms
+    from bbs_server import BBSHandler
+
+    rooms.ROOM_SLOW_KICK = args.kick_after
+    room = rooms.Room('bench')
+    sent = {}
+    latencies = []
+    slow_count = int(args.members * args.slow)
+    sessions = []
+    for n in range(args.members):
+        writer = RoomWriter(sent, latencies, stall=5.0 if n < slow_count else 0.0)
+        handler = BBSHandler(asyncio.StreamReader(), writer, ('127.0.0.1', n), is_ssh=True)
+        handler.username = f"member{n}"
+        handler.start_input()
+        sessions.append((handler, writer, asyncio.ensure_future(handler.chat_room(room))))
+    await asyncio.sleep(0.5)
+    latencies.clear()
+    room.broadcasts = room.deliveries = room.skipped = room.kicked = 0
+
+    speaker = room.members[-1]
+    interval = 1 / args.rate
+    fanout = 0.0
+    start = time.perf_counter()
+    for i in range(int(args.rate * args.seconds)):
+        sent[i] = time.perf_counter()
+        t0 = time.perf_counter()
+        room.say(speaker, f"message #{i}# from the benchmark")
+        fanout += time.perf_counter() - t0
+        await asyncio.sleep(max(0.0, start + (i + 1) * interval - time.perf_counter()))
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(0.5)
+
+    stats = room.stats()
+    for handler, _, task in sessions:
+        handler.reader.feed_eof()
+        task.cancel()
+    await asyncio.gather(*[task for _, _, task in sessions], return_exceptions=True)
+    return stats, latencies, fanout, elapsed, slow_count
+
+
+def bench_rooms(args):
+    from session_io import encode_text
+
+    line = "\033[90m[12:00]\033[0m \033[96mmember1:\033[0m message #1# from the benchmark\n"
+    start = time.perf_counter()
+    for _ in range(args.members):
+        encode_text(line)
+    per_member = time.perf_counter() - start
+
+    stats, latencies, fanout, elapsed, slow = asyncio.run(room_run(args))
+    sent = int(args.rate * args.seconds)
+    latencies.sort()
+    print(f"{args.members} members ({slow} on a stalled link), {sent} lines at {args.rate}/s for {elapsed:.1f}s")
+    print(f"  fan-out CPU per line {fanout / sent * 1e3:.2f} ms "
+          f"(encoding per recipient instead would add {per_member * 1e3:.2f} ms)")
+    print(f"  deliveries {stats['deliveries']}, skipped for slow members {stats['skipped']}, "
+          f"kicked {stats['kicked']}, still in room {stats['members']}")
+    if latencies:
+        print(f"  delivery latency p50 {latencies[len(latencies) // 2] * 1e3:.1f} ms   "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1e3:.1f} ms   "
+              f"max {latencies[-1] * 1e3:.1f} ms  ({len(latencies)} lines received)")
+
+
+def mccp_workload():
+    """Writes of a typical telnet session by kind: full screens, streamed reply chunks, key echo"""
+    from ascii_art import COMPUTER_ART, GOODBYE, LOGO, MAIN_MENU, ROBOT_ART, Colors, clear_screen
+    from screen import MAIN_MENU_SCREEN
+
+    menu = MAIN_MENU_SCREEN.data + encode_text(
+        f"\n{Colors.BRIGHT_YELLOW}Logged in as: {Colors.BRIGHT_WHITE}bench{Colors.RESET}\n\n"
+        f"{Colors.BRIGHT_YELLOW}Enter your choice: {Colors.RESET}")
+    screens = [encode_text(clear_screen() + LOGO), menu, encode_text(COMPUTER_ART + ROBOT_ART), menu,
+               encode_text(clear_screen() + GOODBYE)]
+    words = ("Модемы на 2400 бод были медленными, but the BBS scene thrived on them: "
+             "message boards, door games and file areas over a single phone line. ").split()
+    stream = [encode_text(f"{Colors.BRIGHT_WHITE}{' '.join(words[i:i + 3])} {Colors.RESET}")
+              for i in range(0, len(words), 3)] * 4
+    echo = [char.encode() for char in "hello there, what was your first modem?"]
+    return {'screens': screens, 'stream': stream, 'echo': echo}
+
+
+def bench_mccp(args):
+    from session_io import StreamCompressor
+
+    workload = mccp_workload()
+    raw = {kind: sum(map(len, writes)) for kind, writes in workload.items()}
+    print(f"One session's writes, each compressed with a sync flush as it would be sent "
+          f"({args.sessions} sessions)")
+    print(f"  {'level':>5} " + ''.join(f"{kind:>22}" for kind in workload) + f"{'total':>14}  CPU per write")
+    for level in (1, 6, 9):
+        out = dict.fromkeys(workload, 0)
+        writes = 0
+        start = time.perf_counter()
+        for _ in range(args.sessions):
+            compressor = StreamCompressor(level)
+            # Interleave the way a session does: screens, then typing and a streamed reply
+            for kind in ('screens', 'echo', 'stream'):
+                for data in workload[kind]:
+                    out[kind] += len(compressor.compress(data))
+                    writes += 1
+        cpu = time.perf_counter() - start
+        cells = ''.join(f"{raw[kind]:>9} -> {out[kind] // args.sessions:>5} {raw[kind] * args.sessions / out[kind]:4.1f}x"
+                        for kind in workload)
+        total_raw = sum(raw.values())
+        total = sum(out.values()) // args.sessions
+        print(f"  {level:>5} {cells}  {total_raw / total:5.1f}x  {cpu / writes * 1e6:8.1f} us")
+    print("  (echo: one byte per key grows to a few, since every write ends with a zlib sync flush)")
+
+
+def ssh_login(port):
+    """One SSH caller up to an open shell channel (runs in a client process)"""
+    import paramiko
+
+    start = time.perf_counter()
+    transport = paramiko.Transport(('127.0.0.1', port))
+    try:
+        transport.connect(username='bench', password='bench')
+        channel = transport.open_session()
+        channel.get_pty()
+        channel.invoke_shell()
+        return time.perf_counter() - start, transport.host_key_type, transport.local_cipher
+    finally:
+        transport.close()
+
+
+async def ssh_run(args, host_keys, ciphers, kex):
+    import multiprocessing
+    import socket
+    from concurrent.futures import ProcessPoolExecutor
+    import bbs_server
+    import ssh_transport
+
+    ssh_transport.SSH_CIPHER_ORDER, ssh_transport.SSH_KEX_ORDER = ciphers, kex
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(socket.SOMAXCONN)
+    sock.setblocking(False)
+    port = sock.getsockname()[1]
+
+    async def accept():
+        while True:
+            client, _ = await loop.sock_accept(sock)
+            bbs_server.spawn_session(bbs_server.handle_ssh_connection(client, host_keys))
+
+    acceptor = loop.create_task(accept())
+    try:
+        with ProcessPoolExecutor(args.clients, mp_context=multiprocessing.get_context('spawn')) as pool:
+            # Start the client processes and import paramiko there before timing
+            await asyncio.gather(*[loop.run_in_executor(pool, ssh_login, port) for _ in range(args.clients)])
+            cpu = time.process_time()
+            start = time.perf_counter()
+            results = await asyncio.gather(*[loop.run_in_executor(pool, ssh_login, port)
+                                             for _ in range(args.handshakes)])
+            elapsed = time.perf_counter() - start
+            cpu = time.process_time() - cpu
+        # Let the sessions see their callers hang up before the loop goes away
+        if bbs_server._session_tasks:
+            await asyncio.wait(set(bbs_server._session_tasks), timeout=5)
+    finally:
+        acceptor.cancel()
+        sock.close()
+    return results, elapsed, cpu
+
+
+async def ssh_clients(args, port):
+    """Handshake rate against a server on ``port`` from client processes"""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(args.clients, mp_context=multiprocessing.get_context('spawn')) as pool:
+        await asyncio.gather(*[loop.run_in_executor(pool, ssh_login, port) for _ in range(args.clients)])
+        start = time.perf_counter()
+        results = await asyncio.gather(*[loop.run_in_executor(pool, ssh_login, port)
+                                         for _ in range(args.handshakes)])
+        return results, time.perf_counter() - start
+
+
+def bench_ssh_workers(args):
+    """Handshake rate of bbs_server.py in supervisor mode with 1, 2, ... workers"""
+    import os
+    import socket
+    import subprocess
+    import sys
+    import tempfile
+
+    print(f"{args.handshakes} SSH logins against bbs_server.py, {args.clients} client processes "
+          f"({os.cpu_count()} CPUs; clients share them with the server)")
+    data_dir = tempfile.mkdtemp()
+    for workers in args.workers:
+        port = 20000 + os.getpid() % 10000
+        env = dict(os.environ, BBS_WORKERS=str(workers), BBS_PORT=str(port + 1), SSH_PORT=str(port),
+                   SSH_HOST_KEYS='ed25519', BBS_MAX_PER_IP='0', OPENROUTER_API_KEY='bench')
+        server = subprocess.Popen([sys.executable, os.path.abspath('bbs_server.py')], env=env, cwd=data_dir,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = time.time() + 60
+            while True:
+                try:
+                    socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                    break
+                except OSError:
+                    if time.time() > deadline:
+                        raise
+                    time.sleep(0.2)
+            time.sleep(1)  # let every worker bind before measuring
+            results, elapsed = asyncio.run(ssh_clients(args, port))
+        finally:
+            server.terminate()
+            server.wait()
+        latencies = sorted(r[0] for r in results)
+        print(f"  {workers} worker(s): {args.handshakes / elapsed:6.1f} handshakes/s   "
+              f"p50 {latencies[len(latencies) // 2] * 1e3:6.1f} ms   p99 {latencies[int(len(latencies) * 0.99)] * 1e3:6.1f} ms")
+
+
+def bench_ssh(args):
+    if args.workers:
+        return bench_ssh_workers(args)
+
+    import logging
+    import tempfile
+    import paramiko
+    import bbs_server
+    import ssh_transport
+
+    # Clients hang up as soon as the shell opens; keep paramiko's resets off the report
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    key_dir = tempfile.mkdtemp()
+    rsa = ssh_transport.load_host_keys(key_dir, 'rsa')
+    ed25519 = ssh_transport.load_host_keys(key_dir, 'ed25519')
+    configs = [
+        ("RSA-2048, paramiko default algorithms", rsa,
+         paramiko.Transport._preferred_ciphers, paramiko.Transport._preferred_kex),
+        ("RSA-2048, SSH_CIPHERS/SSH_KEX", rsa, ssh_transport.SSH_CIPHER_ORDER, ssh_transport.SSH_KEX_ORDER),
+        ("Ed25519, SSH_CIPHERS/SSH_KEX", ed25519, ssh_transport.SSH_CIPHER_ORDER, ssh_transport.SSH_KEX_ORDER),
+    ]
+    print(f"{args.handshakes} SSH logins up to an open shell, {args.clients} client processes at a time")
+    for name, keys, ciphers, kex in configs:
+        results, elapsed, cpu = asyncio.run(ssh_run(args, keys, ciphers, kex))
+        latencies = sorted(r[0] for r in results)
+        print(f"  {name}")
+        print(f"    {args.handshakes / elapsed:6.1f} handshakes/s   latency p50 {latencies[len(latencies) // 2] * 1e3:6.1f} ms"
+              f"   p99 {latencies[int(len(latencies) * 0.99)] * 1e3:6.1f} ms   "
+              f"server CPU {cpu / args.handshakes * 1e3:5.2f} ms each   ({results[0][1]}, {results[0][2]})")
+    print(f"  server handshake counters: {bbs_server.ssh_stats}")
+
+
+async def conversation_turns(log, args):
+    """Callers chatting at once; returns the event loop time spent saving each turn"""
+    reply = "Back in the day a 2400 baud modem felt fast. " * 6
+
+    async def caller(i):
+        handle = f"caller{i}"
+        await log.load(handle, 3000)
+        spent = []
+        for turn in range(args.turns):
+            start = time.perf_counter()
+            log.record(handle, 'turn', role="user", content=f"question {turn} from {handle}")
+            log.record(handle, 'turn', role="assistant", content=reply)
+            spent.append(time.perf_counter() - start)
+            await asyncio.sleep(args.think)
+        return spent
+
+    results = await asyncio.gather(*(caller(i) for i in range(args.callers)))
+    return sorted(t for spent in results for t in spent)
+
+
+async def conversation_resume(log, args):
+    cold, warm = [], []
+    for i in range(args.callers):
+        start = time.perf_counter()
+        await log.load(f"caller{i}", 3000)
+        cold.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        await log.load(f"caller{i}", 3000)
+        warm.append(time.perf_counter() - start)
+    return sorted(cold), sorted(warm)
+
+
+def bench_conversations(args):
+    import os
+    import tempfile
+    from conversations import ConversationLog, encode_record
+
+    with tempfile.TemporaryDirectory(dir='data' if os.path.isdir('data') else None) as tmp:
+        # Writing and fsyncing each turn where it happens, as a synchronous save would
+        path = os.path.join(tmp, 'sync.log')
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        sync = []
+        for i in range(min(200, args.callers * args.turns)):
+            start = time.perf_counter()
+            os.write(fd, encode_record({'handle': 'x', 'op': 'turn', 'role': 'user', 'content': 'q'}))
+            os.write(fd, encode_record({'handle': 'x', 'op': 'turn', 'role': 'assistant', 'content': 'a' * 270}))
+            os.fsync(fd)
+            sync.append(time.perf_counter() - start)
+        os.close(fd)
+        sync.sort()
+
+        path = os.path.join(tmp, 'conversations.log')
+        log = ConversationLog(path, flush_interval=args.flush, idle=600)
+        spent = asyncio.run(conversation_turns(log, args))
+        log.close()
+        stats = log.stats()
+        print(f"{args.callers} callers x {args.turns} turns, {args.think * 1000:.0f} ms apart")
+        print(f"  fsync per turn on the loop:   p50 {sync[len(sync) // 2] * 1e3:7.3f} ms   p99 {sync[int(len(sync) * 0.99)] * 1e3:7.3f} ms")
+        print(f"  batched log, time per turn:   p50 {spent[len(spent) // 2] * 1e3:7.3f} ms   p99 {spent[int(len(spent) * 0.99)] * 1e3:7.3f} ms")
+        print(f"  {stats['records']} records in {stats['batches']} batches "
+              f"({stats['bytes_written'] // 1024} KB, {stats['fsync_ms']:.0f} ms of fsync on the writer thread)")
+
+        start = time.perf_counter()
+        log = ConversationLog(path, idle=600)
+        log.indexed.result()
+        scan = time.perf_counter() - start
+        cold, warm = asyncio.run(conversation_resume(log, args))
+        log.close()
+        print(f"  restart: index built in {scan * 1e3:.1f} ms for {os.path.getsize(path) // 1024} KB")
+        print(f"  resume after restart:         p50 {cold[len(cold) // 2] * 1e3:7.3f} ms   p99 {cold[int(len(cold) * 0.99)] * 1e3:7.3f} ms")
+        print(f"  resume while in memory:       p50 {warm[len(warm) // 2] * 1e3:7.3f} ms")
+
+
+def import_breakdown():
+    """Import times in ms: bbs_server, its biggest direct imports, and the modules it loads later"""
+    import subprocess
+    import sys
+
+    code = ("import bbs_server\n"
+            "for name in ('ai_client', 'ssh_transport'):\n"
+            "    try:\n"
+            "        __import__(name)\n"
+            "        print(name)\n"
+            "    except ImportError:\n"
+            "        pass\n")
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+    top, children, current = [], {}, []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        if level == 1:
+            current.append((name, int(cumulative) / 1000))
+        elif level == 0:
+            top.append((name, int(cumulative) / 1000))
+            children[name], current = current, []
+    loaded = ['bbs_server'] + result.stdout.split()
+    return [(name, ms) for name, ms in top if name in loaded], children
+
+
+def first_byte(port, started, deadline):
+    """Seconds from ``started`` until a server on ``port`` accepts and sends its first byte"""
+    import socket
+
+    while time.perf_counter() < deadline:
+        try:
+            sock = socket.create_connection(('127.0.0.1', port), timeout=0.5)
+        except OSError:
+            time.sleep(0.002)
+            continue
+        try:
+            sock.settimeout(max(0.1, deadline - time.perf_counter()))
+            if sock.recv(1):
+                return time.perf_counter() - started
+        except OSError:
+            pass
+        finally:
+            sock.close()
+    return None
+
+
+def rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+def bench_startup(args):
+    import os
+    import subprocess
+    import sys
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    top, children = import_breakdown()
+    print("Import time (ms, cumulative)")
+    for name, ms in top:
+        when = "at startup" if name == 'bbs_server' else "on first use"
+        print(f"  {name:<28} {ms:7.1f}   {when}")
+        for child, child_ms in sorted(children[name], key=lambda c: -c[1])[:args.top]:
+            print(f"    {child:<26} {child_ms:7.1f}")
+
+    data_dir = tempfile.mkdtemp()
+    port = 20000 + os.getpid() % 10000
+    env = dict(os.environ, BBS_PORT=str(port), SSH_PORT=str(port + 1), OPENROUTER_API_KEY='bench',
+               AI_BASE_URL='http://127.0.0.1:9/api/v1', AI_PREWARM_CONNECTIONS='0')
+    print(f"\nbbs_server.py from process start (data dir {data_dir})")
+    print(f"  {'':<16}{'telnet':>10}{'ssh':>10}{'RSS then':>12}{'RSS +3s':>10}")
+    for run in range(args.runs):
+        started = time.perf_counter()
+        server = subprocess.Popen([sys.executable, os.path.abspath('bbs_server.py')], env=env, cwd=data_dir,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = started + 60
+            with ThreadPoolExecutor(2) as pool:
+                telnet, ssh = pool.map(lambda p: first_byte(p, started, deadline), (port, port + 1))
+            rss = rss_mb(server.pid)
+            time.sleep(3)
+            settled = rss_mb(server.pid)
+        finally:
+            server.terminate()
+            server.wait()
+        name = "first start" if run == 0 else f"restart {run}"
+        cells = ''.join(f"{t * 1e3:8.0f}ms" if t is not None else f"{'-':>10}" for t in (telnet, ssh))
+        print(f"  {name:<16}{cells}{rss:10.1f}MB{settled:8.1f}MB")
+
+
+class LockedHistogram:
+    """A histogram behind one lock, the usual thread-safe alternative to per-thread shards"""
+
+    def __init__(self, buckets):
+        import threading
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+
+
+def record_rate(observe, threads, per_thread):
+    """Observations per second with ``threads`` threads recording at once"""
+    import threading
+
+    def work():
+        for i in range(per_thread):
+            observe((i % 100) / 100)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return threads * per_thread / (time.perf_counter() - start)
+
+
+def bench_metrics(args):
+    from metrics import LATENCY_BUCKETS, Counter, Histogram, Registry
+
+    registry = Registry()
+    counter = Counter('bench_total', "bench", ['protocol'], registry=registry)
+    histogram = Histogram('bench_seconds', "bench", ['screen'], registry=registry)
+    child = counter.labels('telnet')
+    start = time.perf_counter()
+    for _ in range(args.records):
+        child.inc()
+    inc = (time.perf_counter() - start) / args.records
+    start = time.perf_counter()
+    for _ in range(args.records):
+        counter.labels('telnet').inc()
+    labelled = (time.perf_counter() - start) / args.records
+    print(f"Counter inc: {inc * 1e9:.0f} ns, with the label lookup {labelled * 1e9:.0f} ns")
+
+    print(f"Histogram observe ({len(LATENCY_BUCKETS)} buckets), observations/s:")
+    print(f"  {'threads':>7} {'per-thread shards':>18} {'one lock':>12}")
+    for threads in args.threads:
+        sharded = record_rate(histogram.labels('bench').observe, threads, args.records // threads)
+        locked = record_rate(LockedHistogram(LATENCY_BUCKETS).observe, threads, args.records // threads)
+        print(f"  {threads:>7} {sharded:>18,.0f} {locked:>12,.0f}")
+
+    for screen in range(20):
+        for _ in range(10):
+            histogram.labels(f"screen{screen}").observe(0.1)
+    start = time.perf_counter()
+    text = registry.render()
+    print(f"Scrape of {text.count(chr(10))} lines: {(time.perf_counter() - start) * 1e3:.2f} ms")
+
+
+def log_storm(log_call, threads, records):
+    """Call ``log_call`` ``records`` times from each of ``threads`` threads at once
+
+    Returns (wall seconds, sorted per-call latencies).
+    """
+    latencies = []
+    barrier = threading.Barrier(threads)
+
+    def run():
+        own = []
+        barrier.wait()
+        for i in range(records):
+            start = time.perf_counter()
+            log_call(i)
+            own.append(time.perf_counter() - start)
+        latencies.extend(own)
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start, sorted(latencies)
+
+
+def slow_pipe(read_delay):
+    """A line-buffered text stream into a pipe drained 4 KB at a time, like a busy log driver"""
+    read_fd, write_fd = os.pipe()
+
+    def drain():
+        while os.read(read_fd, 4096):
+            time.sleep(read_delay)
+        os.close(read_fd)
+
+    threading.Thread(target=drain, daemon=True).start()
+    return os.fdopen(write_fd, 'w', buffering=1)
+
+
+def bench_logging(args):
+    import tempfile
+    from eventlog import EventLog
+
+    error = "Error code: 500 - {'error': {'message': 'Upstream provider error', 'code': 500}}"
+    print(f"Error storm: {args.threads} threads x {args.records} errors, "
+          f"stdout drained 4 KB per {args.read_delay * 1e3:.1f} ms")
+    print(f"  {'':<22} {'wall':>9} {'p50':>9} {'p99':>9} {'max':>9}  written")
+
+    def report(name, wall, latencies, written):
+        p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1e6
+        print(f"  {name:<22} {wall * 1e3:7.0f}ms {p(0.5):7.1f}us {p(0.99):7.1f}us "
+              f"{latencies[-1] * 1e6:7.0f}us  {written}")
+
+    out = slow_pipe(args.read_delay)
+    wall, latencies = log_storm(lambda i: print(f"Error communicating with AI: {error} ({i})", file=out),
+                                args.threads, args.records)
+    out.close()
+    report("print() to stdout", wall, latencies, len(latencies))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log = EventLog(os.path.join(tmp, 'bbs.jsonl'), queue_size=args.queue, echo=0)
+        wall, latencies = log_storm(
+            lambda i: log.emit('error', 'error', i, where='ai', type='InternalServerError', error=error),
+            args.threads, args.records)
+        log.close()
+        with open(log.path) as f:
+            written = sum(1 for _ in f)
+        report("event log queue", wall, latencies, f"{written} lines, {log.dropped} dropped")
+
+
+async def routed_requests(client, args):
+    """Seconds to first token of ``args.requests`` streamed requests, ``args.concurrency`` at a time"""
+    from ai_router import ModelsUnavailable
+    times = []
+    errors = 0
+    pending = iter(range(args.requests))
+    messages = [{"role": "system", "content": "bench"}, {"role": "user", "content": "hi"}]
+
+    async def caller():
+        nonlocal errors
+        for _ in pending:
+            start = time.perf_counter()
+            try:
+                _, reply, _ = await client.create(messages, stream=True, hedge=True)
+            except (ModelsUnavailable, *client.router.retryable):
+                errors += 1
+                continue
+            times.append(time.perf_counter() - start)
+            await reply.close()
+
+    await asyncio.gather(*[caller() for _ in range(args.concurrency)])
+    await client.close()
+    return sorted(times), errors
+
+
+def bench_router(args):
+    import os
+    import threading
+    from mock_openrouter import MockOpenRouter
+
+    models = {'fast/tail-heavy': f"lognormal:{args.fast}", 'steady/model': f"lognormal:{args.steady}",
+              'flaky/model': f"lognormal:{args.fast}"}
+    mock = MockOpenRouter(token_delay=0, reply_tokens=5, model_latency=models,
+                          model_error_rate={'flaky/model': args.flaky_errors})
+    loop = asyncio.new_event_loop()
+    port = loop.run_until_complete(mock.start('127.0.0.1', 0))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    os.environ.update(OPENROUTER_API_KEY='mock', AI_BASE_URL=f"http://127.0.0.1:{port}/api/v1",
+                      AI_MAX_RETRIES='3', AI_RETRY_BASE='0.2', AI_CACHE_SIZE='0')
+    from ai_client import RETRYABLE_ERRORS, AIClient
+    from ai_router import ModelRouter
+
+    print(f"{args.requests} streamed requests, {args.concurrency} at a time; first token latency per model:")
+    for model, spec in models.items():
+        errors = f", {args.flaky_errors:.0%} errors" if model == 'flaky/model' else ""
+        print(f"  {model:<16} {spec}{errors}")
+    print(f"  {'':<28} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}  errors  requests sent")
+    for name, candidates, hedge in [("fast/tail-heavy only", ['fast/tail-heavy'], False),
+                                    ("routed, no hedging", list(models), False),
+                                    ("routed + hedged", list(models), True)]:
+        client = AIClient()
+        client.router = ModelRouter(candidates, RETRYABLE_ERRORS, hedge=hedge)
+        sent = mock.requests
+        times, errors = asyncio.run(routed_requests(client, args))
+        p = lambda q: times[min(len(times) - 1, int(len(times) * q))] * 1e3 if times else float('nan')
+        print(f"  {name:<28} {p(0.5):6.0f}ms {p(0.9):6.0f}ms {p(0.99):6.0f}ms {p(1.0):6.0f}ms  "
+              f"{errors:>6}  {mock.requests - sent} ({client.router.hedges} hedges, "
+              f"{client.router.hedges_won} won)")
+    asyncio.run_coroutine_threadsafe(mock.close(), loop).result()
+
+
+def connect_probe(port, results, stop, interval):
+    """Connect over and over until ``stop``; records (start, seconds to first byte or None, error)"""
+    import socket
+
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=5) as sock:
+                sock.settimeout(5)
+                if not sock.recv(1):
+                    raise ConnectionResetError("closed before the first byte")
+            results.append((started, time.perf_counter() - started, None))
+        except OSError as e:
+            results.append((started, None, type(e).__name__))
+        time.sleep(interval)
+
+
+def idle_caller(port, seen):
+    """Stay connected without typing; records what the server said and when it hung up"""
+    import socket
+
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=5) as sock:
+            sock.settimeout(None)
+            data = b""
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+    except OSError:
+        data = b""
+    seen.append((time.perf_counter(), b"This line closes in" in data))
+
+
+def bench_reload(args):
+    """Time to first byte for callers connecting while bbs_server.py is restarted, then reloaded"""
+    import os
+    import signal
+    import subprocess
+    import sys
+    import tempfile
+    from collections import Counter
+
+    data_dir = tempfile.mkdtemp()
+    port = 20000 + os.getpid() % 10000
+    env = dict(os.environ, BBS_WORKERS=str(args.workers), BBS_SUPERVISOR='1', BBS_PORT=str(port),
+               SSH_PORT=str(port + 1), BBS_METRICS_PORT=str(port + 2), BBS_DRAIN_SECONDS=str(args.drain),
+               BBS_MAX_PER_IP='0', OPENROUTER_API_KEY='bench', AI_BASE_URL='http://127.0.0.1:9/api/v1',
+               AI_PREWARM_CONNECTIONS='0', BBS_STOP_DRAIN_SECONDS='0')  # restart() is a hard restart
+
+    def start():
+        server = subprocess.Popen([sys.executable, os.path.abspath('bbs_server.py')], env=env, cwd=data_dir,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if first_byte(port, time.perf_counter(), time.perf_counter() + 60) is None:
+            raise RuntimeError("bbs_server.py did not start")
+        return server
+
+    def restart(server):
+        server.terminate()
+        server.wait()
+        return start()
+
+    def reload(server):
+        server.send_signal(signal.SIGHUP)
+        return server
+
+    print(f"{args.clients} clients connecting every {args.interval * 1e3:.0f} ms and {args.callers} idle callers; "
+          f"{args.workers} worker(s), deploy {args.before:.0f}s in, BBS_DRAIN_SECONDS={args.drain:.0f}")
+    print(f"  {'':<10} {'connects':>9} {'failed':>7} {'p50':>8} {'p99':>8} {'max':>8}   deploy window p99/max"
+          f"   idle callers: warned, hung up after")
+    for name, deploy in [("restart", restart), ("reload", reload)]:
+        server = start()
+        time.sleep(1)  # let every worker start
+        results, seen = [], []
+        stop = threading.Event()
+        threads = [threading.Thread(target=idle_caller, args=(port, seen), daemon=True) for _ in range(args.callers)]
+        threads += [threading.Thread(target=connect_probe, args=(port, results, stop, args.interval), daemon=True)
+                    for _ in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.before)
+        deployed = time.perf_counter()
+        server = deploy(server)
+        time.sleep(args.after)
+        stop.set()
+        for thread in threads[args.callers:]:
+            thread.join()
+        server.terminate()
+        server.wait()
+
+        times = sorted(t for _, t, _ in results if t is not None)
+        window = sorted(t for started, t, _ in results if t is not None and deployed <= started < deployed + 3)
+        failed = [e for _, _, e in results if e is not None]
+        p = lambda values, q: values[min(len(values) - 1, int(len(values) * q))] * 1e3 if values else float('nan')
+        left = sorted(at - deployed for at, _ in seen)
+        warned = sum(1 for _, notice in seen if notice)
+        hung_up = f"{left[0]:.1f}-{left[-1]:.1f}s" if left else "-"
+        print(f"  {name:<10} {len(results):>9} {len(failed):>7} {p(times, 0.5):6.1f}ms {p(times, 0.99):6.1f}ms "
+              f"{p(times, 1.0):6.1f}ms   {p(window, 0.99):8.1f}ms / {p(window, 1.0):.1f}ms"
+              f"   {warned}/{args.callers}, {hung_up}")
+        if failed:
+            print(f"  {'':<10} failures: {dict(Counter(failed))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI BBS micro-benchmarks")
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    p = sub.add_parser('input', help="input decoder throughput")
+    p.add_argument('--lines', type=int, default=2000)
+    p.add_argument('--repeat', type=int, default=5)
+    p.set_defaults(func=bench_input)
+
+    p = sub.add_parser('output', help="output coalescing: writes and bytes per write")
+    p.add_argument('--batch-ms', type=int, nargs='+', default=[0, 25])
+    p.add_argument('--reply-chars', type=int, default=300)
+    p.add_argument('--repeat', type=int, default=200)
+    p.set_defaults(func=bench_output)
+
+    p = sub.add_parser('animation', help="animation scheduling under a busy loop")
+    p.add_argument('--sessions', type=int, default=200)
+    p.add_argument('--chars', type=int, default=200)
+    p.add_argument('--delay', type=float, default=0.01)
+    p.add_argument('--stall-ms', type=int, default=30)
+    p.set_defaults(func=bench_animation)
+
+    p = sub.add_parser('screen', help="main menu redraw bytes with the virtual screen")
+    p.add_argument('--redraws', type=int, default=1000)
+    p.set_defaults(func=bench_screen)
+
+    p = sub.add_parser('boards', help="message board storage on a large seeded database")
+    p.add_argument('--posts', type=int, default=1000000)
+    p.add_argument('--posts-per-thread', type=int, default=50)
+    p.add_argument('--sessions', type=int, default=50)
+    p.add_argument('--rounds', type=int, default=5)
+    p.add_argument('--readers', type=int, nargs='+', default=[1, 4])
+    p.set_defaults(func=bench_boards)
+
+    p = sub.add_parser('search', help="full-text search vs LIKE on seeded posts")
+    p.add_argument('--posts', type=int, default=200000)
+    p.add_argument('--repeat', type=int, default=5)
+    p.set_defaults(func=bench_search)
+
+    p = sub.add_parser('rooms', help="chat room broadcast fan-out")
+    p.add_argument('--members', type=int, default=1000)
+    p.add_argument('--rate', type=float, default=20, help="lines per second said in the room")
+    p.add_argument('--seconds', type=float, default=5)
+    p.add_argument('--slow', type=float, default=0.02, help="fraction of members on a stalled link")
+    p.add_argument('--kick-after', type=float, default=2, help="seconds squelched before removal")
+    p.set_defaults(func=bench_rooms)
+
+    p = sub.add_parser('mccp', help="MCCP2 compression ratio and CPU cost")
+    p.add_argument('--sessions', type=int, default=200)
+    p.set_defaults(func=bench_mccp)
+
+    p = sub.add_parser('ssh', help="SSH handshake latency and rate")
+    p.add_argument('--handshakes', type=int, default=200)
+    p.add_argument('--clients', type=int, default=8, help="client processes logging in at once")
+    p.add_argument('--workers', type=int, nargs='*', metavar='N',
+                   help="instead, measure bbs_server.py in supervisor mode with each number of workers")
+    p.set_defaults(func=bench_ssh)
+
+    p = sub.add_parser('conversations', help="saved AI conversations: turn latency and resume time")
+    p.add_argument('--callers', type=int, default=200)
+    p.add_argument('--turns', type=int, default=20)
+    p.add_argument('--think', type=float, default=0.05, help="seconds between a caller's turns")
+    p.add_argument('--flush', type=float, default=1.0, help="seconds between batches")
+    p.set_defaults(func=bench_conversations)
+
+    p = sub.add_parser('startup', help="import times, time until telnet and SSH answer, RSS")
+    p.add_argument('--runs', type=int, default=3, help="server starts; the first one creates keys and databases")
+    p.add_argument('--top', type=int, default=5, help="largest direct imports shown per module")
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser('metrics', help="metric recording cost, sharded vs locked, and scrape time")
+    p.add_argument('--records', type=int, default=400000)
+    p.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16])
+    p.set_defaults(func=bench_metrics)
+
+    p = sub.add_parser('logging', help="error storm: print() to stdout vs the event log queue")
+    p.add_argument('--threads', type=int, default=8)
+    p.add_argument('--records', type=int, default=20000, help="errors per thread")
+    p.add_argument('--read-delay', type=float, default=0.001, help="seconds the stdout reader pauses per 4 KB")
+    p.add_argument('--queue', type=int, default=10000)
+    p.set_defaults(func=bench_logging)
+
+    p = sub.add_parser('router', help="time to first token: one model vs several, routed and hedged")
+    p.add_argument('--requests', type=int, default=300)
+    p.add_argument('--concurrency', type=int, default=8)
+    p.add_argument('--fast', default='0.3,1.0', help="lognormal median,sigma of the fast models")
+    p.add_argument('--steady', default='0.5,0.3', help="lognormal median,sigma of the steady model")
+    p.add_argument('--flaky-errors', type=float, default=0.3)
+    p.set_defaults(func=bench_router)
+
+    p = sub.add_parser('reload', help="callers connecting during a deploy: restart vs SIGHUP reload")
+    p.add_argument('--workers', type=int, default=1)
+    p.add_argument('--clients', type=int, default=8, help="threads connecting in a loop")
+    p.add_argument('--interval', type=float, default=0.01, help="seconds each client waits between connects")
+    p.add_argument('--callers', type=int, default=20, help="connected callers to drain")
+    p.add_argument('--drain', type=float, default=5, help="BBS_DRAIN_SECONDS for the server")
+    p.add_argument('--before', type=float, default=2, help="seconds of traffic before the deploy")
+    p.add_argument('--after', type=float, default=8, help="seconds of traffic after it")
+    p.set_defaults(func=bench_reload)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,450 @@
+"""
+Multi-process mode: a supervisor and its worker processes
+
+With BBS_WORKERS above 1 (or BBS_SUPERVISOR=1), bbs_server.py starts as a
+supervisor that binds the telnet and SSH ports once and runs that many
+worker processes (fresh interpreters of bbs_server.py). The workers inherit
+the listening sockets and all accept from them, so new connections go to
+whichever worker is free and every worker gets its own GIL. A worker that
+dies is started again, with a growing delay if it keeps dying; connections
+that arrive meanwhile wait in the kernel's backlog.
+
+Boards, chat logs and search are shared through the SQLite files. Live
+state (who is online, who is in which chat room and what is said there,
+and how many connections each address has open) travels as JSON lines over a socketpair between each worker and the
+supervisor, which relays every message to the other workers and replays
+the current membership to a worker that (re)starts.
+
+SIGHUP reloads: one worker at a time, the supervisor starts a fresh process
+(picking up new code from disk), waits until it accepts on the inherited
+sockets, then tells the old one to drain. The old worker stops accepting,
+counts down to its callers and exits once they have left or BBS_DRAIN_SECONDS
+have passed. The listening sockets stay open throughout, so nobody calling
+during a deploy is refused.
+
+SIGTERM or SIGINT stops: every worker drains for BBS_STOP_DRAIN_SECONDS,
+short enough to fit a container's stop grace period, and the ones still
+running after that are terminated, then killed.
+"""
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+from collections import Counter
+
+WORKERS = max(1, int(os.getenv('BBS_WORKERS', 1)))
+
+# Run under the supervisor even with one worker, so that SIGHUP reloads without dropping callers
+SUPERVISED = WORKERS > 1 or os.getenv('BBS_SUPERVISOR', '0') == '1'
+
+# Set by the supervisor in each worker's environment
+WORKER_ID = int(os.getenv('BBS_WORKER_ID', 0))
+WORKER_LINK_FD = os.getenv('BBS_WORKER_LINK')
+LISTEN_FDS = os.getenv('BBS_LISTEN_FDS')
+
+# Seconds before restarting a worker that exited; doubles up to the max while it keeps failing
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 30.0
+# A worker that ran this long is considered healthy again
+HEALTHY_UPTIME = 60.0
+# Seconds a reloaded worker gets to start accepting before the reload is called off
+READY_TIMEOUT = 60.0
+
+# Seconds workers get to let their callers finish when the supervisor stops;
+# with the exit below it stays inside docker's default 10 s stop grace period
+STOP_DRAIN_SECONDS = float(os.getenv('BBS_STOP_DRAIN_SECONDS', 7))
+# Seconds a worker gets to exit after the drain deadline, and again after SIGTERM, before the next step
+STOP_GRACE = 1.0
+
+# Messages that change shared membership, and the ones that undo them
+_STATE_OPS = {'join': 'leave', 'online': 'offline', 'connected': 'disconnected'}
+
+
+def encode_message(message):
+    return json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+class WorkerLink:
+    """A worker's end of the supervisor socket
+
+    ``publish`` sends a message to all other workers; handlers registered
+    with ``on`` receive theirs. Messages from other workers carry the
+    sender's ``worker`` id. Without a supervisor there is no link and
+    ``get_link`` returns None.
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.handlers = {}
+        self._writer = None
+        self._task = None
+
+    async def start(self):
+        sock = socket.socket(fileno=self.fd)
+        reader, self._writer = await asyncio.open_unix_connection(sock=sock)
+        self._task = asyncio.get_running_loop().create_task(self._read(reader))
+
+    def on(self, op, handler):
+        self.handlers.setdefault(op, []).append(handler)
+
+    def publish(self, op, **fields):
+        if self._writer is None:
+            return
+        fields['op'] = op
+        self._writer.write(encode_message(fields))
+
+    async def _read(self, reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                # The supervisor is gone; a worker must not outlive it
+                print(f"Worker {WORKER_ID}: lost the supervisor, exiting")
+                os._exit(1)
+            try:
+                message = json.loads(line)
+                for handler in self.handlers.get(message.get('op'), ()):
+                    handler(message)
+            except Exception as e:
+                print(f"Worker {WORKER_ID}: bad message from the supervisor: {e}")
+
+
+_link = None
+
+
+def get_link():
+    """This worker's link to the supervisor, or None when running alone"""
+    global _link
+    if _link is None and WORKER_LINK_FD is not None:
+        _link = WorkerLink(int(WORKER_LINK_FD))
+    return _link
+
+
+class Presence:
+    """Callers logged in on this worker and, through the link, on the others"""
+
+    def __init__(self):
+        self.local = Counter()
+        self.remote = {}    # worker id -> Counter of handles
+        self.link = None
+
+    def attach(self, link):
+        self.link = link
+        link.on('online', lambda m: self.remote.setdefault(m['worker'], Counter()).update([m['handle']]))
+        link.on('offline', lambda m: self.remote.get(m['worker'], Counter()).subtract([m['handle']]))
+        link.on('gone', lambda m: self.remote.pop(m['worker'], None))
+
+    def login(self, handle):
+        self.local[handle] += 1
+        if self.link is not None:
+            self.link.publish('online', handle=handle)
+
+    def logout(self, handle):
+        self.local[handle] -= 1
+        if self.link is not None:
+            self.link.publish('offline', handle=handle)
+
+    def count(self):
+        """Callers online on all workers"""
+        return sum(self.local.values()) + sum(sum(c.values()) for c in self.remote.values())
+
+
+def inherited_listeners():
+    """The (telnet, SSH) listening sockets passed down by the supervisor, or None"""
+    if not LISTEN_FDS:
+        return None
+    return tuple(socket.socket(fileno=int(fd)) for fd in LISTEN_FDS.split(','))
+
+
+_presence = None
+
+
+def get_presence():
+    global _presence
+    if _presence is None:
+        _presence = Presence()
+    return _presence
+
+
+class AddressCounts:
+    """Open connections per remote address on this worker and, through the link, on the others
+
+    The other workers' counts arrive a moment late, so an address opening
+    many connections at once across workers can briefly get a few past the
+    limit.
+    """
+
+    def __init__(self):
+        self.local = Counter()
+        self.remote = {}    # worker id -> Counter of addresses
+        self.link = None
+
+    def attach(self, link):
+        self.link = link
+        link.on('connected', lambda m: self._remote(m, 1))
+        link.on('disconnected', lambda m: self._remote(m, -1))
+        link.on('gone', lambda m: self.remote.pop(m['worker'], None))
+
+    def _remote(self, message, change):
+        counts = self.remote.setdefault(message['worker'], Counter())
+        counts[message['ip']] += change
+        if counts[message['ip']] <= 0:
+            del counts[message['ip']]
+
+    def count(self, ip):
+        """Connections from ``ip`` on all workers"""
+        return self.local[ip] + sum(counts[ip] for counts in self.remote.values())
+
+    def add(self, ip):
+        self.local[ip] += 1
+        if self.link is not None:
+            self.link.publish('connected', ip=ip)
+
+    def remove(self, ip):
+        self.local[ip] -= 1
+        if self.local[ip] <= 0:
+            del self.local[ip]
+        if self.link is not None:
+            self.link.publish('disconnected', ip=ip)
+
+
+_addresses = None
+
+
+def get_addresses():
+    global _addresses
+    if _addresses is None:
+        _addresses = AddressCounts()
+    return _addresses
+
+
+class WorkerProcess:
+    """One worker process and the supervisor's end of its link
+
+    During a reload the old and the new process of a slot run side by side,
+    so messages are keyed by process id rather than by slot.
+    """
+
+    def __init__(self, slot, proc, writer):
+        self.slot = slot
+        self.proc = proc
+        self.key = proc.pid
+        self.writer = writer
+        self.ready = asyncio.get_running_loop().create_future()
+        self.started = asyncio.get_running_loop().time()
+        self.draining = False
+        self.task = None
+
+    def send(self, op, **fields):
+        fields['op'] = op
+        self.writer.write(encode_message(fields))
+
+    def drain(self, seconds=None, reason='reload'):
+        """Have the worker stop accepting and let its callers finish
+
+        ``seconds`` overrides the worker's BBS_DRAIN_SECONDS.
+        """
+        self.draining = True
+        if seconds is None:
+            self.send('drain', reason=reason)
+        else:
+            self.send('drain', reason=reason, seconds=seconds)
+
+
+class Supervisor:
+    """Runs the worker processes, relays messages between them and reloads them
+
+    ``listeners`` are the bound listening sockets the workers inherit.
+    """
+
+    def __init__(self, workers, command, listeners=()):
+        self.workers = workers
+        self.command = command
+        self.listeners = list(listeners)
+        self.procs = {}     # process key -> WorkerProcess, draining ones included
+        self.current = {}   # slot -> the WorkerProcess accepting for it
+        self.state = {}     # process key -> Counter of (op, key fields) currently in effect
+        self.stopping = False
+        self._exits = {}    # slot -> future of (process, exit code) for its current process
+        self._reload_task = None
+        self._stop_task = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+        loop.add_signal_handler(signal.SIGHUP, self.request_reload)
+        await asyncio.gather(*(self._keep_running(i) for i in range(self.workers)))
+        if self._stop_task is not None:
+            await self._stop_task
+
+    def stop(self):
+        if self.stopping:
+            # Asked again: no more waiting for callers
+            self._signal_all(signal.SIGTERM)
+            return
+        self.stopping = True
+        self._stop_task = asyncio.get_running_loop().create_task(self.shutdown())
+
+    async def shutdown(self):
+        """Drain every worker, then terminate and at last kill the ones still running"""
+        print(f"Stopping: workers have {STOP_DRAIN_SECONDS:.0f}s to let their callers finish")
+        for process in list(self.procs.values()):
+            if process.proc.returncode is None:
+                process.drain(STOP_DRAIN_SECONDS, reason='stop')
+        if await self._all_exited(STOP_DRAIN_SECONDS + STOP_GRACE):
+            return
+        self._signal_all(signal.SIGTERM)
+        if await self._all_exited(STOP_GRACE):
+            return
+        print("Killing workers that did not exit")
+        self._signal_all(signal.SIGKILL)
+        await self._all_exited(None)
+
+    def _signal_all(self, sig):
+        for process in self.procs.values():
+            if process.proc.returncode is None:
+                process.proc.send_signal(sig)
+
+    async def _all_exited(self, timeout):
+        tasks = [process.task for process in self.procs.values() if process.task is not None]
+        if not tasks:
+            return True
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        return not pending
+
+    def request_reload(self):
+        if self._reload_task is not None and not self._reload_task.done():
+            print("Reload already in progress")
+            return
+        self._reload_task = asyncio.get_running_loop().create_task(self.reload())
+
+    async def reload(self):
+        """Replace the workers one at a time; the old ones drain their callers
+
+        Stops at the first new worker that does not start accepting within
+        READY_TIMEOUT, leaving the remaining old workers in place.
+        """
+        print(f"Reloading {self.workers} worker(s)")
+        for slot in range(self.workers):
+            if self.stopping:
+                return
+            process = await self._start(slot)
+            try:
+                ready = await asyncio.wait_for(asyncio.shield(process.ready), READY_TIMEOUT)
+            except asyncio.TimeoutError:
+                ready = False
+            if not ready:
+                if process.proc.returncode is None:
+                    process.proc.kill()
+                print(f"Reload stopped: the new worker {slot} did not start accepting")
+                return
+            old = self.current.get(slot)
+            self.current[slot] = process
+            if old is not None and old.proc.returncode is None:
+                old.drain()
+                print(f"Worker {slot} reloaded (pid {process.key}); pid {old.key} is draining")
+            else:
+                print(f"Worker {slot} reloaded (pid {process.key})")
+
+    async def _keep_running(self, worker):
+        loop = asyncio.get_running_loop()
+        delay = RESTART_DELAY
+        while not self.stopping:
+            exited = self._exits[worker] = loop.create_future()
+            current = self.current.get(worker)
+            if current is None or current.proc.returncode is not None:
+                self.current[worker] = await self._start(worker)
+            # (else a reload started a new one during the restart delay)
+            # A reload may swap in another process; this resolves when whichever is current exits
+            process, code = await exited
+            if self.stopping:
+                break
+            if loop.time() - process.started > HEALTHY_UPTIME:
+                delay = RESTART_DELAY
+            print(f"Worker {worker} exited with code {code}, restarting in {delay:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+
+    async def _start(self, worker):
+        parent, child = socket.socketpair()
+        env = dict(os.environ, BBS_WORKER_ID=str(worker), BBS_WORKER_LINK=str(child.fileno()))
+        if self.listeners:
+            env['BBS_LISTEN_FDS'] = ','.join(str(s.fileno()) for s in self.listeners)
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable, *self.command, env=env,
+                pass_fds=(child.fileno(),) + tuple(s.fileno() for s in self.listeners))
+        finally:
+            child.close()
+        reader, writer = await asyncio.open_unix_connection(sock=parent)
+        self._replay(writer)
+        process = WorkerProcess(worker, proc, writer)
+        self.procs[process.key] = process
+        process.task = asyncio.get_running_loop().create_task(self._run_worker(process, reader))
+        return process
+
+    async def _run_worker(self, process, reader):
+        relay = asyncio.get_running_loop().create_task(self._relay(process, reader))
+        try:
+            code = await process.proc.wait()
+        finally:
+            relay.cancel()
+            process.writer.close()
+            self.procs.pop(process.key, None)
+            # Whatever the worker had joined is gone with it
+            self.state.pop(process.key, None)
+            self._send_others(process.key, encode_message({'op': 'gone', 'worker': process.key}))
+        if not process.ready.done():
+            process.ready.set_result(False)
+        if process.draining:
+            print(f"Worker {process.slot} (pid {process.key}) finished draining")
+        exited = self._exits.get(process.slot)
+        if self.current.get(process.slot) is process and exited is not None and not exited.done():
+            exited.set_result((process, code))
+        return code
+
+    async def _relay(self, process, reader):
+        state = self.state.setdefault(process.key, Counter())
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            op = message.get('op')
+            if op == 'ready':
+                # The worker accepts on the inherited sockets; for the supervisor only
+                if not process.ready.done():
+                    process.ready.set_result(True)
+                continue
+            if op in _STATE_OPS:
+                state[self._state_key(message)] += 1
+            elif op in _STATE_OPS.values():
+                undo = dict(message, op=next(k for k, v in _STATE_OPS.items() if v == op))
+                key = self._state_key(undo)
+                state[key] -= 1
+                if state[key] <= 0:
+                    del state[key]
+            message['worker'] = process.key
+            self._send_others(process.key, encode_message(message))
+
+    @staticmethod
+    def _state_key(message):
+        return json.dumps({k: v for k, v in message.items() if k != 'worker'}, sort_keys=True)
+
+    def _replay(self, writer):
+        """Tell a starting worker what the others currently have"""
+        for other, state in self.state.items():
+            for key, count in state.items():
+                message = dict(json.loads(key), worker=other)
+                for _ in range(count):
+                    writer.write(encode_message(message))
+
+    def _send_others(self, key, data):
+        for other, process in self.procs.items():
+            if other != key:
+                process.writer.write(data)
@@ -0,0 +1,284 @@
+"""
+Persistent AI conversations, resumed by handle
+
+Every change to a caller's conversation (a turn, a new rolling summary, a
+reset) is appended as one JSON line to a log under data/. Appends are
+buffered and handed to a writer thread that writes and fsyncs them about
+once a second, so a chat turn never waits for the disk. An in-memory index
+maps each handle to its records since its last reset or checkpoint; the
+conversation is read back the first time the handle chats again after a
+restart or reconnect, and dropped from memory once it has been idle.
+
+In multi-process mode (see cluster.py) the workers append to the same file
+and each catches up on the others' records before it loads a conversation.
+A handle chatting on two workers at once keeps a copy on each; the log
+holds the turns of both.
+
+Saving is off unless BBS_SAVE_CHATS is set: a handle is whatever the
+caller types at login, so whoever types it resumes the chats saved under it.
+"""
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Opt-in: handles are not authenticated, so saved chats are open to anyone who types the handle
+SAVE_CHATS = os.getenv('BBS_SAVE_CHATS', '0') != '0'
+
+# Empty to keep conversations in memory only
+CONVERSATIONS_PATH = os.getenv('BBS_CONVERSATIONS_PATH', 'data/conversations.log')
+
+# Seconds appends are buffered before a batch is written and fsync'd
+CONVERSATIONS_FLUSH = float(os.getenv('BBS_CONVERSATIONS_FLUSH', 1.0))
+
+# Seconds an unused conversation stays in memory
+CONVERSATIONS_IDLE = float(os.getenv('BBS_CONVERSATIONS_IDLE', 600))
+
+# Records of one handle after which loading it writes a checkpoint in their place
+CHECKPOINT_RECORDS = 64
+
+# On startup the log is rewritten without dead records once it is this big and mostly dead
+COMPACT_MIN_BYTES = 1 << 20
+
+
+def encode_record(record):
+    return json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+def report_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Conversation log: {future.exception()!r}")
+
+
+def replay(records):
+    """(summary, turns not yet folded into it) from a handle's records"""
+    summary, turns, folded = "", [], 0
+    for record in records:
+        op = record.get('op')
+        if op == 'turn':
+            turns.append({"role": record['role'], "content": record['content']})
+        elif op == 'summary':
+            summary = record['summary']
+            folded += record['folded']
+        elif op == 'state':
+            summary, turns, folded = record['summary'], list(record['turns']), 0
+        elif op == 'reset':
+            summary, turns, folded = "", [], 0
+    return summary, turns[folded:]
+
+
+class ConversationLog:
+    """Append-only conversation log with an index and a cache of live conversations
+
+    ``record`` only buffers; the writer thread owns the file. Loads run on
+    the same thread after the buffered records are written, so a handle
+    always reads back everything said before. The initial index scan and a
+    compaction are queued on that thread too, so a big log never stalls the
+    event loop; whatever comes after them waits its turn.
+    """
+
+    def __init__(self, path=CONVERSATIONS_PATH, flush_interval=CONVERSATIONS_FLUSH, idle=CONVERSATIONS_IDLE):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.idle = idle
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='conversations-writer')
+        self.index = {}     # handle -> [(offset, length)] of its live records
+        self.scanned = 0    # log offset up to which records are indexed
+        self._cache = {}    # handle -> [ConversationContext, last used]
+        self._buffer = []
+        self._flush_handle = None
+        self.indexed = self._in_background(self._scan)  # Future of the startup scan
+
+        # Counters, exported by metrics()
+        self.records = 0
+        self.batches = 0
+        self.bytes_written = 0
+        self.fsync_seconds = 0.0
+        self.loads = 0
+        self.hits = 0
+        self.evicted = 0
+
+    # Called on the event loop
+
+    async def load(self, handle, budget):
+        """The ConversationContext of ``handle``, read back from the log if it is not in memory"""
+        from ai_client import ConversationContext
+        entry = self._cache.get(handle)
+        if entry is None:
+            self._flush()
+            summary, turns, count = await asyncio.get_running_loop().run_in_executor(
+                self._writer, self._load, handle)
+            # Another session of the same handle may have loaded it meanwhile
+            entry = self._cache.get(handle)
+            if entry is None:
+                context = ConversationContext(budget)
+                context.summary = summary
+                for message in turns:
+                    context.append(message)
+                entry = self._cache[handle] = [context, 0]
+                self.loads += 1
+                if count > CHECKPOINT_RECORDS:
+                    self.record(handle, 'state', summary=summary, turns=turns)
+        else:
+            self.hits += 1
+        entry[1] = time.monotonic()
+        return entry[0]
+
+    def record(self, handle, op, **fields):
+        """Queue one record; it reaches the disk with the next batch"""
+        fields['handle'] = handle
+        fields['op'] = op
+        self._buffer.append(encode_record(fields))
+        self.records += 1
+        entry = self._cache.get(handle)
+        if entry is not None:
+            entry[1] = time.monotonic()
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.flush_interval, self._flush)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self.evict_idle()
+        if self._buffer:
+            batch, self._buffer = b"".join(self._buffer), []
+            self._writer.submit(self._write, batch)
+
+    def _in_background(self, func):
+        """Queue ``func`` on the writer thread without waiting for it; a failure is printed"""
+        future = self._writer.submit(func)
+        future.add_done_callback(report_failure)
+        return future
+
+    def evict_idle(self):
+        """Drop conversations nobody used for ``idle`` seconds; they stay in the log"""
+        cutoff = time.monotonic() - self.idle
+        for handle in [h for h, entry in self._cache.items() if entry[1] < cutoff]:
+            del self._cache[handle]
+            self.evicted += 1
+
+    # Run on the writer thread
+
+    def _write(self, batch):
+        view = memoryview(batch)
+        while view:
+            view = view[os.write(self._fd, view):]
+        started = time.perf_counter()
+        os.fsync(self._fd)
+        self.fsync_seconds += time.perf_counter() - started
+        self.batches += 1
+        self.bytes_written += len(batch)
+
+    def _scan(self):
+        """Index the records appended since the last scan, by any process"""
+        with open(self.path, 'rb') as f:
+            f.seek(self.scanned)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break   # still being written
+                offset = self.scanned
+                self.scanned += len(line)
+                try:
+                    record = json.loads(line)
+                    handle, op = record['handle'], record['op']
+                except (ValueError, KeyError):
+                    continue
+                if op == 'reset':
+                    self.index.pop(handle, None)
+                elif op == 'state':
+                    self.index[handle] = [(offset, len(line))]
+                else:
+                    self.index.setdefault(handle, []).append((offset, len(line)))
+
+    def _load(self, handle):
+        self._scan()
+        spans = self.index.get(handle, ())
+        records = [json.loads(os.pread(self._fd, length, offset)) for offset, length in spans]
+        summary, turns = replay(records)
+        return summary, turns, len(spans)
+
+    def _compact(self):
+        size = os.fstat(self._fd).st_size
+        live = sum(length for spans in self.index.values() for _, length in spans)
+        if size < COMPACT_MIN_BYTES or live * 2 > size:
+            return False
+        spans = sorted(span for spans in self.index.values() for span in spans)
+        tmp = self.path + ".tmp"
+        with open(tmp, 'wb') as f:
+            for offset, length in spans:
+                f.write(os.pread(self._fd, length, offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        os.close(self._fd)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        self.index, self.scanned = {}, 0
+        self._scan()
+        print(f"Compacted {self.path}: {size // 1024} KB -> {live // 1024} KB")
+        return True
+
+    # Startup and shutdown
+
+    def compact(self):
+        """Rewrite the log with only the live records, if it is mostly dead
+
+        Only safe while no other process appends: at startup of a single
+        process, or in the supervisor before the workers start. Returns a
+        concurrent.futures.Future of whether it compacted.
+        """
+        return self._in_background(self._compact)
+
+    def stats(self):
+        return {
+            'records': self.records,
+            'batches': self.batches,
+            'bytes_written': self.bytes_written,
+            'fsync_ms': round(self.fsync_seconds * 1000, 1),
+            'handles': len(self.index),
+            'in_memory': len(self._cache),
+            'loads': self.loads,
+            'hits': self.hits,
+            'evicted': self.evicted,
+        }
+
+    def metrics(self):
+        """Scrape-time log and cache figures (a metrics collector)"""
+        return [
+            ('bbs_conversation_records_total', 'counter', "Conversation records appended", [({}, self.records)]),
+            ('bbs_conversation_batches_total', 'counter', "Conversation log batches written and fsync'd",
+             [({}, self.batches)]),
+            ('bbs_conversation_bytes_total', 'counter', "Conversation log bytes written", [({}, self.bytes_written)]),
+            ('bbs_conversation_fsync_seconds_total', 'counter', "Time the writer thread spent in fsync",
+             [({}, self.fsync_seconds)]),
+            ('bbs_conversation_loads_total', 'counter', "Conversations looked up, by where they came from",
+             [({'from': 'log'}, self.loads), ({'from': 'memory'}, self.hits)]),
+            ('bbs_conversation_evictions_total', 'counter', "Idle conversations dropped from memory",
+             [({}, self.evicted)]),
+            ('bbs_conversations_in_memory', 'gauge', "Conversations held in memory", [({}, len(self._cache))]),
+        ]
+
+    def close(self):
+        """Write out what is still buffered and close the file"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._buffer:
+            batch, self._buffer = b"".join(self._buffer), []
+            self._writer.submit(self._write, batch)
+        self._writer.shutdown()
+        os.close(self._fd)
+
+
+_conversations = None
+
+
+def get_conversations():
+    """The process-wide conversation log, or None when persistence is off"""
+    global _conversations
+    if _conversations is None and SAVE_CHATS and CONVERSATIONS_PATH:
+        _conversations = ConversationLog()
+    return _conversations
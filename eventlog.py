@@ -0,0 +1,218 @@
+"""
+Structured event log: JSON lines in logs/, written by a background thread
+
+Sessions and the AI client hand records (errors, and audit events such as
+logins, menu choices and AI turns) to ``log_event``/``log_error``, which
+only append a dict to a bounded in-memory queue. One writer thread wakes
+about twice a second, encodes the queued records and writes them with a
+single write() per batch, rotating the file by size. When the queue is
+full new records are dropped and counted; the writer notes the count in
+the log itself, so a gap is never silent.
+
+Every record carries the time, level, event name, process id and, for
+session events, the session id that ``python sysop.py sessions`` shows,
+so one caller's records can be pulled out with e.g.
+``jq 'select(.session == 12)'``. Errors are also echoed to stdout by the
+writer, at most BBS_EVENT_LOG_ECHO per batch.
+
+In multi-process mode each worker writes its own file (``bbs-<worker
+id>.jsonl``), so rotation only races while a reload replaces a worker.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+LOGS_DIR = os.getenv('BBS_LOGS_DIR', 'logs')
+
+# Event log file in LOGS_DIR (empty turns it off; errors are then printed)
+EVENT_LOG = os.getenv('BBS_EVENT_LOG', 'bbs.jsonl')
+
+# Records waiting for the writer before new ones are dropped
+EVENT_LOG_QUEUE = int(os.getenv('BBS_EVENT_LOG_QUEUE', 10000))
+
+# The file is rotated at this size, keeping this many old files (bbs.jsonl.1 ...)
+EVENT_LOG_MAX_BYTES = int(float(os.getenv('BBS_EVENT_LOG_MAX_MB', 20)) * 1024 * 1024)
+EVENT_LOG_BACKUPS = int(os.getenv('BBS_EVENT_LOG_BACKUPS', 5))
+
+# Errors echoed to stdout per batch (0 for none); the rest are only counted there
+EVENT_LOG_ECHO = int(os.getenv('BBS_EVENT_LOG_ECHO', 20))
+
+# Seconds between batches; a queue this full wakes the writer early
+EVENT_LOG_FLUSH = 0.5
+EVENT_LOG_WAKE = 1000
+
+
+class EventLog:
+    """Bounded queue of records and the thread that writes them out
+
+    ``emit`` may be called from any thread. It never blocks and never does
+    I/O: the record dict is encoded on the writer thread.
+    """
+
+    def __init__(self, path, queue_size=EVENT_LOG_QUEUE, max_bytes=EVENT_LOG_MAX_BYTES,
+                 backups=EVENT_LOG_BACKUPS, echo=EVENT_LOG_ECHO, flush_interval=EVENT_LOG_FLUSH):
+        self.path = path
+        self.queue_size = queue_size
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.echo = echo
+        self.flush_interval = flush_interval
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._size = os.fstat(self._fd).st_size
+        self._queue = deque()
+        self._wake = threading.Event()
+        self._closing = False
+        self._pid = os.getpid()
+
+        # Counters, exported by event_log_metrics() in bbs_server.py
+        self.records = 0
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.batches = 0
+        self.bytes_written = 0
+        self.rotations = 0
+        self.write_errors = 0
+
+        self._thread = threading.Thread(target=self._run, name='event-log', daemon=True)
+        self._thread.start()
+
+    def emit(self, event, level='info', session=None, **fields):
+        """Queue one record; dropped (and counted) if the writer is too far behind"""
+        if len(self._queue) >= self.queue_size:
+            self.dropped += 1
+            return
+        record = {'ts': time.time(), 'level': level, 'event': event, 'pid': self._pid}
+        if session is not None:
+            record['session'] = session
+        record.update(fields)
+        self._queue.append(record)
+        self.records += 1
+        if len(self._queue) == EVENT_LOG_WAKE:
+            self._wake.set()
+
+    # Writer thread
+
+    def _run(self):
+        while not self._closing:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._write_batch()
+        self._write_batch()
+
+    def _write_batch(self):
+        lines = []
+        echo = []
+        errors = 0
+        while self._queue:
+            record = self._queue.popleft()
+            lines.append(json.dumps(record, ensure_ascii=False, default=str))
+            if record['level'] == 'error':
+                errors += 1
+                if len(echo) < self.echo:
+                    echo.append(self._format(record))
+        dropped = self.dropped - self.reported_dropped
+        if dropped:
+            self.reported_dropped += dropped
+            lines.append(json.dumps({'ts': time.time(), 'level': 'warning', 'event': 'log.dropped',
+                                     'pid': self._pid, 'count': dropped, 'total': self.reported_dropped}))
+            echo.append(f"Event log queue full: dropped {dropped} records")
+        if not lines:
+            return
+        data = ("\n".join(lines) + "\n").encode('utf-8')
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(self._fd, view):]
+            self._size += len(data)
+            self.batches += 1
+            self.bytes_written += len(data)
+            if self._size >= self.max_bytes:
+                self._rotate()
+        except OSError as e:
+            self.write_errors += 1
+            echo.append(f"Event log write to {self.path} failed: {e}")
+        if self.echo:
+            if errors > self.echo:
+                echo.append(f"... and {errors - self.echo} more errors in {self.path}")
+            if echo:
+                sys.stdout.write("\n".join(echo) + "\n")
+                sys.stdout.flush()
+
+    @staticmethod
+    def _format(record):
+        session = f" (session {record['session']})" if 'session' in record else ""
+        return f"Error in {record.get('where', record['event'])}{session}: {record.get('error', '')}"
+
+    def _rotate(self):
+        inode = os.fstat(self._fd).st_ino
+        os.close(self._fd)
+        try:
+            # The draining worker of a reload shares the file and may have rotated it already
+            rotated = os.stat(self.path).st_ino != inode
+        except FileNotFoundError:
+            rotated = True
+        if not rotated:
+            for i in range(self.backups - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{i}"):
+                    os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+            if self.backups:
+                os.replace(self.path, f"{self.path}.1")
+            else:
+                os.unlink(self.path)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._size = 0
+        self.rotations += 1
+
+    def stats(self):
+        return {
+            'records': self.records,
+            'dropped': self.dropped,
+            'queued': len(self._queue),
+            'batches': self.batches,
+            'bytes_written': self.bytes_written,
+            'rotations': self.rotations,
+            'write_errors': self.write_errors,
+        }
+
+    def close(self):
+        """Write out everything queued and stop the writer"""
+        self._closing = True
+        self._wake.set()
+        self._thread.join()
+        os.close(self._fd)
+
+
+_event_log = None
+
+
+def get_event_log():
+    """The process-wide event log, or None when it is off"""
+    global _event_log
+    if _event_log is None and EVENT_LOG:
+        from cluster import WORKER_ID, WORKERS
+        name = EVENT_LOG
+        if WORKERS > 1:
+            base, ext = os.path.splitext(EVENT_LOG)
+            name = f"{base}-{WORKER_ID}{ext}"
+        _event_log = EventLog(os.path.join(LOGS_DIR, name))
+    return _event_log
+
+
+def log_event(event, session=None, **fields):
+    """Record an audit event, e.g. ``log_event('login', 12, handle='neo')``"""
+    log = get_event_log()
+    if log is not None:
+        log.emit(event, 'info', session, **fields)
+
+
+def log_error(where, exc, session=None, **fields):
+    """Record a caught exception (printed instead when the event log is off)"""
+    log = get_event_log()
+    if log is not None:
+        log.emit('error', 'error', session, where=where, type=type(exc).__name__, error=str(exc), **fields)
+    else:
+        print(f"Error in {where}: {exc}")
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+End-to-end load generator for the BBS
+
+Drives concurrent telnet and SSH callers through the real menu flow (handle,
+AI chat, system info, message boards, quit) and reports, per concurrency
+level: connections/sec, p50/p99 latency per screen, AI round trip and time
+to first character, and the server's RSS and thread count.
+
+    # Spawn the server against a built-in mock API (no quota used)
+    python loadgen.py --spawn --levels 10 50 200 --ssh-ratio 0.2
+
+    # Or load an already running server
+    python loadgen.py --host 127.0.0.1 --port 2323 --ssh-port 2222 --server-pid 1234
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from mock_openrouter import MockOpenRouter, parse_per_model
+
+CHOICE = b"Enter your choice: "
+HANDLE = b"Enter your handle: "
+CONTINUE = b"continue..."
+BACK = b"go back: "
+
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def process_stats(pid):
+    """RSS (MiB) and thread count of a process from /proc"""
+    rss = threads = None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) / 1024
+                elif line.startswith('Threads:'):
+                    threads = int(line.split()[1])
+    except OSError:
+        pass
+    return rss, threads
+
+
+class TelnetCaller:
+    """Telnet connection with expect-style reads"""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port, limit=1 << 20)
+
+    async def send(self, text):
+        self.writer.write(text.encode('utf-8'))
+        await self.writer.drain()
+
+    async def expect(self, marker):
+        await asyncio.wait_for(self.reader.readuntil(marker), self.timeout)
+
+    async def expect_eof(self):
+        await asyncio.wait_for(self.reader.read(), self.timeout)
+
+    async def close(self):
+        self.writer.close()
+
+
+class SSHCaller:
+    """Paramiko SSH connection; blocking calls run on a worker thread"""
+
+    def __init__(self, timeout, executor):
+        self.timeout = timeout
+        self.executor = executor
+        self.buffer = b""
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def _connect(self, host, port):
+        import paramiko
+        self.client = paramiko.SSHClient()
+        self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.client.connect(host, port, username='load', password='load', timeout=self.timeout,
+                            look_for_keys=False, allow_agent=False)
+        self.channel = self.client.invoke_shell()
+        self.channel.settimeout(self.timeout)
+
+    def _expect(self, marker):
+        while True:
+            index = self.buffer.find(marker)
+            if index >= 0:
+                self.buffer = self.buffer[index + len(marker):]
+                return
+            data = self.channel.recv(65536)
+            if not data:
+                raise ConnectionError("SSH channel closed")
+            self.buffer += data
+
+    def _expect_eof(self):
+        while self.channel.recv(65536):
+            pass
+
+    async def connect(self, host, port):
+        await self._run(self._connect, host, port)
+
+    async def send(self, text):
+        await self._run(self.channel.sendall, text.encode('utf-8'))
+
+    async def expect(self, marker):
+        await self._run(self._expect, marker)
+
+    async def expect_eof(self):
+        await self._run(self._expect_eof)
+
+    async def close(self):
+        await self._run(self.client.close)
+
+
+class Results:
+    def __init__(self):
+        self.screens = defaultdict(list)
+        self.ai_rtt = []
+        self.ai_first_char = []
+        self.connect_times = []
+        self.errors = defaultdict(int)
+        self.completed = 0
+
+
+async def caller_flow(caller, host, port, handle, messages, results):
+    """One caller walking through the menus"""
+    async def screen(name, send, marker):
+        started = time.monotonic()
+        await caller.send(send)
+        await caller.expect(marker)
+        results.screens[name].append(time.monotonic() - started)
+
+    started = time.monotonic()
+    await caller.connect(host, port)
+    await caller.expect(HANDLE)
+    results.connect_times.append(time.monotonic())
+    results.screens['connect'].append(time.monotonic() - started)
+
+    prompt = f"{handle}>".encode()
+    await screen('welcome', f"{handle}\r", CHOICE)
+    await screen('chat', "1\r", prompt)
+    for i in range(messages):
+        started = time.monotonic()
+        await caller.send(f"load test message {i} from {handle}\r")
+        await caller.expect(b"AI>")
+        results.ai_first_char.append(time.monotonic() - started)
+        await caller.expect(prompt)
+        results.ai_rtt.append(time.monotonic() - started)
+    await screen('menu', "/exit\r", CHOICE)
+    await screen('system_info', "4\r", CONTINUE)
+    await screen('menu', "\r", CHOICE)
+    await screen('message_boards', "2\r", BACK)
+    await screen('board_threads', "1\r", BACK)
+    await screen('message_boards', "\r", BACK)
+    await screen('menu', "\r", CHOICE)
+
+    started = time.monotonic()
+    await caller.send("q\r")
+    await caller.expect_eof()
+    results.screens['goodbye'].append(time.monotonic() - started)
+    await caller.close()
+    results.completed += 1
+
+
+async def run_level(args, level, server_pid):
+    results = Results()
+    ssh_count = int(round(level * args.ssh_ratio))
+    executor = ThreadPoolExecutor(max_workers=max(1, ssh_count))
+    peak = [0.0, 0]
+    stop = asyncio.Event()
+
+    async def sample():
+        while not stop.is_set():
+            rss, threads = process_stats(server_pid) if server_pid else (None, None)
+            if rss is not None:
+                peak[0] = max(peak[0], rss)
+                peak[1] = max(peak[1], threads)
+            try:
+                await asyncio.wait_for(stop.wait(), 0.25)
+            except asyncio.TimeoutError:
+                pass
+
+    async def one(n):
+        if n < ssh_count:
+            caller, port, proto = SSHCaller(args.timeout, executor), args.ssh_port, 'ssh'
+        else:
+            caller, port, proto = TelnetCaller(args.timeout), args.port, 'telnet'
+        try:
+            await caller_flow(caller, args.host, port, f"load{level}x{n}", args.messages, results)
+        except Exception as e:
+            results.errors[f"{proto}:{type(e).__name__}"] += 1
+            try:
+                await caller.close()
+            except Exception:
+                pass
+
+    sampler = asyncio.ensure_future(sample())
+    started = time.monotonic()
+    await asyncio.gather(*[one(n) for n in range(level)])
+    elapsed = time.monotonic() - started
+    stop.set()
+    await sampler
+    executor.shutdown(wait=False)
+
+    connected = len(results.connect_times)
+    connect_window = (max(results.connect_times) - started) if connected else float('nan')
+    print(f"\n=== {level} callers ({level - ssh_count} telnet, {ssh_count} ssh) in {elapsed:.1f}s ===")
+    print(f"  completed {results.completed}/{level}, connections/sec {connected / connect_window:.1f}")
+    for name in ('connect', 'welcome', 'chat', 'menu', 'system_info', 'message_boards', 'board_threads', 'goodbye'):
+        values = results.screens.get(name)
+        if values:
+            print(f"  {name:<16} p50 {percentile(values, 50) * 1e3:8.1f} ms   p99 {percentile(values, 99) * 1e3:8.1f} ms")
+    if results.ai_rtt:
+        print(f"  {'ai_first_char':<16} p50 {percentile(results.ai_first_char, 50) * 1e3:8.1f} ms   "
+              f"p99 {percentile(results.ai_first_char, 99) * 1e3:8.1f} ms")
+        print(f"  {'ai_round_trip':<16} p50 {percentile(results.ai_rtt, 50) * 1e3:8.1f} ms   "
+              f"p99 {percentile(results.ai_rtt, 99) * 1e3:8.1f} ms")
+    if server_pid:
+        print(f"  server peak RSS {peak[0]:.1f} MiB, peak threads {peak[1]}")
+    if results.errors:
+        print(f"  errors: {dict(results.errors)}")
+
+
+def wait_for_port(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def start_mock(args):
+    """Run the mock API on its own loop in a background thread"""
+    mock = MockOpenRouter(args.mock_latency, args.mock_token_delay, args.mock_reply_tokens,
+                          args.mock_error_rate, args.mock_rate_limit_rate,
+                          model_latency=parse_per_model(args.mock_model_latency),
+                          model_error_rate=parse_per_model(args.mock_model_error_rate, float))
+    loop = asyncio.new_event_loop()
+    port = loop.run_until_complete(mock.start('127.0.0.1', args.mock_port))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return mock, port
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI BBS load generator")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2323)
+    parser.add_argument('--ssh-port', type=int, default=2222)
+    parser.add_argument('--levels', type=int, nargs='+', default=[10, 50, 100])
+    parser.add_argument('--ssh-ratio', type=float, default=0.2, help="fraction of callers using SSH")
+    parser.add_argument('--messages', type=int, default=2, help="AI chat messages per caller")
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--server-pid', type=int, help="sample RSS/threads of this process")
+    parser.add_argument('--spawn', action='store_true', help="start bbs_server.py wired to a mock API")
+    parser.add_argument('--mock-port', type=int, default=0)
+    parser.add_argument('--mock-latency', default='lognormal:0.8,0.5')
+    parser.add_argument('--mock-token-delay', type=float, default=0.02)
+    parser.add_argument('--mock-reply-tokens', type=int, default=60)
+    parser.add_argument('--mock-error-rate', type=float, default=0.0)
+    parser.add_argument('--mock-rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--mock-model-latency', action='append', metavar='MODEL=SPEC',
+                        help="latency of one model, for AI_MODELS routing (repeatable)")
+    parser.add_argument('--mock-model-error-rate', action='append', metavar='MODEL=RATE')
+    args = parser.parse_args()
+
+    server = None
+    server_pid = args.server_pid
+    mock = None
+    if args.spawn:
+        mock, mock_port = start_mock(args)
+        env = dict(os.environ,
+                   BBS_PORT=str(args.port), SSH_PORT=str(args.ssh_port),
+                   AI_BASE_URL=f"http://127.0.0.1:{mock_port}/api/v1",
+                   OPENROUTER_API_KEY=os.getenv('OPENROUTER_API_KEY', 'mock'),
+                   BBS_MAX_PER_IP='0')  # every simulated caller comes from 127.0.0.1
+        server = subprocess.Popen([sys.executable, 'bbs_server.py'], env=env,
+                                  stdout=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__)))
+        server_pid = server.pid
+        if not (wait_for_port(args.host, args.port) and wait_for_port(args.host, args.ssh_port)):
+            server.kill()
+            sys.exit("Server did not come up")
+        print(f"Spawned server pid {server_pid} against mock API on port {mock_port}")
+
+    rss, threads = process_stats(server_pid) if server_pid else (None, None)
+    if rss is not None:
+        print(f"Idle server: RSS {rss:.1f} MiB, {threads} threads")
+    try:
+        for level in args.levels:
+            asyncio.run(run_level(args, level, server_pid))
+        if mock is not None:
+            print(f"\nMock API: {mock.stats()}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
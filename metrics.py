@@ -0,0 +1,311 @@
+"""
+Prometheus metrics for the server, served as text on a local HTTP port
+
+Counters, gauges and histograms keep one shard per thread: recording adds
+to the calling thread's own shard without a lock, and a scrape sums the
+shards. Nearly everything is recorded on the event loop thread, so in
+practice a metric has one or two shards. Counters that already exist as
+plain dicts elsewhere (``ssh_stats``, ``limit_stats``) are read by
+collector functions at scrape time instead of being counted twice.
+
+In multi-process mode every worker serves its own metrics on
+BBS_METRICS_PORT plus its worker id.
+"""
+import asyncio
+import os
+import resource
+import threading
+import time
+from bisect import bisect_left
+
+# Local port for the /metrics endpoint (0 turns it off)
+METRICS_PORT = int(os.getenv('BBS_METRICS_PORT', 9323))
+METRICS_HOST = os.getenv('BBS_METRICS_HOST', '127.0.0.1')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Child:
+    """One label combination of a metric, with a shard per recording thread"""
+
+    def __init__(self, size):
+        self._size = size
+        self._local = threading.local()
+        self._shards = []
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = [0] * self._size
+            self._shards.append(shard)  # list.append is atomic; scrapes may iterate meanwhile
+            return shard
+
+    def _total(self):
+        total = [0] * self._size
+        for shard in list(self._shards):
+            for i, value in enumerate(shard):
+                total[i] += value
+        return total
+
+
+class _CounterChild(_Child):
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount=1):
+        self._shard()[0] += amount
+
+    def value(self):
+        return self._total()[0]
+
+
+class _GaugeChild(_CounterChild):
+    def dec(self, amount=1):
+        self._shard()[0] -= amount
+
+
+class _HistogramChild(_Child):
+    def __init__(self, buckets):
+        super().__init__(len(buckets) + 2)    # bucket counts, +Inf, then the sum
+        self._buckets = buckets
+
+    def observe(self, value):
+        shard = self._shard()
+        shard[bisect_left(self._buckets, value)] += 1
+        shard[-1] += value
+
+
+class Metric:
+    """A named metric; ``labels(...)`` picks the child to record on"""
+    TYPE = None
+
+    def __init__(self, name, help, labels=(), registry=None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children = {}
+        if not self.label_names:
+            self._default = self.labels()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.label_names)
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{format_labels(self.label_names, values)} {format_value(child._total()[0])}"]
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labels, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def _render_child(self, values, child):
+        total = child._total()
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), total[:-1]):
+            cumulative += count
+            labels = format_labels(self.label_names, values, [('le', format_value(float(bound)))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = format_labels(self.label_names, values)
+        lines.append(f"{self.name}_sum{labels} {format_value(total[-1])}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Metrics and scrape-time collectors, rendered in Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def collector(self, func):
+        """Add ``func()``, returning (name, type, help, [(labels dict, value)]) tuples; usable as a decorator"""
+        self.collectors.append(func)
+        return func
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for func in self.collectors:
+            try:
+                families = func()
+            except Exception as e:
+                print(f"Metrics collector {func.__name__} failed: {e}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{format_labels(labels.keys(), labels.values())} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+@REGISTRY.collector
+def process_metrics():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    families = [('process_cpu_seconds_total', 'counter', "User and system CPU time of this process",
+                 [({}, usage.ru_utime + usage.ru_stime)]),
+                ('process_threads', 'gauge', "Threads in this process", [({}, threading.active_count())])]
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        families.append(('process_resident_memory_bytes', 'gauge', "Resident memory", [({}, rss)]))
+    except (OSError, ValueError):
+        pass
+    return families
+
+
+# Sessions and connections
+SESSIONS = Gauge('bbs_sessions_active', "Sessions currently connected", ['protocol'])
+ACCEPTS = Counter('bbs_accepts_total', "Connections accepted", ['protocol'])
+SSH_HANDSHAKE_SECONDS = Histogram('bbs_ssh_handshake_seconds', "Accept to open shell channel, queueing included",
+                                  ['result'])
+RENDER_SECONDS = Histogram('bbs_screen_render_seconds', "From drawing a screen until it waits for the caller",
+                           ['screen'])
+RENDER_BYTES = Histogram('bbs_screen_render_bytes', "Bytes sent for a screen until it waits for the caller",
+                         ['screen'], buckets=BYTES_BUCKETS)
+ERRORS = Counter('bbs_errors_total', "Errors caught and logged, by where and exception type", ['where', 'type'])
+ANIMATION_FRAMES = Counter('bbs_animation_frames_total',
+                           "Animation frames by how they went out (late: with the next frame, "
+                           "skipped: all at once after a key press)", ['result'])
+
+# AI requests
+AI_QUEUE_SECONDS = Histogram('bbs_ai_queue_seconds', "Wait for an AI request slot", ['kind'])
+AI_FIRST_TOKEN_SECONDS = Histogram('bbs_ai_first_token_seconds', "Request start to first reply token")
+AI_REQUEST_SECONDS = Histogram('bbs_ai_request_seconds', "Request start to complete reply", ['kind'])
+AI_REQUESTS = Counter('bbs_ai_requests_total', "Chat turns by outcome", ['outcome'])
+AI_TOKENS = Counter('bbs_ai_tokens_total', "Tokens used, as reported by the API (else estimated)", ['kind'])
+AI_MODEL_REQUESTS = Counter('bbs_ai_model_requests_total',
+                            "Requests per model by outcome, hedges included (cancelled: lost a race)",
+                            ['model', 'outcome'])
+AI_HEDGES = Counter('bbs_ai_hedges_total', "Hedged duplicate requests, by which request answered", ['winner'])
+AI_RETRIES = Counter('bbs_ai_retries_total', "Requests started over after every model failed")
+
+
+def error(where, exc):
+    """Count a caught exception"""
+    ERRORS.labels(where, type(exc).__name__).inc()
+
+
+class RenderTimer:
+    """Times the screen a session is drawing; ``end`` is called when it waits for input"""
+    __slots__ = ('screen', 'started', 'bytes_before')
+
+    def __init__(self, screen, bytes_before):
+        self.screen = screen
+        self.started = time.perf_counter()
+        self.bytes_before = bytes_before
+
+    def end(self, bytes_after):
+        RENDER_SECONDS.labels(self.screen).observe(time.perf_counter() - self.started)
+        RENDER_BYTES.labels(self.screen).observe(bytes_after - self.bytes_before)
+
+
+async def _handle_scrape(reader, writer):
+    try:
+        request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+        path = request.split(b" ", 2)[1] if request.count(b" ") >= 2 else b""
+        if path.split(b"?")[0] == b"/metrics":
+            body = REGISTRY.render().encode('utf-8')
+            status, content_type = "200 OK", "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body = b"Not found: try /metrics\n"
+            status, content_type = "404 Not Found", "text/plain"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_metrics(port, host=METRICS_HOST, wait=0):
+    """Start the /metrics HTTP endpoint; returns the server, or None if the port is taken
+
+    A taken port is retried for ``wait`` seconds first: after a reload the
+    draining worker lets go of it once the new one is accepting.
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        try:
+            return await asyncio.start_server(_handle_scrape, host, port)
+        except OSError as e:
+            if time.monotonic() < deadline:
+                await asyncio.sleep(0.25)
+                continue
+            print(f"Metrics endpoint not started on {host}:{port}: {e}")
+            return None
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the OpenRouter (OpenAI-compatible) chat completions API
+
+Lets the BBS be load tested without spending API quota. Point the server at
+it with AI_BASE_URL:
+
+    python mock_openrouter.py --port 8099 --latency lognormal:0.8,0.5
+    AI_BASE_URL=http://127.0.0.1:8099/api/v1 OPENROUTER_API_KEY=mock python bbs_server.py
+
+Latency specs: "0.5" or "fixed:0.5", "uniform:LOW,HIGH", "normal:MEAN,STDDEV",
+"lognormal:MEDIAN,SIGMA", "exp:MEAN" (seconds, time to first token).
+Models can be given their own latency and error rate, to exercise routing
+between several (AI_MODELS):
+
+    python mock_openrouter.py --model-latency slow/model=lognormal:3,0.8 --model-error-rate flaky/model=0.5
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from collections import Counter
+
+WORDS = ("hello caller welcome to the board the modem sings at night and the "
+         "sysop is still awake reading your messages over a warm cup of coffee "
+         "привет как дела всё работает отлично").split()
+
+
+def parse_latency(spec):
+    """Turn a latency spec into a zero-argument sampler (seconds)"""
+    kind, _, params = spec.partition(':')
+    if not params:
+        kind, params = 'fixed', kind
+    values = [float(v) for v in params.split(',')]
+    if kind == 'fixed':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'normal':
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    if kind == 'lognormal':
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1])
+    if kind == 'exp':
+        return lambda: random.expovariate(1 / values[0])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class MockOpenRouter:
+    """Minimal HTTP/1.1 keep-alive server speaking /chat/completions"""
+
+    def __init__(self, latency='0.5', token_delay=0.02, reply_tokens=60,
+                 error_rate=0.0, rate_limit_rate=0.0, disconnect_rate=0.0,
+                 model_latency=None, model_error_rate=None):
+        self.latency = parse_latency(latency) if isinstance(latency, str) else latency
+        self.model_latency = {model: parse_latency(spec) if isinstance(spec, str) else spec
+                              for model, spec in (model_latency or {}).items()}
+        self.model_error_rate = dict(model_error_rate or {})
+        self.token_delay = token_delay
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.disconnect_rate = disconnect_rate
+        self.server = None
+
+        # Counters
+        self.connections = 0
+        self.requests = 0
+        self.streams = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.disconnects = 0
+        self.by_model = Counter()
+
+    async def start(self, host='127.0.0.1', port=8099):
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def stats(self):
+        return {
+            'connections': self.connections,
+            'requests': self.requests,
+            'streams': self.streams,
+            'errors': self.errors,
+            'rate_limited': self.rate_limited,
+            'disconnects': self.disconnects,
+            'by_model': dict(self.by_model),
+        }
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    return
+                method, path, body = request
+                if method != 'POST' or not path.endswith('/chat/completions'):
+                    # HEAD probes from connection pre-warming and anything else
+                    self._respond(writer, 200 if method == 'HEAD' else 404, b'')
+                    await writer.drain()
+                    continue
+                if not await self._completion(writer, json.loads(body or b'{}')):
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        method, path, _ = line.decode('latin-1').split(' ', 2)
+        length = 0
+        while True:
+            header = await reader.readline()
+            if header in (b'\r\n', b''):
+                break
+            name, _, value = header.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        body = await reader.readexactly(length) if length else b''
+        return method, path, body
+
+    def _respond(self, writer, status, body, content_type='application/json', extra=''):
+        reason = {200: 'OK', 404: 'Not Found', 429: 'Too Many Requests', 500: 'Internal Server Error'}[status]
+        writer.write(f"HTTP/1.1 {status} {reason}\r\ncontent-type: {content_type}\r\n"
+                     f"content-length: {len(body)}\r\n{extra}\r\n".encode() + body)
+
+    async def _completion(self, writer, request):
+        """Serve one completion; returns False if the connection was dropped"""
+        self.requests += 1
+        model = request.get('model', 'mock')
+        self.by_model[model] += 1
+        error_rate = self.model_error_rate.get(model, self.error_rate)
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            self.rate_limited += 1
+            body = json.dumps({"error": {"message": "Rate limit exceeded", "code": 429}}).encode()
+            self._respond(writer, 429, body, extra='retry-after: 1\r\n')
+            await writer.drain()
+            return True
+        if roll < self.rate_limit_rate + error_rate:
+            self.errors += 1
+            body = json.dumps({"error": {"message": "Upstream provider error", "code": 500}}).encode()
+            self._respond(writer, 500, body)
+            await writer.drain()
+            return True
+
+        await asyncio.sleep(self.model_latency.get(model, self.latency)())
+        messages = request.get('messages', [])
+        prompt_tokens = sum(len(m.get('content', '')) for m in messages) // 4
+        tokens = [random.choice(WORDS) + ' ' for _ in range(min(self.reply_tokens, request.get('max_tokens') or 500))]
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                 "total_tokens": prompt_tokens + len(tokens)}
+        created = int(time.time())
+
+        if not request.get('stream'):
+            body = json.dumps({
+                "id": f"mock-{self.requests}", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": ''.join(tokens).strip()},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            }).encode()
+            self._respond(writer, 200, body)
+            await writer.drain()
+            return True
+
+        self.streams += 1
+        writer.write(b"HTTP/1.1 200 OK\r\ncontent-type: text/event-stream\r\n"
+                     b"transfer-encoding: chunked\r\n\r\n")
+        drop_at = random.randrange(len(tokens)) if random.random() < self.disconnect_rate else None
+        for i, token in enumerate(tokens):
+            if i == drop_at:
+                self.disconnects += 1
+                writer.transport.abort()
+                return False
+            self._event(writer, {
+                "id": f"mock-{self.requests}", "object": "chat.completion.chunk", "created": created,
+                "model": model, "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+            })
+            await writer.drain()
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+        self._event(writer, {
+            "id": f"mock-{self.requests}", "object": "chat.completion.chunk", "created": created,
+            "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        })
+        if (request.get('stream_options') or {}).get('include_usage'):
+            self._event(writer, {
+                "id": f"mock-{self.requests}", "object": "chat.completion.chunk", "created": created,
+                "model": model, "choices": [], "usage": usage,
+            })
+        self._chunk(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return True
+
+    def _event(self, writer, payload):
+        self._chunk(writer, f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode())
+
+    def _chunk(self, writer, data):
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+
+def parse_per_model(pairs, convert=str):
+    """{model: value} from MODEL=VALUE arguments"""
+    result = {}
+    for pair in pairs or ():
+        model, _, value = pair.rpartition('=')
+        result[model] = convert(value)
+    return result
+
+
+async def serve(args):
+    mock = MockOpenRouter(args.latency, args.token_delay, args.reply_tokens,
+                          args.error_rate, args.rate_limit_rate, args.disconnect_rate,
+                          parse_per_model(args.model_latency), parse_per_model(args.model_error_rate, float))
+    port = await mock.start(args.host, args.port)
+    print(f"Mock OpenRouter listening on http://{args.host}:{port}/api/v1")
+    while True:
+        await asyncio.sleep(10)
+        print(f"Mock stats: {mock.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenRouter chat completions server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', default='0.5', help="time to first token distribution")
+    parser.add_argument('--token-delay', type=float, default=0.02, help="seconds between streamed tokens")
+    parser.add_argument('--reply-tokens', type=int, default=60)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="fraction answered with 429")
+    parser.add_argument('--disconnect-rate', type=float, default=0.0, help="fraction of streams cut mid-reply")
+    parser.add_argument('--model-latency', action='append', metavar='MODEL=SPEC',
+                        help="latency distribution of one model (repeatable)")
+    parser.add_argument('--model-error-rate', action='append', metavar='MODEL=RATE',
+                        help="error rate of one model (repeatable)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
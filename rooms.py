@@ -0,0 +1,263 @@
+"""
+Live chat rooms (teleconference) between connected callers
+
+A broadcast is CRLF-translated and encoded once, and the same bytes object
+is appended to every member's bounded outbound queue; each member's session
+drains its own queue into its connection. A member whose queue fills up is
+squelched: its backlog is replaced by a count of skipped lines and nothing
+more is queued until it catches up. A member that stays squelched too long
+is removed from the room, so one slow link never holds the others back.
+
+In multi-process mode (see cluster.py) rooms span the workers: joins,
+leaves and every broadcast line are published on the worker link, and
+lines from other workers are fanned out to the local members here.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+
+from ascii_art import Colors
+from eventlog import log_error
+from session_io import encode_text
+
+# Lines queued per member before it is squelched
+ROOM_QUEUE_LIMIT = int(os.getenv('ROOM_QUEUE_LIMIT', 200))
+
+# Seconds a member may stay squelched before it is removed from the room
+ROOM_SLOW_KICK = float(os.getenv('ROOM_SLOW_KICK', 15))
+
+# Let callers ask the AI in a room with /ai
+ROOM_AI = os.getenv('ROOM_AI', '1') != '0'
+
+DEFAULT_ROOM = 'lobby'
+MAX_ROOM_NAME = 20
+
+
+class Member:
+    """One caller in a room, with its outbound queue"""
+
+    def __init__(self, handle, limit=ROOM_QUEUE_LIMIT):
+        self.handle = handle
+        self.limit = limit
+        self.queue = deque()
+        self.waiter = None     # Future the session sleeps on, resolved on delivery
+        self.squelched_at = None
+        self.skipped = 0
+        self.kicked = False
+        self.joined = time.monotonic()
+
+    def deliver(self, payload):
+        """Queue a line; False if the member was too far behind to take it"""
+        if self.squelched_at is not None:
+            self.skipped += 1
+            return False
+        if len(self.queue) >= self.limit:
+            self.skipped += len(self.queue) + 1
+            self.queue.clear()
+            self.squelched_at = time.monotonic()
+            self._wake()
+            return False
+        self.queue.append(payload)
+        self._wake()
+        return True
+
+    def pending(self):
+        return bool(self.queue) or self.squelched_at is not None or self.kicked
+
+    def take(self):
+        """All queued lines, led by a notice if some had to be skipped"""
+        lines = list(self.queue)
+        self.queue.clear()
+        if self.squelched_at is not None:
+            notice = f"{Colors.BRIGHT_BLACK}*** {self.skipped} lines skipped: your connection is falling behind ***{Colors.RESET}\n"
+            lines.insert(0, encode_text(notice))
+            self.squelched_at = None
+            self.skipped = 0
+        return lines
+
+    def _wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result('room')
+
+
+class Room:
+    """Members of one room and the broadcast fan-out"""
+
+    def __init__(self, name, link=None):
+        self.name = name
+        self.members = []
+        self.remote = {}    # worker id -> handles in this room on that worker
+        self.link = link
+        self.ai_session = None
+        self._ai_task = None
+
+        # Counters, read by the benchmark
+        self.deliveries = 0
+        self.skipped = 0
+        self.kicked = 0
+
+    def join(self, handle):
+        member = Member(handle)
+        self.broadcast(f"{Colors.BRIGHT_BLACK}*** {handle} has joined {self.name} ***{Colors.RESET}\n")
+        self.members.append(member)
+        self._publish('join', handle=handle)
+        return member
+
+    def leave(self, member):
+        if member in self.members:
+            self.members.remove(member)
+            self._publish('leave', handle=member.handle)
+            if not member.kicked:
+                self.broadcast(f"{Colors.BRIGHT_BLACK}*** {member.handle} has left ***{Colors.RESET}\n")
+
+    def handles(self):
+        """Everyone in the room, on this worker and the others"""
+        handles = [m.handle for m in self.members]
+        for remote in self.remote.values():
+            handles.extend(remote)
+        return handles
+
+    def count(self):
+        return len(self.members) + sum(len(remote) for remote in self.remote.values())
+
+    def say(self, member, text):
+        stamp = time.strftime('%H:%M')
+        self.broadcast(f"{Colors.BRIGHT_BLACK}[{stamp}]{Colors.RESET} {Colors.BRIGHT_CYAN}{member.handle}:{Colors.RESET} {text}\n",
+                       exclude=member)
+
+    def emote(self, member, text):
+        self.broadcast(f"{Colors.BRIGHT_MAGENTA}* {member.handle} {text}{Colors.RESET}\n", exclude=member)
+
+    def broadcast(self, text, exclude=None, publish=True):
+        """Send a line to every member; it is encoded once for all of them"""
+        if publish:
+            self._publish('say', text=text)
+        payload = encode_text(text)
+        now = time.monotonic()
+        slow = None
+        for member in self.members:
+            if member is exclude:
+                continue
+            if member.deliver(payload):
+                self.deliveries += 1
+            else:
+                self.skipped += 1
+                if now - member.squelched_at > ROOM_SLOW_KICK:
+                    slow = slow or []
+                    slow.append(member)
+        if slow:
+            self._kick(slow)
+
+    def _kick(self, slow):
+        # Remove them all before the notices go out, so those cannot kick anyone again
+        for member in slow:
+            member.kicked = True
+            member._wake()
+            self.members.remove(member)
+            self._publish('leave', handle=member.handle)
+            self.kicked += 1
+        for member in slow:
+            self.broadcast(f"{Colors.BRIGHT_BLACK}*** {member.handle} was disconnected from {self.name} "
+                           f"(connection too slow) ***{Colors.RESET}\n")
+
+    def _publish(self, op, **fields):
+        if self.link is not None:
+            self.link.publish(op, room=self.name, **fields)
+
+    def ask_ai(self, handle, question):
+        """Have the AI answer in the room; False if it is still on the last question"""
+        if self._ai_task is not None and not self._ai_task.done():
+            return False
+        self._ai_task = asyncio.get_running_loop().create_task(self._answer(handle, question))
+        return True
+
+    async def _answer(self, handle, question):
+        from ai_client import get_client
+        try:
+            if self.ai_session is None:
+                self.ai_session = get_client().new_session(f"room:{self.name}")
+            reply = await self.ai_session.chat(f"{handle} asks: {question}")
+        except Exception as e:
+            log_error('room_ai', e, room=self.name)
+            reply = "Sorry, I can't answer right now."
+        self.broadcast(f"{Colors.BRIGHT_MAGENTA}AI>{Colors.RESET} {reply}\n")
+
+    def stats(self):
+        return {
+            'members': len(self.members),
+            'remote_members': self.count() - len(self.members),
+            'deliveries': self.deliveries,
+            'skipped': self.skipped,
+            'kicked': self.kicked,
+        }
+
+
+class Rooms:
+    """All rooms of this process; empty rooms are forgotten"""
+
+    def __init__(self):
+        self.rooms = {}
+        self.link = None
+
+    def attach(self, link):
+        """Share rooms with the other workers over ``link``"""
+        self.link = link
+        for room in self.rooms.values():
+            room.link = link
+        link.on('join', self._remote_join)
+        link.on('leave', self._remote_leave)
+        link.on('say', self._remote_say)
+        link.on('gone', self._remote_gone)
+
+    def room(self, name):
+        name = name.strip().lower()[:MAX_ROOM_NAME] or DEFAULT_ROOM
+        room = self.rooms.get(name)
+        if room is None:
+            room = self.rooms[name] = Room(name, self.link)
+        return room
+
+    def leave(self, room, member):
+        room.leave(member)
+        self._forget_if_empty(room)
+
+    def listing(self):
+        """(name, member count) of every room, busiest first"""
+        self.room(DEFAULT_ROOM)
+        return sorted(((r.name, r.count()) for r in self.rooms.values()), key=lambda r: -r[1])
+
+    def _forget_if_empty(self, room):
+        if not room.members and not room.remote and room.name != DEFAULT_ROOM:
+            self.rooms.pop(room.name, None)
+
+    def _remote_join(self, message):
+        self.room(message['room']).remote.setdefault(message['worker'], []).append(message['handle'])
+
+    def _remote_leave(self, message):
+        room = self.rooms.get(message['room'])
+        handles = room.remote.get(message['worker']) if room is not None else None
+        if handles and message['handle'] in handles:
+            handles.remove(message['handle'])
+            if not handles:
+                del room.remote[message['worker']]
+            self._forget_if_empty(room)
+
+    def _remote_say(self, message):
+        room = self.rooms.get(message['room'])
+        if room is not None and room.members:
+            room.broadcast(message['text'], publish=False)
+
+    def _remote_gone(self, message):
+        for room in list(self.rooms.values()):
+            if room.remote.pop(message['worker'], None) is not None:
+                self._forget_if_empty(room)
+
+
+_rooms = None
+
+
+def get_rooms():
+    global _rooms
+    if _rooms is None:
+        _rooms = Rooms()
+    return _rooms
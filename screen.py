@@ -0,0 +1,135 @@
+"""
+Screen composition: pre-encoded static screens and diff redraws
+
+Static art is CRLF-translated and UTF-8 encoded once at import. Each session
+keeps a ``VirtualScreen`` that remembers the last composed page and how far
+the cursor has moved below it, so redrawing the same page (the main menu
+after every choice) only rewrites the lines that changed, such as the clock.
+"""
+import re
+import unicodedata
+
+from ascii_art import LOGO, MAIN_MENU, clear_screen
+from session_io import encode_text
+
+# Widest line we trust not to wrap, and the furthest we move the cursor up,
+# for a standard 80x24 terminal
+SCREEN_COLUMNS = 79
+SCREEN_ROWS = 22
+
+_CSI = re.compile(r'\033\[[0-9;?]*([@-~])')
+
+
+def display_width(text):
+    """Terminal columns taken by ``text`` (no control characters)"""
+    width = 0
+    for char in text:
+        if unicodedata.combining(char):
+            continue
+        width += 2 if unicodedata.east_asian_width(char) in 'WF' else 1
+    return width
+
+
+class StaticScreen:
+    """A fixed block of screen text, encoded once"""
+
+    def __init__(self, text):
+        self.text = text
+        self.data = encode_text(text)
+
+
+# Screens drawn on every visit, shared by all sessions
+WELCOME_SCREEN = StaticScreen(clear_screen() + LOGO)
+MAIN_MENU_SCREEN = StaticScreen(clear_screen() + LOGO + MAIN_MENU)
+
+
+class VirtualScreen:
+    """The caller's terminal as far as this session knows it
+
+    ``track`` must see all text sent outside ``draw``; anything the model
+    cannot follow (cursor addressing, a line that may wrap, raw bytes) makes
+    the next ``draw`` a full redraw. Positions are relative to the cursor,
+    so a page taller than the terminal still redraws correctly; it just
+    stays scrolled where the erased lines below it left it.
+    """
+
+    def __init__(self):
+        self.static = None   # StaticScreen at the top of the page on screen
+        self.lines = []      # Dynamic lines drawn below it
+        self.below = 0       # Rows the cursor moved down since the page ended
+        self.column = 0
+        self.valid = False
+
+        # Counters
+        self.full_draws = 0
+        self.diff_draws = 0
+
+    def invalidate(self):
+        self.valid = False
+
+    def track(self, message):
+        """Follow cursor movement for output sent after the page"""
+        if not self.valid:
+            return
+        if not isinstance(message, str):
+            self.valid = False
+            return
+        for final in _CSI.findall(message):
+            if final not in 'mK':
+                self.valid = False
+                return
+        message = _CSI.sub('', message)
+        for segment in re.split(r'([\r\n\x08])', message):
+            if segment == '\n':
+                self.below += 1
+                self.column = 0
+            elif segment == '\r':
+                self.column = 0
+            elif segment == '\x08':
+                self.column = max(0, self.column - 1)
+            elif segment:
+                self.column += display_width(segment)
+                if self.column > SCREEN_COLUMNS:
+                    self.valid = False
+                    return
+
+    def draw(self, static, dynamic):
+        """Output that brings the screen to ``static`` followed by ``dynamic``
+
+        ``dynamic`` is text ending in a newline. Returns bytes for a full
+        redraw, or a short str of cursor moves and changed lines when the
+        same page is still on screen. The cursor ends on the line after the
+        page either way, with everything below it erased.
+        """
+        lines = dynamic.split('\n')[:-1]
+        if self.valid and static is self.static and len(lines) == len(self.lines):
+            changed = [i for i, (old, new) in enumerate(zip(self.lines, lines)) if old != new]
+            up = self.below + len(lines) - (changed[0] if changed else len(lines))
+            if up <= SCREEN_ROWS and all(display_width(_CSI.sub('', lines[i])) <= SCREEN_COLUMNS
+                                         for i in changed):
+                out = ["\r"]
+                if up:
+                    out.append(f"\033[{up}A")
+                row = changed[0] if changed else len(lines)
+                for i in changed:
+                    if i > row:
+                        out.append(f"\033[{i - row}B")
+                    out.append(f"\r{lines[i]}\033[K")
+                    row = i
+                if changed:
+                    out.append(f"\r\033[{len(lines) - row}B")
+                out.append("\033[J")
+                self._drawn(static, lines)
+                self.diff_draws += 1
+                return ''.join(out)
+
+        self._drawn(static, lines)
+        self.full_draws += 1
+        return static.data + encode_text(dynamic)
+
+    def _drawn(self, static, lines):
+        self.static = static
+        self.lines = lines
+        self.below = 0
+        self.column = 0
+        self.valid = True
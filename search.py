@@ -0,0 +1,177 @@
+"""
+Full-text search over board posts and AI chat transcripts
+
+The index is an SQLite FTS5 table in its own file (data/search.db) with the
+unicode61 tokenizer, which case-folds Cyrillic and other scripts. A
+background task copies new posts and chat exchanges from the board database
+in batches, tracking the last indexed id of each, so posting never waits
+for indexing and a restart picks up where it left off. Chats are only
+searchable with BBS_SAVE_CHATS on (see conversations.py).
+"""
+import asyncio
+import os
+import re
+
+from conversations import SAVE_CHATS
+from eventlog import log_error
+from storage import Database, PAGE_SIZE, get_store
+
+SEARCH_DB_PATH = os.getenv('BBS_SEARCH_PATH', 'data/search.db')
+
+# Seconds between index catch-ups when nobody pokes the indexer
+SEARCH_INDEX_INTERVAL = float(os.getenv('BBS_SEARCH_INDEX_INTERVAL', 2))
+
+INDEX_BATCH = 1000
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+    kind UNINDEXED, ref UNINDEXED, author UNINDEXED, board UNINDEXED, created UNINDEXED, subject UNINDEXED,
+    title, body,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE TABLE IF NOT EXISTS search_meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+_WORD = re.compile(r'\w+')
+
+
+def match_query(text):
+    """Turn what a caller typed into an FTS5 query: every word, as a prefix
+
+    Prefix matching lets "модем" find "модема" and "модемы" without a
+    stemmer. Returns None when there is nothing to search for.
+    """
+    words = _WORD.findall(text.lower())
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words[:8])
+
+
+class SearchIndex(Database):
+    """FTS5 index of posts and chat logs with ranked, paginated queries
+
+    ``kind`` is 'post' (``ref`` is the thread id) or 'chat' (``ref`` is the
+    chat log id). Only the opening post of a thread has the subject in its
+    indexed ``title``, so replies do not all match on it. Chat transcripts
+    only show up in searches by their own handle, and never for the shared
+    Guest handle, which belongs to every anonymous caller. Without ``chats``
+    they do not show up at all, even if some were indexed earlier.
+    """
+    SCHEMA = SCHEMA
+    NAME = 'search'
+
+    def __init__(self, path=SEARCH_DB_PATH, readers=2, store=None, chats=SAVE_CHATS):
+        super().__init__(path, readers)
+        self.store = store
+        self.chats = chats
+        self._wake = None
+        self._task = None
+
+    def start(self):
+        """Run the background indexer on the current loop"""
+        self._wake = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._indexer())
+
+    def stop(self):
+        """Stop the background indexer (a worker replaced by a reload leaves it to the new one)"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self._wake = None
+
+    def notify(self):
+        """New content was written; index it soon"""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _indexer(self):
+        while True:
+            try:
+                while await self.catch_up():
+                    pass
+            except Exception as e:
+                log_error('search_indexer', e)
+            try:
+                await asyncio.wait_for(self._wake.wait(), SEARCH_INDEX_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def catch_up(self):
+        """Index one batch of new posts and chats; returns how many"""
+        store = self.store or get_store()
+        marks = await self._read(self._marks)
+        posts = await store.posts_since(marks.get('post', 0), INDEX_BATCH)
+        chats = await store.chats_since(marks.get('chat', 0), INDEX_BATCH)
+        if not posts and not chats:
+            return 0
+        await self._write(self._index, posts, chats)
+        return len(posts) + len(chats)
+
+    def _marks(self):
+        return dict(self._local.db.execute("SELECT name, value FROM search_meta").fetchall())
+
+    def _index(self, posts, chats):
+        db = self._local.db
+        with db:
+            # During a reload the old and the new worker index for a moment; skip what the other just did
+            db.execute("BEGIN IMMEDIATE")
+            marks = self._marks()
+            posts = [p for p in posts if p['id'] > marks.get('post', 0)]
+            chats = [c for c in chats if c['id'] > marks.get('chat', 0)]
+            db.executemany("INSERT INTO search_index (kind, ref, author, board, created, subject, title, body) "
+                           "VALUES ('post', ?, ?, ?, ?, ?, ?, ?)",
+                           [(p['thread_id'], p['author'], p['board'], p['created'], p['subject'],
+                             p['subject'] if p['opening'] else '', p['body']) for p in posts])
+            db.executemany("INSERT INTO search_index (kind, ref, author, board, created, subject, title, body) "
+                           "VALUES ('chat', ?, ?, '', ?, ?, ?, ?)",
+                           [(c['id'], c['handle'], c['created'], c['question'], c['question'], c['answer'])
+                            for c in chats])
+            if posts:
+                db.execute("INSERT OR REPLACE INTO search_meta VALUES ('post', ?)", (posts[-1]['id'],))
+            if chats:
+                db.execute("INSERT OR REPLACE INTO search_meta VALUES ('chat', ?)", (chats[-1]['id'],))
+
+    async def search(self, text, handle, after=None, limit=PAGE_SIZE, highlight=('[', ']')):
+        """Best matches first as ``(rows, cursor)``; pass the cursor as ``after``"""
+        query = match_query(text)
+        if query is None:
+            return [], None
+        return await self._read(self._search, query, handle, after, limit, highlight)
+
+    def _search(self, query, handle, after, limit, highlight):
+        # bm25 weights: title matches count three times as much as body ones
+        sql = ("SELECT * FROM (SELECT rowid, kind, ref, author, board, created, subject, "
+               "snippet(search_index, 7, ?, ?, '…', 10) AS snippet, "
+               "bm25(search_index, 0, 0, 0, 0, 0, 0, 3.0, 1.0) AS score "
+               "FROM search_index WHERE search_index MATCH ? ")
+        params = [highlight[0], highlight[1], query]
+        if self.chats:
+            sql += "AND (kind = 'post' OR (author = ? AND author != 'Guest'))) "
+            params.append(handle)
+        else:
+            sql += "AND kind = 'post') "
+        if after is not None:
+            sql += "WHERE (score, rowid) > (?, ?) "
+            params += [after[0], after[1]]
+        sql += "ORDER BY score, rowid LIMIT ?"
+        params.append(limit + 1)
+        rows = self._local.db.execute(sql, params).fetchall()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return rows, (rows[-1]['score'], rows[-1]['rowid'])
+        return rows, None
+
+
+_search = None
+
+
+def get_search():
+    """The process-wide search index, opened on first use"""
+    global _search
+    if _search is None:
+        _search = SearchIndex()
+    return _search
@@ -0,0 +1,357 @@
+"""
+Session I/O layer - chunked input decoding and buffered output for telnet
+and SSH callers
+"""
+import codecs
+import os
+import time
+import zlib
+
+# Bytes read from the transport per call
+READ_CHUNK = 4096
+
+# Animation frames closer together than this are coalesced into one write
+# (0 writes every frame as soon as it is drawn)
+OUTPUT_BATCH_DELAY = int(os.getenv('BBS_OUTPUT_BATCH_MS', 25)) / 1000
+
+# Pending output size that forces a flush regardless of flush points
+OUTPUT_HIGH_WATER = 64 * 1024
+
+# Decoded type-ahead held per session before we stop reading from the caller
+TYPEAHEAD_LIMIT = 64 * 1024
+
+# Offer MCCP2 stream compression to telnet callers, and the zlib level used
+TELNET_COMPRESS = os.getenv('BBS_MCCP', '0') != '0'
+TELNET_COMPRESS_LEVEL = int(os.getenv('BBS_MCCP_LEVEL', 6))
+
+# Telnet command bytes (RFC 854)
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+SE = 240
+
+# Telnet options
+COMPRESS2 = 86  # MCCP2: everything the server sends after IAC SB 86 IAC SE is a zlib stream
+
+# Longest subnegotiation payload we keep; anything past it is dropped
+MAX_SUBNEGOTIATION = 1024
+
+_IAC_BYTE = bytes([IAC])
+
+# Parser states
+_DATA, _IAC, _OPTION, _SB, _SB_IAC = range(5)
+
+
+class TelnetParser:
+    """Incremental telnet IAC parser
+
+    Strips commands and option negotiation out of the inbound stream and
+    returns the remaining data bytes. Parsing state survives across chunks, so
+    a command split over two reads is still recognised. Commands are reported
+    to ``on_command(command, option)``: ``option`` is the option byte for
+    WILL/WONT/DO/DONT, the payload bytes for SB, and None otherwise.
+    """
+
+    def __init__(self, on_command=None):
+        self.on_command = on_command
+        self._state = _DATA
+        self._verb = None
+        self._sb = bytearray()
+
+    def feed(self, data):
+        """Parse a chunk and return the data bytes it carried"""
+        out = bytearray()
+        i = 0
+        n = len(data)
+        while i < n:
+            state = self._state
+            if state == _DATA:
+                # Fast path: copy everything up to the next IAC in one go
+                j = data.find(_IAC_BYTE, i)
+                if j < 0:
+                    out += data[i:]
+                    break
+                out += data[i:j]
+                i = j + 1
+                self._state = _IAC
+                continue
+
+            b = data[i]
+            i += 1
+            if state == _IAC:
+                if b == IAC:
+                    out.append(IAC)  # escaped 0xFF data byte
+                    self._state = _DATA
+                elif b in (WILL, WONT, DO, DONT):
+                    self._verb = b
+                    self._state = _OPTION
+                elif b == SB:
+                    self._sb = bytearray()
+                    self._state = _SB
+                else:
+                    self._command(b, None)
+                    self._state = _DATA
+            elif state == _OPTION:
+                self._command(self._verb, b)
+                self._state = _DATA
+            elif state == _SB:
+                if b == IAC:
+                    self._state = _SB_IAC
+                elif len(self._sb) < MAX_SUBNEGOTIATION:
+                    self._sb.append(b)
+            else:  # _SB_IAC
+                if b == SE:
+                    self._command(SB, bytes(self._sb))
+                    self._state = _DATA
+                else:
+                    if b == IAC and len(self._sb) < MAX_SUBNEGOTIATION:
+                        self._sb.append(IAC)
+                    self._state = _SB
+        return bytes(out)
+
+    def _command(self, command, option):
+        if self.on_command is not None:
+            self.on_command(command, option)
+
+
+class InputDecoder:
+    """Turns raw transport chunks into text, keeping leftovers between reads
+
+    Telnet framing is stripped first (skipped for SSH), then bytes go through
+    an incremental UTF-8 decoder so a multibyte character split across reads
+    is held back instead of retried from scratch. Invalid bytes are dropped.
+    CR LF and CR NUL from the client are folded to a single CR so one Enter
+    never produces an extra empty line. Decoded text that a line read has not
+    consumed yet (type-ahead, the rest of a paste) stays buffered here.
+    """
+
+    def __init__(self, telnet=True, on_command=None):
+        self.telnet = TelnetParser(on_command) if telnet else None
+        self._utf8 = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        self._text = ''
+        self._after_cr = False
+
+    def feed(self, data):
+        """Add a chunk of raw bytes from the transport"""
+        if self.telnet is not None:
+            data = self.telnet.feed(data)
+        text = self._utf8.decode(data)
+        if not text:
+            return
+        if self._after_cr and text[0] in '\n\0':
+            text = text[1:]
+        if '\r' in text:
+            text = text.replace('\r\n', '\r').replace('\r\0', '\r')
+        if text:
+            self._after_cr = text[-1] == '\r'
+            self._text += text
+
+    def has_input(self):
+        """True if decoded text is waiting to be read"""
+        return bool(self._text)
+
+    def buffered(self):
+        """Number of decoded characters waiting to be read"""
+        return len(self._text)
+
+    def read(self):
+        """Return and clear all buffered text"""
+        text, self._text = self._text, ''
+        return text
+
+    def unread(self, text):
+        """Put unconsumed text back in front of the buffer"""
+        if text:
+            self._text = text + self._text
+
+
+def edit_line(decoder, line, limit=None):
+    """Apply buffered input to ``line`` (a list of characters)
+
+    Handles Enter and Backspace and ignores other control characters. Returns
+    ``(finished, echo)``: whether Enter was seen, and the text to echo back to
+    the caller for everything consumed. Input after Enter stays in the decoder.
+    Once ``line`` holds ``limit`` characters, further ones are dropped.
+    """
+    text = decoder.read()
+    echo = []
+    for i, char in enumerate(text):
+        # Handle Enter (CR or LF)
+        if char == '\r' or char == '\n':
+            decoder.unread(text[i + 1:])
+            echo.append('\r\n')
+            return True, ''.join(echo)
+
+        # Handle Backspace (ASCII 127 or 8)
+        if char == '\x7f' or char == '\x08':
+            if line:
+                line.pop()
+                echo.append('\x08 \x08')  # Erase character on screen
+            continue
+
+        # Handle regular characters
+        if char.isprintable() and (limit is None or len(line) < limit):
+            line.append(char)
+            echo.append(char)
+    return False, ''.join(echo)
+
+
+def encode_text(text):
+    """CRLF-translate and UTF-8 encode text for the wire
+
+    Proper CRLF line endings avoid the "staircase effect" where ASCII art
+    falls apart on both telnet clients and SSH PTYs.
+    """
+    text = text.replace('\r\n', '\n').replace('\n', '\r\n')
+    return text.encode('utf-8', errors='replace')
+
+
+class StreamCompressor:
+    """One session's MCCP2 zlib stream
+
+    Each flush point is compressed with Z_SYNC_FLUSH, so the client can
+    inflate and show it right away while the dictionary carries over to
+    the next screen; repeated escape sequences and box drawing cost a few
+    bytes after their first appearance.
+    """
+    START = bytes([IAC, SB, COMPRESS2, IAC, SE])
+
+    def __init__(self, level=TELNET_COMPRESS_LEVEL):
+        self._zlib = zlib.compressobj(level)
+
+        # Counters: bytes before and after compression, seconds spent compressing
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu = 0.0
+
+    def compress(self, data):
+        start = time.perf_counter()
+        out = self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+        self.cpu += time.perf_counter() - start
+        self.bytes_in += len(data)
+        self.bytes_out += len(out)
+        return out
+
+    def finish(self):
+        """End of the compressed stream; the client reads plain data after it"""
+        out = self._zlib.flush(zlib.Z_FINISH)
+        self.bytes_out += len(out)
+        return out
+
+    def stats(self):
+        return {
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'ratio': self.bytes_in / self.bytes_out if self.bytes_out else 0.0,
+            'cpu': self.cpu,
+        }
+
+
+def _encode_parts(parts):
+    """Join queued str and bytes messages into one encoded payload"""
+    out = bytearray()
+    text = []
+    for part in parts:
+        if isinstance(part, str):
+            text.append(part)
+            continue
+        if text:
+            out += encode_text(''.join(text))
+            text = []
+        out += part
+    if text:
+        out += encode_text(''.join(text))
+    return out
+
+
+class OutputBuffer:
+    """Per-session output buffer with explicit flush points
+
+    ``write`` only queues text (or raw bytes such as telnet commands). The
+    session decides when to flush: at the end of a screen, before blocking on
+    input, or on an animation frame. Everything queued since the previous
+    flush is joined, CRLF-translated and encoded once by ``take``.
+
+    Frame flushes are Nagle-style: a frame drawn less than ``batch_delay``
+    seconds after the previous write stays buffered and rides along with a
+    later one. Forced flushes always go out.
+
+    Once ``start_compression`` is called, output queued after the MCCP2
+    start sequence is compressed, one sync-flushed block per ``take``.
+    """
+
+    def __init__(self, batch_delay=OUTPUT_BATCH_DELAY, high_water=OUTPUT_HIGH_WATER, clock=time.monotonic):
+        self.batch_delay = batch_delay
+        self.high_water = high_water
+        self.clock = clock
+        self._parts = []
+        self._size = 0
+        self._plain = 0           # Leading parts that go out uncompressed
+        self.compressor = None    # Active StreamCompressor
+        self.compression = None   # Last StreamCompressor, kept for its counters
+        self.last_flush = 0.0
+
+        # Counters: send() calls, transport writes, bytes written
+        self.messages = 0
+        self.flushes = 0
+        self.bytes_out = 0
+
+    def write(self, message):
+        """Queue a str or bytes message; returns True once past the high-water mark"""
+        self._parts.append(message)
+        self._size += len(message)
+        self.messages += 1
+        return self._size >= self.high_water
+
+    def pending(self):
+        """True if anything is waiting to be flushed"""
+        return bool(self._parts)
+
+    def frame_delay(self):
+        """Seconds an animation frame flush should wait (0 means write now)"""
+        return max(0.0, self.batch_delay - (self.clock() - self.last_flush))
+
+    def start_compression(self, compressor):
+        """Queue the MCCP2 start sequence; everything queued after it is compressed"""
+        self.write(compressor.START)
+        self._plain = len(self._parts)
+        self.compressor = self.compression = compressor
+
+    def end_compression(self):
+        """Close the compressed stream: returns its final bytes (call after ``take``)"""
+        compressor, self.compressor = self.compressor, None
+        return compressor.finish() if compressor is not None else b''
+
+    def take(self):
+        """Return all queued output as one encoded payload and reset the buffer"""
+        if self.compressor is None:
+            out = _encode_parts(self._parts)
+            self.bytes_out += len(out)
+        else:
+            out = _encode_parts(self._parts[:self._plain])
+            rest = _encode_parts(self._parts[self._plain:])
+            self.bytes_out += len(out) + len(rest)
+            if rest:
+                out += self.compressor.compress(bytes(rest))
+
+        self._parts = []
+        self._size = 0
+        self._plain = 0
+        self.last_flush = self.clock()
+        self.flushes += 1
+        return bytes(out)
+
+    def stats(self):
+        """Counters for this session's output (``bytes`` before compression)"""
+        stats = {
+            'messages': self.messages,
+            'writes': self.flushes,
+            'bytes': self.bytes_out,
+            'bytes_per_write': self.bytes_out / self.flushes if self.flushes else 0.0,
+        }
+        if self.compression is not None:
+            stats['compression'] = self.compression.stats()
+        return stats
@@ -0,0 +1,155 @@
+"""
+The paramiko side of the SSH server: host keys, algorithm preferences and
+the blocking handshake
+
+paramiko pulls in cryptography and takes a good part of a second to
+import, so bbs_server.py loads this module on a worker thread once the
+telnet listener is up, rather than at startup.
+"""
+import os
+import time
+
+import paramiko
+
+# Host key types served, in order: ed25519, rsa
+SSH_HOST_KEYS = os.getenv('SSH_HOST_KEYS', 'ed25519,rsa')
+
+# Algorithms offered, best first. The client picks the first of its own list we
+# offer, so leaving an algorithm out is what keeps it from being used.
+SSH_CIPHERS = os.getenv('SSH_CIPHERS', 'aes128-gcm@openssh.com,aes256-gcm@openssh.com,aes128-ctr,aes256-ctr')
+SSH_KEX = os.getenv('SSH_KEX', 'curve25519-sha256@libssh.org,ecdh-sha2-nistp256,diffie-hellman-group14-sha256')
+
+# Offer zlib compression of the SSH stream
+SSH_COMPRESSION = os.getenv('SSH_COMPRESSION', '0') != '0'
+
+
+class BBS_SSHInterface(paramiko.ServerInterface):
+    """Handle SSH authentication and channel requests"""
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_none(self, username):
+        return paramiko.AUTH_SUCCESSFUL
+    
+    def get_allowed_auths(self, username):
+        return 'none,password'
+    
+    def check_channel_shell_request(self, channel):
+        return True
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+
+def ssh_algorithms(wanted, supported):
+    """The names in comma-separated ``wanted`` that paramiko supports, in order"""
+    names = [name.strip() for name in wanted.split(',')]
+    names = tuple(name for name in names if name in supported)
+    if not names:
+        print(f"None of {wanted!r} is supported, using paramiko's defaults")
+        return tuple(supported)
+    return names
+
+
+SSH_CIPHER_ORDER = ssh_algorithms(SSH_CIPHERS, paramiko.Transport._preferred_ciphers)
+SSH_KEX_ORDER = ssh_algorithms(SSH_KEX, paramiko.Transport._preferred_kex)
+
+
+def ssh_handshake(transport, host_keys, deadline):
+    """Run the blocking part of an SSH login and return the session channel
+
+    Every step waits at most until ``deadline`` (time.monotonic()), so a
+    client that stalls gives its worker back instead of holding it for
+    paramiko's default 15 + 30 + 20 seconds.
+    """
+    for host_key in host_keys:
+        transport.add_server_key(host_key)
+    options = transport.get_security_options()
+    options.ciphers = SSH_CIPHER_ORDER
+    options.kex = SSH_KEX_ORDER
+    transport.use_compression(SSH_COMPRESSION)
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        return None
+    transport.banner_timeout = transport.handshake_timeout = transport.auth_timeout = remaining
+    server = BBS_SSHInterface()
+    try:
+        transport.start_server(server=server)
+    except (paramiko.SSHException, EOFError, OSError):
+        return None
+
+    # Wait for a channel
+    return transport.accept(max(0.0, deadline - time.monotonic()))
+
+
+def publish_key_file(tmp, host_key_path):
+    """Move a freshly written key into place unless another worker got there first"""
+    try:
+        os.link(tmp, host_key_path)
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(tmp)
+
+
+def load_host_key(host_key_path):
+    """Load the SSH host key, generating one on first start"""
+    # Ensure data directory exists
+    os.makedirs(os.path.dirname(host_key_path), exist_ok=True)
+    
+    if not os.path.exists(host_key_path):
+        print(f"Generating SSH host key at {host_key_path}...")
+        key = paramiko.RSAKey.generate(2048)
+        tmp = f"{host_key_path}.{os.getpid()}"
+        key.write_private_key_file(tmp)
+        publish_key_file(tmp, host_key_path)
+    
+    return paramiko.RSAKey(filename=host_key_path)
+
+
+def load_ed25519_host_key(host_key_path):
+    """Load the Ed25519 SSH host key, generating one on first start
+
+    Signing with it is much cheaper than with RSA, and every handshake signs once.
+    """
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+
+    os.makedirs(os.path.dirname(host_key_path), exist_ok=True)
+
+    if not os.path.exists(host_key_path):
+        # paramiko cannot generate Ed25519 keys, so write one in OpenSSH format
+        print(f"Generating SSH host key at {host_key_path}...")
+        key = ed25519.Ed25519PrivateKey.generate()
+        data = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.OpenSSH,
+                                 serialization.NoEncryption())
+        tmp = f"{host_key_path}.{os.getpid()}"
+        with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+            f.write(data)
+        publish_key_file(tmp, host_key_path)
+
+    return paramiko.Ed25519Key(filename=host_key_path)
+
+
+def load_host_keys(key_dir='data', key_types=SSH_HOST_KEYS):
+    """Load (or create) the host keys listed in ``key_types``"""
+    loaders = {
+        'ed25519': (load_ed25519_host_key, 'ssh_host_ed25519_key'),
+        'rsa': (load_host_key, 'ssh_host_key'),
+    }
+    keys = []
+    for key_type in key_types.split(','):
+        key_type = key_type.strip().lower()
+        if key_type not in loaders:
+            print(f"Unknown SSH host key type: {key_type}")
+            continue
+        loader, filename = loaders[key_type]
+        keys.append(loader(os.path.join(key_dir, filename)))
+    if not keys:
+        keys.append(load_host_key(os.path.join(key_dir, 'ssh_host_key')))
+    return keys
@@ -0,0 +1,282 @@
+"""
+Message board and chat log storage on SQLite
+
+One database file under data/ in WAL mode, so readers never wait for the
+writer. Writes go through a single writer thread; reads run on a small pool
+of threads that each own a read-only connection. Lists are paginated by
+keyset (the last row's sort key) instead of OFFSET, and post/thread counts
+are kept up to date on every write rather than counted.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DB_PATH = os.getenv('BBS_DB_PATH', 'data/bbs.db')
+DB_READERS = int(os.getenv('BBS_DB_READERS', 4))
+
+PAGE_SIZE = 10
+MAX_SUBJECT = 60
+MAX_BODY = 4000
+
+DEFAULT_BOARDS = [
+    ("General Discussion", "Talk about anything!"),
+    ("Tech Talk", "Computers, coding, and more"),
+    ("AI & Future", "Discuss AI and the future"),
+    ("Retro Computing", "Old school tech nostalgia"),
+    ("Off Topic", "Random stuff goes here"),
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS boards (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    description TEXT NOT NULL DEFAULT '',
+    thread_count INTEGER NOT NULL DEFAULT 0,
+    post_count INTEGER NOT NULL DEFAULT 0,
+    last_post REAL
+);
+CREATE TABLE IF NOT EXISTS threads (
+    id INTEGER PRIMARY KEY,
+    board_id INTEGER NOT NULL REFERENCES boards(id),
+    subject TEXT NOT NULL,
+    author TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_post REAL NOT NULL,
+    post_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS posts (
+    id INTEGER PRIMARY KEY,
+    board_id INTEGER NOT NULL REFERENCES boards(id),
+    thread_id INTEGER NOT NULL REFERENCES threads(id),
+    author TEXT NOT NULL,
+    body TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chat_log (
+    id INTEGER PRIMARY KEY,
+    handle TEXT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS posts_board_thread_created ON posts (board_id, thread_id, created, id);
+CREATE INDEX IF NOT EXISTS threads_board_last_post ON threads (board_id, last_post, id);
+"""
+
+
+def connect(path, readonly=False):
+    """Open a connection with the pragmas every board connection uses"""
+    if readonly:
+        db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("PRAGMA busy_timeout=5000")
+    db.execute("PRAGMA cache_size=-16000")  # 16 MB per connection
+    db.row_factory = sqlite3.Row
+    return db
+
+
+class Database:
+    """A SQLite file with one writer thread and a pool of reader threads
+
+    Every thread owns its connection (``self._local.db``). Subclasses set
+    ``SCHEMA`` and run their queries as plain functions through ``_read`` and
+    ``_write``.
+    """
+    SCHEMA = ""
+    NAME = 'db'
+
+    def __init__(self, path, readers):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._local = threading.local()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'{self.NAME}-writer',
+                                          initializer=self._open, initargs=(False,))
+        # Create the schema before any reader opens the file read-only
+        self._writer.submit(self._create).result()
+        self._readers = ThreadPoolExecutor(max_workers=max(1, readers), thread_name_prefix=f'{self.NAME}-reader',
+                                           initializer=self._open, initargs=(True,))
+
+        self.reads = 0    # Queries run, for the benchmark
+
+    def _open(self, readonly):
+        self._local.db = connect(self.path, readonly)
+
+    def _create(self):
+        db = self._local.db
+        db.executescript(self.SCHEMA)
+        db.commit()
+
+    async def _read(self, func, *args):
+        self.reads += 1
+        return await asyncio.get_running_loop().run_in_executor(self._readers, func, *args)
+
+    async def _write(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._writer, func, *args)
+
+    def close(self):
+        self._readers.shutdown()
+        self._writer.shutdown()
+
+
+class BoardStore(Database):
+    """Boards, threads, posts and the AI chat log, with async methods for the sessions
+
+    ``threads`` and ``posts`` return ``(rows, cursor)``; pass the cursor back
+    as ``before``/``after`` for the next page. It is None on the last page.
+    """
+    SCHEMA = SCHEMA
+
+    def __init__(self, path=DB_PATH, readers=DB_READERS):
+        super().__init__(path, readers)
+
+    def _create(self):
+        super()._create()
+        db = self._local.db
+        if db.execute("SELECT 1 FROM boards LIMIT 1").fetchone() is None:
+            db.executemany("INSERT INTO boards (name, description) VALUES (?, ?)", DEFAULT_BOARDS)
+        db.commit()
+
+    # Reads
+
+    async def boards(self):
+        return await self._read(self._boards)
+
+    async def board(self, board_id):
+        return await self._read(self._board, board_id)
+
+    async def thread(self, thread_id):
+        return await self._read(self._thread, thread_id)
+
+    async def threads(self, board_id, before=None, limit=PAGE_SIZE):
+        """Threads of a board, most recent activity first"""
+        return await self._read(self._threads, board_id, before, limit)
+
+    async def posts(self, thread_id, after=None, limit=PAGE_SIZE):
+        """Posts of a thread, oldest first"""
+        return await self._read(self._posts, thread_id, after, limit)
+
+    def _boards(self):
+        return self._local.db.execute("SELECT * FROM boards ORDER BY id").fetchall()
+
+    def _board(self, board_id):
+        return self._local.db.execute("SELECT * FROM boards WHERE id = ?", (board_id,)).fetchone()
+
+    def _thread(self, thread_id):
+        return self._local.db.execute("SELECT * FROM threads WHERE id = ?", (thread_id,)).fetchone()
+
+    def _threads(self, board_id, before, limit):
+        db = self._local.db
+        if before is None:
+            rows = db.execute("SELECT * FROM threads WHERE board_id = ? "
+                              "ORDER BY last_post DESC, id DESC LIMIT ?", (board_id, limit + 1)).fetchall()
+        else:
+            rows = db.execute("SELECT * FROM threads WHERE board_id = ? AND (last_post, id) < (?, ?) "
+                              "ORDER BY last_post DESC, id DESC LIMIT ?",
+                              (board_id, before[0], before[1], limit + 1)).fetchall()
+        return self._page(rows, limit, 'last_post')
+
+    def _posts(self, thread_id, after, limit):
+        db = self._local.db
+        thread = db.execute("SELECT board_id FROM threads WHERE id = ?", (thread_id,)).fetchone()
+        if thread is None:
+            return [], None
+        # board_id leads the index, so look it up rather than scanning by thread
+        if after is None:
+            rows = db.execute("SELECT * FROM posts WHERE board_id = ? AND thread_id = ? "
+                              "ORDER BY created, id LIMIT ?", (thread[0], thread_id, limit + 1)).fetchall()
+        else:
+            rows = db.execute("SELECT * FROM posts WHERE board_id = ? AND thread_id = ? AND (created, id) > (?, ?) "
+                              "ORDER BY created, id LIMIT ?",
+                              (thread[0], thread_id, after[0], after[1], limit + 1)).fetchall()
+        return self._page(rows, limit, 'created')
+
+    @staticmethod
+    def _page(rows, limit, key):
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return rows, (rows[-1][key], rows[-1]['id'])
+        return rows, None
+
+    # Writes
+
+    async def new_thread(self, board_id, author, subject, body):
+        """Start a thread with its first post; returns the thread id"""
+        return await self._write(self._new_thread, board_id, author, subject[:MAX_SUBJECT], body[:MAX_BODY])
+
+    async def reply(self, thread_id, author, body):
+        """Add a post to a thread; returns the post id, or None if the thread is gone"""
+        return await self._write(self._reply, thread_id, author, body[:MAX_BODY])
+
+    def _new_thread(self, board_id, author, subject, body, now=None):
+        db = self._local.db
+        now = now or time.time()
+        with db:
+            thread_id = db.execute("INSERT INTO threads (board_id, subject, author, created, last_post) "
+                                   "VALUES (?, ?, ?, ?, ?)", (board_id, subject, author, now, now)).lastrowid
+            db.execute("UPDATE boards SET thread_count = thread_count + 1 WHERE id = ?", (board_id,))
+            self._insert_post(db, board_id, thread_id, author, body, now)
+        return thread_id
+
+    def _reply(self, thread_id, author, body, now=None):
+        db = self._local.db
+        now = now or time.time()
+        with db:
+            thread = db.execute("SELECT board_id FROM threads WHERE id = ?", (thread_id,)).fetchone()
+            if thread is None:
+                return None
+            return self._insert_post(db, thread[0], thread_id, author, body, now)
+
+    @staticmethod
+    def _insert_post(db, board_id, thread_id, author, body, now):
+        post_id = db.execute("INSERT INTO posts (board_id, thread_id, author, body, created) "
+                             "VALUES (?, ?, ?, ?, ?)", (board_id, thread_id, author, body, now)).lastrowid
+        db.execute("UPDATE threads SET post_count = post_count + 1, last_post = ? WHERE id = ?", (now, thread_id))
+        db.execute("UPDATE boards SET post_count = post_count + 1, last_post = ? WHERE id = ?", (now, board_id))
+        return post_id
+
+    async def log_chat(self, handle, question, answer):
+        """Keep one AI chat exchange for search"""
+        return await self._write(self._log_chat, handle, question, answer)
+
+    def _log_chat(self, handle, question, answer):
+        db = self._local.db
+        with db:
+            return db.execute("INSERT INTO chat_log (handle, question, answer, created) VALUES (?, ?, ?, ?)",
+                              (handle, question, answer, time.time())).lastrowid
+
+    # Change feed for the search indexer
+
+    async def posts_since(self, post_id, limit):
+        """Posts with an id above ``post_id``, with their board and thread"""
+        return await self._read(self._posts_since, post_id, limit)
+
+    async def chats_since(self, chat_id, limit):
+        return await self._read(self._chats_since, chat_id, limit)
+
+    def _posts_since(self, post_id, limit):
+        return self._local.db.execute(
+            "SELECT posts.id, posts.thread_id, posts.author, posts.body, posts.created, "
+            "threads.subject, posts.created = threads.created AS opening, boards.name AS board FROM posts "
+            "JOIN threads ON threads.id = posts.thread_id JOIN boards ON boards.id = posts.board_id "
+            "WHERE posts.id > ? ORDER BY posts.id LIMIT ?", (post_id, limit)).fetchall()
+
+    def _chats_since(self, chat_id, limit):
+        return self._local.db.execute("SELECT * FROM chat_log WHERE id > ? ORDER BY id LIMIT ?",
+                                      (chat_id, limit)).fetchall()
+
+
+_store = None
+
+
+def get_store():
+    """The process-wide board store, opened on first use"""
+    global _store
+    if _store is None:
+        _store = BoardStore()
+    return _store
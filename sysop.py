@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Sysop tools: an on-demand sampling profiler and per-session tracing
+
+The server listens on a local Unix socket (BBS_ADMIN_SOCKET, mode 0600) for
+one-line commands; this file is also the client:
+
+    python sysop.py sessions           # connected callers and their session ids
+    python sysop.py profile 30         # sample every thread for 30 s
+    python sysop.py trace 12 120       # trace session 12 for two minutes
+    python sysop.py untrace 12
+
+A profile is written to logs/ in collapsed-stack format (one
+``thread;outer;...;inner count`` line per stack, ready for flamegraph.pl or
+speedscope). A trace is a JSON-lines file in logs/ with one span per menu
+screen, receive(), send() and AI request of that session. Sessions that are
+not traced only pay an ``is None`` check at those points.
+
+In multi-process mode each worker has its own socket: the path plus
+``.<worker id>``; pass ``--worker N`` to the client.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+
+from eventlog import LOGS_DIR
+
+# Local admin socket (empty turns it off)
+ADMIN_SOCKET = os.getenv('BBS_ADMIN_SOCKET', 'data/admin.sock')
+
+# Milliseconds between profiler samples
+PROFILE_INTERVAL = float(os.getenv('BBS_PROFILE_INTERVAL_MS', 5)) / 1000
+
+MAX_PROFILE_SECONDS = 300
+MAX_TRACE_SECONDS = 3600
+
+# Innermost functions of a thread that is blocked waiting rather than working
+IDLE_FRAMES = {'select', 'wait', '_worker', 'accept', 'readinto', 'recv', 'read_all'}
+
+_ANSI = re.compile(r'\033\[[0-9;?]*[@-~]')
+
+
+def log_path(kind, suffix):
+    os.makedirs(LOGS_DIR, exist_ok=True)
+    return os.path.join(LOGS_DIR, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}{suffix}")
+
+
+class SamplingProfiler:
+    """Samples the Python stack of every thread from a background thread"""
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.running = False
+
+    def run(self, seconds):
+        """Sample for ``seconds``; returns (collapsed stack counts, samples taken)"""
+        self.running = True
+        own = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        try:
+            while time.monotonic() < deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    codes = []
+                    while frame is not None:
+                        codes.append(frame.f_code)
+                        frame = frame.f_back
+                    stacks[(names.get(ident, str(ident)), tuple(codes))] += 1
+                samples += 1
+                time.sleep(self.interval)
+        finally:
+            self.running = False
+        collapsed = Counter()
+        for (thread, codes), count in stacks.items():
+            frames = [f"{c.co_name} ({os.path.basename(c.co_filename)}:{c.co_firstlineno})" for c in reversed(codes)]
+            collapsed[";".join([thread] + frames)] += count
+        return collapsed, samples
+
+
+def profile_report(collapsed, samples, path, top=15):
+    """Where the samples ended up: the innermost frames seen most often
+
+    Stacks parked in a blocking wait (the event loop in select, pool threads
+    waiting for work) are counted apart so they don't crowd out busy frames;
+    the file keeps them all.
+    """
+    leaves = Counter()
+    idle = 0
+    for stack, count in collapsed.items():
+        leaf = stack.rsplit(";", 1)[-1]
+        if leaf.split(" ", 1)[0] in IDLE_FRAMES:
+            idle += count
+        else:
+            leaves[leaf] += count
+    total = sum(collapsed.values()) or 1
+    lines = [f"{samples} samples, {total} thread stacks -> {path}",
+             f"{idle / total:.1%} waiting ({', '.join(sorted(IDLE_FRAMES))}); busiest innermost frames:"]
+    for frame, count in leaves.most_common(top):
+        lines.append(f"  {count / total:6.1%}  {frame}")
+    return "\n".join(lines)
+
+
+class SessionTrace:
+    """Spans of one session, appended as JSON lines to a file in logs/
+
+    ``begin`` returns a span that ``end`` completes and writes; attributes
+    passed to either end up in the record.
+    """
+
+    def __init__(self, session_id, seconds):
+        self.session_id = session_id
+        self.path = log_path(f"trace-{session_id}", ".jsonl")
+        self.until = time.monotonic() + seconds
+        self.spans = 0
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def begin(self, name, **attrs):
+        attrs['span'] = name
+        attrs['start'] = time.time()
+        attrs['_t'] = time.perf_counter()
+        return attrs
+
+    def end(self, span, **attrs):
+        span['ms'] = round((time.perf_counter() - span.pop('_t')) * 1000, 3)
+        span.update(attrs)
+        self._write(span)
+
+    def event(self, name, **attrs):
+        attrs['span'] = name
+        attrs['start'] = time.time()
+        self._write(attrs)
+
+    @staticmethod
+    def text(text, limit=60):
+        """Printable excerpt of screen text for a span attribute"""
+        if isinstance(text, bytes):
+            return f"<{len(text)} bytes>"
+        return _ANSI.sub('', text).strip()[:limit]
+
+    def expired(self):
+        return self._file.closed or time.monotonic() > self.until
+
+    def _write(self, record):
+        if not self._file.closed:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.spans += 1
+
+    def close(self):
+        self._file.close()
+
+
+class AdminServer:
+    """Answers sysop commands on the admin socket
+
+    ``sessions`` is a callable returning the live BBSHandlers by session id.
+    """
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self.profiler = SamplingProfiler()
+        self._server = None
+
+    async def start(self, path):
+        if os.path.exists(path):
+            os.unlink(path)  # left over from a previous run
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._server = await asyncio.start_unix_server(self._handle, path)
+        os.chmod(path, 0o600)
+        return self._server
+
+    async def _handle(self, reader, writer):
+        try:
+            line = await asyncio.wait_for(reader.readline(), 10)
+            reply = await self.command(line.decode('utf-8', 'replace').split())
+            writer.write(reply.encode('utf-8') + b"\n")
+            await writer.drain()
+        except Exception as e:
+            writer.write(f"Error: {e}\n".encode('utf-8'))
+        finally:
+            writer.close()
+
+    async def command(self, args):
+        if not args or args[0] == 'help':
+            return __doc__.strip().split("\n\n")[1]
+        name, args = args[0], args[1:]
+        if name == 'sessions':
+            return self.list_sessions()
+        if name == 'profile':
+            return await self.profile(float(args[0]) if args else 10)
+        if name == 'trace' and args:
+            return self.trace(int(args[0]), float(args[1]) if len(args) > 1 else 60)
+        if name == 'untrace' and args:
+            return self.untrace(int(args[0]))
+        return f"Unknown command: {' '.join([name] + args)} (try help)"
+
+    def list_sessions(self):
+        sessions = self.sessions()
+        if not sessions:
+            return "No callers connected"
+        lines = [f"{'id':>5}  {'protocol':<8} {'address':<22} {'handle':<20} {'screen':<12} {'minutes':>7}  trace"]
+        for session_id, handler in sorted(sessions.items()):
+            address = handler.client_address[0] if handler.client_address else "?"
+            trace = handler.trace.path if handler.trace is not None else ""
+            lines.append(f"{session_id:>5}  {handler.protocol:<8} {address:<22} {handler.username:<20} "
+                         f"{handler.screen_name:<12} {(time.monotonic() - handler.connected) / 60:7.1f}  {trace}")
+        return "\n".join(lines)
+
+    async def profile(self, seconds):
+        if self.profiler.running:
+            return "A profile is already running"
+        seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def run():
+            try:
+                result = self.profiler.run(seconds)
+                loop.call_soon_threadsafe(done.set_result, result)
+            except Exception as e:
+                loop.call_soon_threadsafe(done.set_exception, e)
+
+        threading.Thread(target=run, name='sysop-profiler', daemon=True).start()
+        collapsed, samples = await done
+        path = log_path("profile", ".collapsed")
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in collapsed.most_common():
+                f.write(f"{stack} {count}\n")
+        return profile_report(collapsed, samples, path)
+
+    def trace(self, session_id, seconds):
+        handler = self.sessions().get(session_id)
+        if handler is None:
+            return f"No session {session_id}"
+        if handler.trace is not None:
+            handler.set_trace(None)
+        trace = SessionTrace(session_id, min(seconds, MAX_TRACE_SECONDS))
+        handler.set_trace(trace)
+        return f"Tracing session {session_id} ({handler.username}) for {seconds:.0f}s -> {trace.path}"
+
+    def untrace(self, session_id):
+        handler = self.sessions().get(session_id)
+        if handler is None or handler.trace is None:
+            return f"Session {session_id} is not traced"
+        trace = handler.trace
+        handler.set_trace(None)
+        return f"Stopped tracing session {session_id}: {trace.spans} spans in {trace.path}"
+
+
+def admin_socket_path(worker=None):
+    from cluster import WORKER_ID, WORKERS
+    if worker is None:
+        worker = WORKER_ID if WORKERS > 1 else None
+    return ADMIN_SOCKET if worker is None else f"{ADMIN_SOCKET}.{worker}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send a command to a running AI BBS server")
+    parser.add_argument('--worker', type=int, help="worker id in multi-process mode")
+    parser.add_argument('command', nargs='+', help="sessions | profile [seconds] | trace <id> [seconds] | untrace <id>")
+    args = parser.parse_args()
+
+    path = admin_socket_path(args.worker)
+    timeout = MAX_PROFILE_SECONDS + 30
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(path)
+    except OSError as e:
+        sys.exit(f"Cannot reach the server at {path}: {e}")
+    with sock:
+        sock.sendall(" ".join(args.command).encode('utf-8') + b"\n")
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    print(b"".join(chunks).decode('utf-8', 'replace'), end="")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Model router: hedging, losers cleaned up, and the circuit breaker
+"""
+import asyncio
+
+from ai_router import ModelRouter
+from metrics import AI_MODEL_REQUESTS
+
+
+def router(**overrides):
+    options = dict(hedge=True, hedge_min=0.01, hedge_max=0.01, hedge_ratio=0.5,
+                   breaker_failures=2, breaker_seconds=30)
+    options.update(overrides)
+    return ModelRouter(["slow", "fast"], **options)
+
+
+def test_hedge_loser_is_closed_before_race_returns():
+    closed = []
+
+    async def request(model):
+        try:
+            await asyncio.sleep(10 if model == "slow" else 0.05)
+            return model
+        finally:
+            closed.append(model)
+
+    async def run():
+        r = router()
+        r.profiles["fast"].latency = 1.0  # Ranked after "slow", which has no figures yet
+        result = await r.race(request)
+        assert closed == ["fast", "slow"]  # Not left for the loop to finish later
+        return result
+
+    assert asyncio.run(run()) == ("fast", "fast", True)
+
+
+def test_whole_completions_are_neither_hedged_nor_timed():
+    async def request(model):
+        await asyncio.sleep(0.05)
+        return model
+
+    answered = AI_MODEL_REQUESTS.labels("slow", "ok").value()
+
+    async def run():
+        r = router()
+        result = await r.race(request, first_token=False)
+        return r, result
+
+    r, result = asyncio.run(run())
+    assert result == ("slow", "slow", False)
+    assert r.hedges == 0
+    assert AI_MODEL_REQUESTS.labels("slow", "ok").value() == answered + 1
+    assert not r.profiles["slow"].first_token
+
+
+class Flaky(Exception):
+    pass
+
+
+def test_breaker_opens_then_one_probe_closes_it(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr('ai_router.time.monotonic', lambda: clock[0])
+    broken = {"slow"}
+    tried = []
+
+    async def request(model):
+        tried.append(model)
+        if model in broken:
+            raise Flaky(model)
+        return model
+
+    async def run():
+        r = router(hedge=False, retryable=(Flaky,))
+        r.profiles["fast"].latency = 1.0  # "slow" is tried first while it is healthy
+        for _ in range(2):
+            assert await r.race(request) == ("fast", "fast", False)  # Failed over at once
+        profile = r.profiles["slow"]
+        assert profile.state == 'open'
+        assert r.ranked() == ["fast"]
+        clock[0] += 31
+        assert profile.state == 'half-open'
+        broken.clear()
+        tried.clear()
+        assert await r.race(request) == ("slow", "slow", False)  # The probe
+        assert tried == ["slow"]
+        assert profile.state == 'closed'
+
+    asyncio.run(run())
+
+
+def test_failed_probe_reopens_for_twice_as_long(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr('ai_router.time.monotonic', lambda: clock[0])
+    profile = router().profiles["slow"]
+    for _ in range(2):
+        profile.failure(2, 30, 240)
+    assert profile.open_until == 1030.0
+    clock[0] += 31
+    profile.probing = True
+    assert profile.state == 'open'  # Only the one probe may try it
+    profile.failure(2, 30, 240)
+    assert profile.open_until == clock[0] + 60
+
+
+def test_hedges_are_capped_at_the_ratio_of_recent_requests():
+    async def request(model):
+        await asyncio.sleep(0.03)  # Past the hedge delay on either model
+        return model
+
+    async def run():
+        r = router(hedge_ratio=0.25)
+        for _ in range(8):
+            await r.race(request)
+        return r.hedges, r.requests
+
+    hedges, requests = asyncio.run(run())
+    assert requests == 8
+    assert hedges == 3  # Every request would hedge; the cap keeps it near a quarter (1st, 4th, 8th)
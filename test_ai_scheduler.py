@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+AI scheduler: round-robin fairness, queue deadlines and place in line
+"""
+import asyncio
+
+import pytest
+
+from ai_client import ChatSession
+from ai_scheduler import AIScheduler, QueueTimeout
+
+
+class Client:
+    context_model = 'mock'
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+
+def test_callers_take_turns_however_much_each_queued():
+    async def run():
+        scheduler = AIScheduler(concurrency=1, deadline=10)
+        await scheduler.wait(scheduler.enqueue("busy"))
+        order = []
+
+        async def request(caller, background=False):
+            ticket = scheduler.enqueue(caller, background)
+            await scheduler.wait(ticket)
+            order.append(caller)
+            scheduler.release()
+
+        tasks = [asyncio.create_task(request(caller)) for caller in ["neo"] * 3 + ["trinity"] * 2]
+        tasks.append(asyncio.create_task(request("summary", background=True)))
+        tasks.append(asyncio.create_task(request(("Guest", 7))))
+        await asyncio.sleep(0)
+        assert scheduler.waiting() == 6
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    # Round-robin among foreground callers; background work only once they are done
+    assert asyncio.run(run()) == ["neo", "trinity", ("Guest", 7), "neo", "trinity", "neo", "summary"]
+
+
+def test_request_past_the_queue_deadline_gives_up_its_place():
+    async def run():
+        scheduler = AIScheduler(concurrency=1, deadline=0.05)
+        await scheduler.wait(scheduler.enqueue("busy"))
+        late = scheduler.enqueue("neo")
+        with pytest.raises(QueueTimeout):
+            await scheduler.wait(late)
+        assert scheduler.waiting() == 0
+        assert scheduler.stats()['timed_out'] == 1
+        scheduler.release()
+        assert scheduler.active == 0  # The slot was not handed to the request that left
+
+    asyncio.run(run())
+
+
+def test_summary_slot_keeps_the_callers_place_in_line():
+    async def run():
+        scheduler = AIScheduler(concurrency=1, deadline=10)
+        await scheduler.wait(scheduler.enqueue("busy"))  # Holds the only slot
+        session = ChatSession(Client(scheduler), handle="neo")
+
+        async def hold(background):
+            async with session._slot(background):
+                pass
+
+        chat = asyncio.create_task(hold(background=False))
+        summary = asyncio.create_task(hold(background=True))
+        await asyncio.sleep(0)
+        assert session.queue_position() == 1
+        summary.cancel()  # The rolling summary gave up while the chat still waits
+        await asyncio.gather(summary, return_exceptions=True)
+        assert session.queue_position() == 1
+        chat.cancel()
+        await asyncio.gather(chat, return_exceptions=True)
+
+    asyncio.run(run())
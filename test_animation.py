@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Animation timing: the shared timer wheel and frames that fall behind
+"""
+import asyncio
+import time
+
+from animation import TimerWheel
+from bbs_server import FRAMES_LATE, BBSHandler
+
+
+def test_frames_fire_on_the_tick_at_or_after_their_deadline():
+    async def run():
+        loop = asyncio.get_running_loop()
+        wheel = TimerWheel(tick=0.01, size=8)
+        start = loop.time()
+        fired = {}
+        futures = []
+        for delay in (0.03, 0.01, 0.2):  # 0.2 s is more than one turn of the wheel
+            future = loop.create_future()
+            future.add_done_callback(lambda f, delay=delay: fired.setdefault(delay, loop.time() - start))
+            wheel.schedule(start + delay, future, value=delay)
+            futures.append(future)
+        assert await asyncio.gather(*futures) == [0.03, 0.01, 0.2]
+        return fired, wheel.stats()
+
+    fired, stats = asyncio.run(run())
+    assert sorted(fired, key=fired.get) == [0.01, 0.03, 0.2]
+    for delay, at in fired.items():
+        assert delay <= at < delay + 0.05
+    assert stats['pending'] == 0 and stats['fired'] == 3
+
+
+def test_a_late_tick_fires_everything_that_fell_due():
+    async def run():
+        loop = asyncio.get_running_loop()
+        wheel = TimerWheel(tick=0.01)
+        futures = [loop.create_future() for _ in range(3)]
+        for i, future in enumerate(futures):
+            wheel.schedule(loop.time() + 0.01 * (i + 1), future)
+        time.sleep(0.1)  # The loop is busy past every deadline
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        return [future.done() for future in futures], wheel.stats()
+
+    done, stats = asyncio.run(run())
+    assert done == [True, True, True]
+    assert stats['ticks'] == 1 and stats['late_ticks'] == 1
+
+
+class Writer:
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_frames_behind_schedule_go_out_with_the_next_one():
+    async def run():
+        writer = Writer()
+        handler = BBSHandler(asyncio.StreamReader(), writer, ('127.0.0.1', 1), is_ssh=True)
+        handler.output.batch_delay = 0
+        frames = [("1", 0.02), ("2", 0.02), ("3", 0.02), ("4", 0.02)]
+        original_send = handler.send
+
+        async def send(text):
+            if text == "2":
+                time.sleep(0.05)  # Drawing frame 2 blocks the loop past its deadline
+            await original_send(text)
+
+        handler.send = send
+        late = FRAMES_LATE.value()
+        await handler.animate(frames)
+        return writer.writes, FRAMES_LATE.value() - late
+
+    writes, dropped = asyncio.run(run())
+    assert b"".join(writes) == b"1234"  # The same bytes, only fewer writes
+    assert dropped >= 1
+    assert len(writes) == 4 - dropped
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Saved conversations: off unless asked for, and opening a big log does not stall the event loop
+"""
+import asyncio
+import time
+
+import conversations
+from conversations import ConversationLog, get_conversations
+
+
+def test_chats_are_not_saved_unless_turned_on(monkeypatch):
+    monkeypatch.setattr(conversations, '_conversations', None)
+    monkeypatch.setattr(conversations, 'SAVE_CHATS', False)
+    assert conversations.CONVERSATIONS_PATH
+    assert get_conversations() is None  # Nobody resumes a chat by typing someone else's handle
+
+
+def test_open_indexes_in_the_background_and_loads_wait_for_it(tmp_path, monkeypatch):
+    path = str(tmp_path / 'conversations.log')
+
+    async def chat():
+        log = ConversationLog(path, flush_interval=0.01)
+        log.record("neo", 'turn', role="user", content="hello")
+        log.record("neo", 'turn', role="assistant", content="hi neo")
+        log.close()
+
+    asyncio.run(chat())
+
+    scan = ConversationLog._scan
+
+    def slow_scan(self):
+        time.sleep(0.5)  # A log of many megabytes
+        scan(self)
+
+    monkeypatch.setattr(ConversationLog, '_scan', slow_scan)
+
+    async def resume():
+        started = time.monotonic()
+        log = ConversationLog(path)
+        log.compact()
+        opened = time.monotonic() - started
+        context = await log.load("neo", budget=1000)
+        log.close()
+        return opened, context
+
+    opened, context = asyncio.run(resume())
+    assert opened < 0.2
+    assert [turn['content'] for turn in context.turns] == ["hello", "hi neo"]
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+AI response cache: LRU and TTL eviction, and the disk tier
+"""
+import asyncio
+import time
+
+from ai_client import ResponseCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+def test_least_recently_used_entry_is_evicted():
+    async def run():
+        cache = ResponseCache(max_entries=2, ttl=60)
+        await cache.put("a", "reply a", 1.0)
+        await cache.put("b", "reply b", 1.0)
+        assert await cache.get("a") == "reply a"  # Now "b" is the oldest
+        await cache.put("c", "reply c", 1.0)
+        return [await cache.get(key) for key in "abc"], cache.stats()
+
+    replies, stats = asyncio.run(run())
+    assert replies == ["reply a", None, "reply c"]
+    assert (stats['entries'], stats['hits'], stats['misses']) == (2, 3, 1)
+    assert stats['latency_saved'] == 3.0
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, 'time', clock)
+
+    async def run():
+        cache = ResponseCache(max_entries=10, ttl=60)
+        await cache.put("a", "reply a", 1.0)
+        clock.now += 59
+        fresh = await cache.get("a")
+        clock.now += 2
+        return fresh, await cache.get("a"), cache.stats()['entries']
+
+    assert asyncio.run(run()) == ("reply a", None, 0)
+
+
+def test_disk_tier_survives_a_restart_and_honours_the_ttl(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, 'time', clock)
+    path = str(tmp_path / 'cache' / 'responses.db')
+
+    async def run():
+        cache = ResponseCache(max_entries=10, ttl=60, path=path)
+        await cache.put("a", "reply a", 2.5)
+        cache.db.close()
+
+        restarted = ResponseCache(max_entries=10, ttl=60, path=path)
+        first = await restarted.get("a")
+        second = await restarted.get("a")  # From memory now
+        stats = restarted.stats()
+        clock.now += 61
+        restarted._entries.clear()
+        expired = await restarted.get("a")
+        restarted.db.close()
+        return first, second, stats, expired
+
+    first, second, stats, expired = asyncio.run(run())
+    assert first == second == "reply a"
+    assert (stats['hits'], stats['disk_hits'], stats['latency_saved']) == (2, 1, 5.0)
+    assert expired is None
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Search privacy: AI chats are only found by their own (named) handle, and only when saving them is on
+"""
+import asyncio
+
+from bbs_server import BBSHandler
+from search import SearchIndex
+from storage import BoardStore
+
+
+def seeded_index(tmp_path, chats=True):
+    store = BoardStore(str(tmp_path / 'bbs.db'), readers=1)
+    index = SearchIndex(str(tmp_path / 'search.db'), readers=1, store=store, chats=chats)
+
+    async def seed():
+        # A Guest chat logged before log_chat skipped them is still in the database
+        await store.log_chat("Guest", "my modem password", "Keep the modem password secret")
+        await store.log_chat("neo", "my modem password", "Neo's modem password stays private")
+        while await index.catch_up():
+            pass
+
+    asyncio.run(seed())
+    return store, index
+
+
+def chat_authors(index, handle):
+    rows, _ = asyncio.run(index.search("modem password", handle))
+    return [row['author'] for row in rows if row['kind'] == 'chat']
+
+
+def test_guest_does_not_find_other_guests_chats(tmp_path):
+    store, index = seeded_index(tmp_path)
+    try:
+        assert chat_authors(index, "Guest") == []
+        assert chat_authors(index, "neo") == ["neo"]
+    finally:
+        index.close()
+        store.close()
+
+
+def test_chats_are_not_searchable_unless_saving_is_on(tmp_path):
+    store, index = seeded_index(tmp_path, chats=False)
+    try:
+        assert chat_authors(index, "neo") == []  # Anyone can log in as "neo"
+    finally:
+        index.close()
+        store.close()
+
+
+def test_guest_chats_are_not_logged(monkeypatch):
+    logged = []
+
+    class Store:
+        async def log_chat(self, handle, question, answer):
+            logged.append(handle)
+
+    class Index:
+        def notify(self):
+            pass
+
+    monkeypatch.setattr('bbs_server.get_store', lambda: Store())
+    monkeypatch.setattr('bbs_server.get_search', lambda: Index())
+    handler = BBSHandler.__new__(BBSHandler)
+    handler.session_id = 1
+    for save in (False, True):
+        monkeypatch.setattr('bbs_server.SAVE_CHATS', save)
+        for handle in ("Guest", "neo"):
+            handler.username = handle
+            asyncio.run(handler.log_chat("question", "answer"))
+    assert logged == ["neo"]  # Only once saving was on
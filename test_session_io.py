@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Session I/O: telnet parsing and decoding across reads, output batching
+"""
+import zlib
+
+from session_io import DO, IAC, SB, SE, WILL, InputDecoder, OutputBuffer, StreamCompressor, TelnetParser
+
+NAWS = 31  # Window size option
+
+
+def feed_bytewise(parser, data):
+    return b"".join(parser.feed(data[i:i + 1]) for i in range(len(data)))
+
+
+def test_commands_are_stripped_even_when_split_across_chunks():
+    commands = []
+    stream = (b"he" + bytes([IAC, WILL, NAWS]) + b"ll" + bytes([IAC, 241]) + b"o"
+              + bytes([IAC, SB, NAWS, 0, 80, 0, 24, IAC, SE]) + b"!")
+    assert feed_bytewise(TelnetParser(lambda *command: commands.append(command)), stream) == b"hello!"
+    assert commands == [(WILL, NAWS), (241, None), (SB, bytes([NAWS, 0, 80, 0, 24]))]
+
+
+def test_escaped_iac_is_data_inside_and_outside_subnegotiation():
+    commands = []
+    parser = TelnetParser(lambda *command: commands.append(command))
+    assert parser.feed(bytes([1, IAC])) == bytes([1])
+    assert parser.feed(bytes([IAC, 2, IAC, SB, 24, IAC])) == bytes([IAC, 2])
+    assert parser.feed(bytes([IAC, 7, IAC, SE, DO])) == bytes([DO])
+    assert commands == [(SB, bytes([24, IAC, 7]))]
+
+
+def test_utf8_character_split_across_reads():
+    decoder = InputDecoder(telnet=False)
+    data = "Привет".encode('utf-8')
+    decoder.feed(data[:3])
+    assert decoder.read() == "П"
+    decoder.feed(data[3:])
+    assert decoder.read() == "ривет"
+
+
+def test_crlf_split_across_reads_is_one_enter():
+    decoder = InputDecoder()
+    decoder.feed(b"yes\r")
+    decoder.feed(b"\nno\r\0")
+    assert decoder.read() == "yes\rno\r"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_frames_inside_the_batch_window_wait_for_it():
+    clock = Clock()
+    output = OutputBuffer(batch_delay=0.025, clock=clock)
+    output.write("frame 1")
+    assert output.frame_delay() == 0.0  # Nothing went out recently
+    assert output.take() == b"frame 1"
+    clock.now += 0.01
+    output.write("frame 2\n")
+    output.write(b"\xff\xf9")
+    assert abs(output.frame_delay() - 0.015) < 1e-9
+    clock.now += 0.015
+    assert output.frame_delay() == 0.0
+    assert output.take() == b"frame 2\r\n\xff\xf9"  # One write, encoded once
+    assert output.stats()['messages'] == 3 and output.stats()['writes'] == 2
+
+
+def test_write_reports_the_high_water_mark():
+    output = OutputBuffer(high_water=10)
+    assert not output.write("12345")
+    assert output.write("67890")
+    output.take()
+    assert not output.pending()
+    assert not output.write("1")
+
+
+def test_output_before_the_compression_start_stays_plain():
+    output = OutputBuffer()
+    output.write("plain\n")
+    output.start_compression(StreamCompressor())
+    output.write("squeezed " * 20)
+    data = output.take()
+    plain = b"plain\r\n" + StreamCompressor.START
+    assert data.startswith(plain)
+    inflate = zlib.decompressobj()
+    assert inflate.decompress(data[len(plain):]) == b"squeezed " * 20
+    output.write("more")
+    assert inflate.decompress(output.take()) == b"more"  # Same stream, sync-flushed per take
+    inflate.decompress(output.end_compression())
+    assert inflate.eof
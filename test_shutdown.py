@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Shutdown: a worker stopped with SIGTERM still writes out its logs
+"""
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from loadgen import CHOICE, HANDLE, TelnetCaller, wait_for_port
+from mock_openrouter import MockOpenRouter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def worker_pid(supervisor_pid, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with open(f"/proc/{supervisor_pid}/task/{supervisor_pid}/children") as f:
+            children = f.read().split()
+        if children:
+            return int(children[0])
+        time.sleep(0.1)
+    raise AssertionError("supervisor started no worker")
+
+
+async def chat_then_terminate(port, mock_port, cwd, supervisor=False, drain_seconds=7):
+    """Run one AI turn as bob, then SIGTERM the worker (or the supervisor) while bob is still online
+
+    Returns the seconds from the signal until bob was hung up on.
+    """
+    mock = MockOpenRouter(latency='0.05', token_delay=0, reply_tokens=5)
+    mock_port = await mock.start('127.0.0.1', mock_port)
+    env = dict(os.environ, BBS_SUPERVISOR='1', BBS_WORKERS='1',
+               BBS_PORT=str(port), SSH_PORT=str(free_port()),
+               AI_BASE_URL=f"http://127.0.0.1:{mock_port}/api/v1", OPENROUTER_API_KEY='mock',
+               AI_PREWARM_CONNECTIONS='0', BBS_SAVE_CHATS='1', BBS_CONVERSATIONS_FLUSH='60',
+               BBS_STOP_DRAIN_SECONDS=str(drain_seconds))
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, 'bbs_server.py')], env=env, cwd=cwd,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        assert await asyncio.to_thread(wait_for_port, '127.0.0.1', port)
+        caller = TelnetCaller(timeout=20)
+        await caller.connect('127.0.0.1', port)
+        await caller.expect(HANDLE)
+        await caller.send("bob\r")
+        await caller.expect(CHOICE)
+        await caller.send("1\r")
+        await caller.expect(b"bob>")
+        await caller.send("hello from bob\r")
+        await caller.expect(b"AI>")
+        await caller.expect(b"bob>")
+
+        worker = worker_pid(server.pid)
+        signaled = time.monotonic()
+        os.kill(server.pid if supervisor else worker, signal.SIGTERM)
+        await caller.expect(b"shutting down")
+        await caller.expect_eof()
+        hung_up = time.monotonic() - signaled
+        await caller.close()
+        if not supervisor:
+            server.terminate()
+        await asyncio.to_thread(server.wait, 20)
+        return hung_up
+    finally:
+        if server.poll() is None:
+            server.kill()
+        await mock.close()
+
+
+def test_sigterm_writes_out_the_conversation_log(tmp_path):
+    asyncio.run(chat_then_terminate(free_port(), 0, str(tmp_path)))
+
+    with open(tmp_path / 'data' / 'conversations.log', encoding='utf-8') as f:
+        log = f.read()
+    assert "hello from bob" in log
+
+
+def test_sigterm_writes_out_the_event_log(tmp_path):
+    asyncio.run(chat_then_terminate(free_port(), 0, str(tmp_path)))
+
+    with open(tmp_path / 'logs' / 'bbs.jsonl', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    events = [record['event'] for record in records]
+    assert 'ai.turn' in events
+    assert events[-2:] == ['shutdown', 'disconnect']  # The port probe disconnected earlier
+    assert records[-1]['handle'] == "bob"
+
+
+def test_stopping_the_supervisor_lets_callers_finish(tmp_path):
+    hung_up = asyncio.run(chat_then_terminate(free_port(), 0, str(tmp_path), supervisor=True, drain_seconds=2))
+    assert 1.5 < hung_up < 5  # Counted down for BBS_STOP_DRAIN_SECONDS instead of cut off at once
+
+    with open(tmp_path / 'logs' / 'bbs.jsonl', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    drains = [record for record in records if record['event'] == 'drain']
+    assert [(d['reason'], d['seconds']) for d in drains] == [('stop', 2)]
+    assert records[-1]['event'] == 'drained'
+    with open(tmp_path / 'data' / 'conversations.log', encoding='utf-8') as f:
+        assert "hello from bob" in f.read()
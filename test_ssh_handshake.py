@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+SSH handshakes: a thread still running after its wait timed out stays counted
+"""
+import asyncio
+import socket
+import threading
+
+import bbs_server
+import ssh_transport
+
+
+def test_timed_out_handshake_counts_until_its_thread_ends(monkeypatch):
+    release = threading.Event()
+
+    def stuck_handshake(transport, host_keys, deadline):
+        release.wait(5)  # A client trickling its key exchange
+        return None
+
+    monkeypatch.setattr(ssh_transport, 'ssh_handshake', stuck_handshake)
+    monkeypatch.setattr(bbs_server, 'SSH_HANDSHAKE_TIMEOUT', 0.1)
+    monkeypatch.setattr(bbs_server, 'release_connection', lambda ip: None)
+    monkeypatch.setitem(bbs_server.ssh_stats, 'pending', 0)
+
+    async def run():
+        ours, theirs = socket.socketpair()
+        try:
+            await bbs_server.handle_ssh_connection(ours, host_keys=[])
+            assert bbs_server.ssh_stats['pending'] == 1  # The wait gave up, the thread did not
+            release.set()
+            for _ in range(100):
+                if bbs_server.ssh_stats['pending'] == 0:
+                    break
+                await asyncio.sleep(0.01)
+            assert bbs_server.ssh_stats['pending'] == 0
+        finally:
+            release.set()
+            theirs.close()
+
+    asyncio.run(run())
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+AI reply streaming: tokens reach the caller on time, and a cut-off reply is kept
+"""
+import asyncio
+from types import SimpleNamespace
+
+import ai_client
+from ai_client import ChatSession
+from ai_scheduler import AIScheduler
+from bbs_server import AI_STREAM_RENDER_INTERVAL, BBSHandler
+
+
+class Writer:
+    """Records what reaches the transport and when"""
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append((asyncio.get_running_loop().time(), data))
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+    def received(self):
+        return b"".join(data for _, data in self.writes)
+
+
+class StallingSession:
+    """Sends two tokens back to back, then stalls before the last one"""
+
+    def __init__(self, stall):
+        self.stall = stall
+
+    def queue_position(self):
+        return None
+
+    async def stream_chat(self, message):
+        yield "Hello"
+        yield " there"
+        await asyncio.sleep(self.stall)
+        yield "!"
+
+
+def test_token_inside_the_window_goes_out_during_a_stall():
+    async def run():
+        writer = Writer()
+        handler = BBSHandler(asyncio.StreamReader(), writer, ('127.0.0.1', 1), is_ssh=True)
+        handler.username = "Guest"  # Not logged, so no store is needed
+        handler.ai_session = StallingSession(stall=1.0)
+        task = asyncio.create_task(handler.stream_ai_reply("hi"))
+        await asyncio.sleep(AI_STREAM_RENDER_INTERVAL * 3)
+        assert b"Hello there" in writer.received()  # Not held back until "!" arrives
+        await task
+        assert writer.received().endswith(b"Hello there!")
+
+    asyncio.run(run())
+
+
+class Stream:
+    """A streamed completion that sends ``tokens`` and then hangs"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.closed = False
+
+    async def __aiter__(self):
+        for token in self.tokens:
+            yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+        await asyncio.Event().wait()
+
+    async def close(self):
+        self.closed = True
+
+
+class Client:
+    context_model = 'mock'
+    cache = None
+
+    def __init__(self, stream):
+        self.scheduler = AIScheduler(concurrency=1, deadline=10)
+        self.stream = stream
+
+    def cache_key(self, messages):
+        return None
+
+    async def create(self, messages, stream=False, hedge=False):
+        return 'mock', self.stream, False
+
+
+def test_hanging_up_mid_reply_keeps_the_partial_reply(monkeypatch):
+    turns = []
+    monkeypatch.setattr(ai_client, 'log_event', lambda event, session=None, **fields: turns.append(fields))
+
+    async def run():
+        stream = Stream(["Half ", "an answer"])
+        session = ChatSession(Client(stream), handle="neo")
+        reply = session.stream_chat("question")
+        assert [await anext(reply), await anext(reply)] == ["Half ", "an answer"]
+        await reply.aclose()  # The caller hung up
+        assert stream.closed
+        return session
+
+    session = asyncio.run(run())
+    assert session.conversation_history[-1] == {"role": "assistant", "content": "Half an answer"}
+    assert [(t['outcome'], t['reply_chars']) for t in turns] == [('disconnected', len("Half an answer"))]